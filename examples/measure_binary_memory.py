@@ -0,0 +1,88 @@
+"""Measures the memory taken by the decoded element trees of binary documents, per node, for
+the SI given as an argument (examples/SI.bin by default) and a large synthetic PI, with the
+nodes laid out in slots and, for comparison, in a per-instance dict with lists for every element"""
+
+import contextlib
+import datetime
+import os
+import sys
+import tracemalloc
+
+import spi.binary
+from spi import *
+from spi.binary import Element, marshall
+
+NODE_CLASSES = ('Element', 'Attribute', 'CData')
+
+def unslotted(cls):
+    """returns a copy of a node class keeping its attributes in a per-instance dict rather than in
+       slots. Copied elements start with their own attribute and children lists rather than sharing
+       the empty tuple"""
+    body = dict((k, v) for k, v in vars(cls).items() if k not in cls.__slots__ and k not in ('__slots__', '__dict__', '__weakref__'))
+    if cls is Element:
+        init = cls.__init__
+        def __init__(self, tag, attributes=None, children=None, cdata=None):
+            init(self, tag, attributes if attributes is not None else [], children if children is not None else [], cdata)
+        body['__init__'] = __init__
+    return type(cls.__name__, (object,), body)
+
+@contextlib.contextmanager
+def dict_layout():
+    """decodes with unslotted copies of the node classes while in effect"""
+    classes = dict((name, getattr(spi.binary, name)) for name in NODE_CLASSES)
+    for name, cls in classes.items(): setattr(spi.binary, name, unslotted(cls))
+    try:
+        yield
+    finally:
+        for name, cls in classes.items(): setattr(spi.binary, name, cls)
+
+def count_nodes(e):
+    """returns the number of elements, attributes and CData in a decoded element tree"""
+    count = 1 + len(e.attributes) + (e.cdata is not None)
+    for child in e.children:
+        count += count_nodes(child)
+    return count
+
+def read_document(path):
+    """reads an encoded document, undoing the UTF-8 encoding that the bytes of SI.bin have been 
+       written out with"""
+    with open(path, 'rb') as f: data = f.read()
+    try: 
+        Element.frombuffer(data)
+        return data
+    except ValueError:
+        return data.decode('utf-8').encode('latin-1')
+
+def decoded_size(data):
+    """returns the number of bytes allocated decoding a document, and its number of nodes"""
+    tracemalloc.start()
+    e = spi.binary.Element.frombuffer(data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, count_nodes(e)
+
+def measure(name, data):
+    with dict_layout():
+        before, nodes = decoded_size(data)
+    size, nodes = decoded_size(data)
+    print('%-24s %10d bytes %8d nodes %12d bytes %8.1f bytes per node (%.1f with dicts)' % (name, len(data), nodes, size, size / nodes, before / nodes))
+
+def synthetic_programmeinfo(days=7, services=10):
+    start = datetime.datetime(2014, 4, 25, 6, 0, tzinfo=datetime.timezone.utc)
+    schedule = Schedule(Scope(start, start + datetime.timedelta(days=days)), created=start)
+    for i in range(days * 24 * services):
+        programme = Programme('crid://www.capitalfm.com/4772/%d' % i, i + 1)
+        programme.names.append(ShortName('Show %d' % (i % 100)))
+        programme.names.append(MediumName('Capital Show %d' % (i % 100)))
+        programme.names.append(LongName('Capital Breakfast with Roman Kemp %d' % i))
+        programme.descriptions.append(ShortDescription('Forget the coffee, Capital gives you the perfect morning pick-me-up'))
+        programme.media.append(Multimedia('http://owdo.thisisglobal.com/2.0/id/25/logo/32x32.png', Multimedia.LOGO_COLOUR_SQUARE))
+        location = Location(times=[Time(start + datetime.timedelta(hours=i // services), datetime.timedelta(hours=1))])
+        location.bearers.append(DabBearer(0xe1, 0xc185, 0xc0da + i % services))
+        programme.locations.append(location)
+        schedule.programmes.append(programme)
+    return marshall(ProgrammeInfo(schedules=[schedule])).tobytes()
+
+path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'SI.bin')
+measure(os.path.basename(path), read_document(path))
+measure('synthetic PI', synthetic_programmeinfo())
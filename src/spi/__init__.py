@@ -200,7 +200,9 @@ class DabBearer(DigitalBearer):
         dab:<gcc>.<eid>.<sid>.<scids>.<xpad> in hex
         :: 
 
-        Where ``gcc`` is a combination of the first nibble of the EId and the ECC.
+        Where ``gcc`` is a combination of the first nibble of the EId and the ECC. A bearer of a
+        binary document may have neither, being on the same ensemble as the document, and then
+        has no URI.
 
         For example:
         ::
@@ -226,8 +228,9 @@ class DabBearer(DigitalBearer):
         self.scids = scids
         self.xpad = xpad
 
-        if not isinstance(ecc, int): raise ValueError("ECC must be an integer")
-        if not isinstance(eid, int): raise ValueError("EId must be an integer")
+        if (ecc is None) != (eid is None): raise ValueError("ECC and EId must both be given, or neither")
+        if ecc is not None and not isinstance(ecc, int): raise ValueError("ECC must be an integer")
+        if eid is not None and not isinstance(eid, int): raise ValueError("EId must be an integer")
         if not isinstance(sid, int): raise ValueError("SId must be an integer")
         if not isinstance(scids, int): raise ValueError("SCIdS must be an number")
         if xpad and not isinstance(xpad, int): raise ValueError("XPAD AppType must be an integer")
@@ -251,12 +254,14 @@ class DabBearer(DigitalBearer):
         return DabBearer(ecc, eid, sid, scids, xpad)
     
     def __str__(self):
+        if self.ecc is None: raise ValueError('bearer on the same ensemble has no URI: SId %04x' % self.sid)
         uri = 'dab:{gcc:03x}.{eid:04x}.{sid:04x}.{scids:01x}'.format(gcc=(self.eid >> 4 & 0xf00) + self.ecc, eid=self.eid, sid=self.sid, scids=self.scids)
         if self.xpad is not None:
             uri += '.{xpad:04x}'.format(xpad=self.xpad)
         return uri
 
     def __repr__(self):
+        if self.ecc is None: return '<DabBearer: same ensemble, SId %04x, SCIdS %x>' % (self.sid, self.scids)
         return '<DabBearer: %s>' % str(self)
             
 class HdBearer(DigitalBearer):
@@ -1,1265 +1,3599 @@
-from spi import *
-
-from bitarray import bitarray, bits2bytes
-import math
-import datetime, dateutil.tz
-import logging
-import sys
-from datetime import timedelta
-
-logger = logging.getLogger("spi.binary")
-
-class Ensemble:
-    """
-    Describes a DAB ensemble 
-    
-    :param ecc: Extended Country Code (ECC) 
-    :type ecc: integer
-    :param eid: Ensemble ID (EId)
-    :type eid: integer
-    :param version: Description version 
-    :type version: integer
-    """
-    
-    def __init__(self, ecc, eid, version=1):
-        self.ecc = ecc
-        self.eid = eid
-        self.names = []
-        self.descriptions = []
-        self.media = []
-        self.keywords = []
-        self.links = []
-        self.services = []
-        self.frequencies = []
-        self.version = version
-        
-    def __str__(self):
-        return "%02x.%04x" % (self.ecc, self.eid) 
-    
-    def __repr__(self):
-        return '<Ensemble: %s>' % str(self)
-    
-
-class Element:
-    
-    def __init__(self, tag, attributes=None, children=None, cdata=None):
-        self.tag = tag
-        self.attributes = (attributes if attributes is not None else [])
-        self.children = (children if children is not None else [])
-        self.cdata = cdata
-        logger.debug('created new element: %s', self)
-        
-    def tobytes(self):
-        logger.debug('rendering element %s', repr(self))
-        data = bitarray()
-
-        # encode attributes
-        for attribute in self.attributes: 
-            logger.debug('rendering attribute: %s', attribute)
-            try: data += attribute.tobytes()
-            except Exception as e: 
-                raise ValueError('error rendering attribute %s of %s: %s' % (attribute, self, str(e))).with_traceback(sys.exc_info()[2]) 
-
-        # encode children
-        for child in self.children: 
-            logger.debug('rendering child element: %s', child)
-            try: data += child.tobytes()
-            except: 
-                logger.exception('error rendering child %s of %s', child, self)
-                raise
-
-        # encode CData
-        if self.cdata is not None: 
-            logger.debug('rendering cdata: %s', self.cdata)
-            data += self.cdata.tobytes()
-        
-        # b0-b7: element tag
-        bits = encode_number(self.tag, 8)
-  
-        # b8-15: element data length (0-253 bytes)
-        # b16-31: extended element length (256-65536 bytes)
-        # b16-39: extended element length (65537-16777216 bytes)
-        datalength = len(data)/8
-        if datalength == 0:
-            raise ValueError('element data length is zero')
-        if datalength <= 253:
-            bits += encode_number(datalength, 8)
-        elif datalength >= 254 and datalength <= 1<<16:
-            bits += encode_number(0xfe, 8)
-            bits += encode_number(datalength, 16)
-        elif datalength > 1<<16 and datalength <= 1<<24: 
-            bits += encode_number(0xff, 8)
-            bits += encode_number(datalength, 24)
-        else: raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %s > %s' + datalength + " > " + (1<<24))
-        logger.debug('element %s is rendered with data length: %d bytes: %s', repr(self), datalength, bitarray_to_hex(bits))         
-        bits += data
-        return bits
-    
-    def __iter__(self):
-        return iter(self.children)
-    
-    def has_child(self, tag):
-        return len(self.get_children(tag))
-    
-    def get_children(self, tag=None):
-        if tag is not None:
-            return [x for x in self.children if x.tag == tag]
-        return self.children
-    
-    def has_attribute(self, tag):
-        return len(self.get_attributes(tag))
-    
-    def get_attributes(self, tag=None):
-        if tag is not None:
-            return [x for x in self.attributes if x.tag == tag]
-        return self.attributes    
-    
-    @staticmethod
-    def frombits(bits):
-        
-        # b0-b7: element tag
-        tag = int(bits[0:8].to01(), 2)
-        if tag < 0x02 or tag > 0x36: raise ValueError('invalid value for tag: 0x%02x' % tag)
-               
-        # b8-15: element data length (0-253 bytes)
-        # b16-31: extended element length (256-65536 bytes)
-        # b16-39: extended element length (65537-16777216 bytes)
-        datalength = int(bits[8:16].to01(), 2)
-        start = 16
-        if datalength == 0xfe:
-            datalength = int(bits[start:start+16].to01(), 2)
-            start += 16 
-        elif datalength == 0xff:
-            datalength = int(bits[start:start+24].to01(), 2)
-            start += 24 
-        data = bits[start : start + (datalength * 8)]
-                
-        i = 0
-        e = Element(tag)
-        logger.debug('parsing data of length %d bytes for element with tag 0x%02x', datalength, tag)
-        while i < data.length():
-            logger.debug('now parsing at offset %d / %d', i/8, data.length()/8)
-            child_tag = int(data[i:i+8].to01(), 2)            
-            child_datalength = int(data[i+8:i+16].to01(), 2)
-            start = 16
-            if child_datalength == 0xfe:
-                child_datalength = int(data[i+16:i+32].to01(), 2)
-                start = 32
-            elif child_datalength == 0xff: 
-                child_datalength = int(data[i+16:i+40].to01(), 2)
-                start = 40
-            logger.debug('child with tag 0x%02x for parent tag 0x%02x at offset %d has data length of %d bytes', child_tag, tag, i/8, child_datalength)
-            end = start + (child_datalength * 8)
-            if i + end > data.length():
-                raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d: %s' % (child_tag, i/8, (i + end)/8, data.length() / 8, bitarray_to_hex(data[i:i+64])))
-            child_data = data[i + start : i + end] 
-            if child_data.length() < 16*8: logger.debug('child element with tag 0x%02x for parent 0x%02x has data: %s', child_tag, tag, bitarray_to_hex(child_data))
-                
-            # attributes
-            if child_tag >= 0x80 and child_tag <= 0x87:
-                logger.debug('parsing child as an attribute')
-                attribute = Attribute.frombits(tag, data[i:i+end])
-                logger.debug('parsed child as an attribute: %s', attribute)
-                e.attributes.append(attribute)
-            # token table
-            elif child_tag == 0x04:
-                logger.debug('parsing child as a token table')
-                tokens = decode_tokentable(child_data)
-                e.tokens = tokens
-                logger.debug('parsed token table: %s', tokens)
-            # default content ID
-            elif child_tag == 0x05:
-                logger.debug('parsing child as a default content ID')
-                default_contentid = decode_contentid(child_data)
-                e.default_contentid = default_contentid
-            # default language
-            elif child_tag == 0x06: 
-                logger.debug('parsing child as a default language (not yet implemented)')
-                pass               
-            # children
-            elif child_tag >= 0x02 and child_tag <= 0x36:
-                logger.debug('parsing child as an element')
-                child = Element.frombits(data[i:i+end])
-                child.parent = e
-                logger.debug('parsed child as an element: %s', child)
-                e.children.append(child)
-            # cdata
-            elif child_tag == 0x01:
-                logger.debug('parsing child as CDATA')
-                cdata = CData.frombits(data[i:i+end])
-                logger.debug('parsed CDATA: %s', cdata)
-                e.cdata = cdata
-            else:
-                raise ValueError('unknown element 0x%02x under parent 0x%02x' % (child_tag, tag))
-            
-            i += end
-            
-        return e
-        
-    def __str__(self):
-        return 'tag=0x%02X, attributes=%s, children=%s, cdata=%s' % (self.tag, self.attributes, self.children, self.cdata)
-    
-    def __repr__(self):
-        return '<Element: 0x%02X>' % self.tag
-        
-class Attribute:
-    
-    def __init__(self, tag, value, f=None, *args, **kwargs):
-        if not isinstance(tag, int): raise ValueError('tag must be an integer')
-        self.tag = tag
-        self.value = value
-        self.f = f
-        self.args = args
-        self.kwargs = kwargs
-        logger.debug('created new attribute: %s', repr(self))
-    
-    def tobytes(self):
-
-        if not self.f: raise ValueError('cant encode this attribute without an encoding function')
-
-        # encode data
-        data = None
-        logger.debug('encoding attribute %s with function %s', self, self.f) 
-        data = self.f(self.value, *self.args, **self.kwargs)
-
-        # b0-b7: tag
-        bits = encode_number(self.tag, 8)
-  
-        # b8-15: element data length (0-253 bytes)
-        # b16-31: extended element length (256-65536 bytes)
-        # b16-39: extended element length (65537-16777216 bytes)
-        datalength = bits2bytes(data.length())
-        if datalength <= 253:
-            bits += encode_number(datalength, 8)
-        elif datalength >= 254 and datalength <= 1<<16:
-            tmp = bitarray()
-            tmp.fromstring('\xfe')
-            bits += tmp
-            bits += encode_number(datalength, 16)
-        elif datalength > 1<<16 and datalength <= 1<<24: 
-            tmp = bitarray()
-            tmp.fromstring('\xff')
-            bits += tmp
-            bits += encode_number(datalength, 24)
-        else: raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %s > %s' + datalength + " > " + (1<<24))
-                
-        bits += data
-        return bits
-    
-    @staticmethod
-    def frombits(parent, bits):
-        
-        # b0-b7: attribute tag
-        tag = int(bits[0:8].to01(), 2)
-        
-        # b8-15: attribute data length (0-253 bytes)
-        # b16-31: extended attribute length (256-65536 bytes)
-        # b16-39: extended attribute length (65537-16777216 bytes)
-        datalength = int(bits[8:16].to01(), 2)
-        start = 16
-        if datalength >= 254 and datalength <= 1<<16:
-            datalength = int(bits[16:32].to01(), 2)
-            start = 32
-        elif datalength > 1<<16 and datalength <= 1<<24: 
-            datalength = int(bits[16:40].to01(), 2)
-            start = 40
-        elif datalength > 1<<24:
-            raise ValueError('attribute data length exceeds the maximum allowed by the extended attribute length (24bits): %s > %s' + datalength + " > " + (1<<24))
-        data = bits[start:start+(datalength * 8)]
-                
-        # decode data
-        if isinstance(parent, Element): parent_tag = parent.tag
-        else: parent_tag = int(parent)
-        if (parent_tag, tag) in [ # integer 
-                (0x02, 0x80), (0x21, 0x80), (0x23, 0x80), (0x23, 0x81), (0x23, 0x82), (0x23, 0x84), (0x25, 0x80),
-                (0x1c, 0x81), (0x1c, 0x82), (0x1c, 0x87), (0x17, 0x81), (0x17, 0x82), (0x03, 0x80), (0x26, 0x81),
-                (0x2b, 0x84), (0x2b, 0x85), (0x2e, 0x81)
-        ]: 
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as int', parent_tag, tag)
-            value = int(data.to01(), 2)
-        elif (parent_tag, tag) in [ # string
-                (0x14, 0x80), (0x17, 0x80), (0x18, 0x80), (0x18, 0x83), (0x1c, 0x80), (0x20, 0x80), (0x20, 0x82), 
-                (0x21, 0x82), (0x03, 0x82), (0x03, 0x83), (0x2b, 0x80), (0x2b, 0x82), (0x2e, 0x80), (0x31, 0x80), 
-                (0x31, 0x81), (0x29, 0x82), (0x18, 0x81), (0x18, 0x83), (0x10, 0x80), (0x11, 0x80), (0x12, 0x80),
-                (0x20, 0x86), (0x2a, 0x80), (0x2b, 0x81), (0x1a, 0x80), (0x1b, 0x80), (0x06, 0x80)
-        ]:
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as string', parent_tag, tag)
-            value = data.tobytes().decode()
-        elif (parent_tag, tag) in [(0x2c, 0x81), (0x2c, 0x83), (0x2f, 0x80), (0x2f, 0x81)]: # duration
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as duration', parent_tag, tag)
-            value = datetime.timedelta(seconds=int(data.to01(), 2))
-        elif (parent_tag, tag) in []: # genre
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as genre', parent_tag, tag)
-            value = decode_genre(data)
-        elif (parent_tag, tag) in [(0x20, 0x81), (0x21, 0x81), (0x24, 0x80), (0x24, 0x81), (0x2c, 0x80), (0x2c, 0x82),
-                                   (0x03, 0x81)]: # time
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as timepoint', parent_tag, tag)
-            value = decode_timepoint(data)
-        elif (parent_tag, tag) in [(0x25, 0x80), (0x26, 0x80), (0x29, 0x80), (0x2d, 0x80)]: # content ID
-            logger.debug('decoding tag/attribute 0x%02x/0x%02x as ContentId', parent_tag, tag)
-            return Attribute(tag, decode_contentid(data))
-        elif (parent_tag, tag) in [(0x1c, 0x83), (0x1c, 0x84), (0x03, 0x84), (0x2b, 0x83), (0x2e, 0x83), (0x2e, 0x84)]: # ENUM
-            try:
-                value = decode_enum(parent_tag, tag, data)
-            except:
-                logger.warning('error decoding enum for parent 0x%02x from tag: 0x%02x - IGNORING for now' % (parent_tag, tag))
-                value = data
-        else:
-            raise ValueError('dont know how to decode attribute value for parent 0x%02x from tag: 0x%02x' % (parent_tag, tag))
-        
-        return Attribute(tag, value)
-    
-    def __str__(self):
-        return str('0x%x' % self.tag)
-    
-    def __repr__(self):
-        return '<Attribute: tag=0x%02X, value=%s>' % (self.tag, self.value) 
-    
-genre_map = dict(
-    IntentionCS=1,
-    FormatCS=2,
-    ContentCS=3, # what happened to 4?!
-    OriginationCS=5,
-    ContentAlertCS=6,
-    MediaTypeCS=7,
-    AtmosphereCS=8
-)
-    
-def encode_genre(genre):
-    
-    segments = genre.href.split(':')
-    if len(segments) < 6: raise ValueError('genre is incorrectly formatted: %s' % genre)
-    
-    bits = bitarray(4)
-    bits.setall(False)
-    
-    # b0-3: RFU(0)
-    # b4-7: CS
-    cs = segments[4]
-    if cs in list(genre_map.keys()): cs_val = genre_map[cs]
-    else: raise ValueError('unknown CS in genre: %s' % cs)
-    bits += encode_number(cs_val, 4)
-    
-    # optional schema levels
-    if len(segments) >= 6:
-        levels = segments[6].split('.')
-        for level in levels:
-            bits += encode_number(int(level), 8)
-        
-    return bits
-
-def decode_genre(bits):
-    
-    # b4-7: CS
-    cs_val = int(bits[4:8].to01(), 2)
-    if cs_val in list(genre_map.values()): cs = [x[0] for x in list(genre_map.items()) if x[1] == cs_val]
-    else: raise ValueError('unknown CS value for genre: %d' % cs_val)
-    
-    level = '%d' % cs_val
-    
-    # optional schema levels
-    if bits.length() > 8:
-        i = 8
-        while i < bits.length():
-            sublevel = int(bits[i:i+8].to01(), 2)
-            level += '.%d' % sublevel
-            i += 8
-    
-    return Genre('urn:tva:metadata:cs:ContentCS:2002:%s' % level)
-
-def encode_string(s):
-    b = bitarray()
-    b.frombytes(s.encode())
-    return b
-    
-def encode_timepoint(timepoint):
-    
-    if timepoint.tzinfo is None:
-        UTC = datetime.timezone.utc
-        timepoint = timepoint.replace(tzinfo=UTC)
-    bits = bitarray(1)
-    bits.setall(False)
-    tz_offset = timepoint.utcoffset() if timepoint.utcoffset() is not None else datetime.timedelta(0)
-    tz_dst = timepoint.dst() if timepoint.dst() is not None else datetime.timedelta(0)
-    offset = (tz_offset.days * 86400 + tz_offset.seconds) + (tz_dst.days * 86400 + tz_dst.days)
-    timepoint = timepoint - timedelta(seconds=offset)
-    
-    # b0: RFA(0)
-        
-    # b1-17: Date
-    a = (14 - timepoint.month) / 12
-    y = timepoint.year + 4800 - a
-    m = timepoint.month + (12 * a) - 3
-    jdn = timepoint.day + ((153 * m) + 2) / 5 + (365 * y) + (y / 4) - (y / 100) + (y / 400) - 32045
-    jd = jdn + timepoint.hour / 24 + timepoint.minute / 1440 + timepoint.second / 86400
-    mjd = (int)(jd - 2400000.5)
-    bits += encode_number(mjd, 17)
-        
-    # b18: RFA(0)
-    bits += bitarray('0')
-        
-    # b19: LTO Flag
-    if timepoint.tzinfo is None or (timepoint.utcoffset().days == 0 and timepoint.utcoffset().seconds == 0):
-        bits += bitarray('0')
-    else:
-        bits += bitarray('1')
-        
-    # b20: UTC Flag
-    # b21: UTC - 11 or 27 bits depending on the form
-    if timepoint.second > 0:
-        bits += bitarray('1')
-        bits += encode_number(timepoint.hour, 5)
-        bits += encode_number(timepoint.minute, 6)
-        bits += encode_number(timepoint.second, 6)
-        bits += bitarray('0' * 10)
-    else:
-        bits += bitarray('0')
-        bits += encode_number(timepoint.hour, 5)
-        bits += encode_number(timepoint.minute, 6)
-        
-    # b32/48: LTO
-    if bits[19]:
-        bits += bitarray('00') # b49-50: RFA(0)
-        bits += bitarray('0' if offset > 0 else '1') # b51: LTO sign
-        bits += encode_number(offset / (60 * 60) * 2, 5) # b52-56: Half hours
-            
-    return bits
-
-def decode_timepoint(bits):
-    
-    if not bits.any(): return None # NOW
-    
-    mjd = int(bits[1:18].to01(), 2)
-    date = datetime.datetime.fromtimestamp((mjd - 40587) * 86400)
-    timepoint = datetime.datetime.combine(date, datetime.time())
-
-    # parse timezone
-    if bits[19]:
-        sign = bits[-6]
-        half_hours = int(bits[-5:].to01(), 2)
-        timezone = dateutil.tz.tzoffset(None, half_hours * 30 * 60 * (-1 if sign else 1))
-    else:
-        timezone = dateutil.tz.tzutc()
-
-    # parse date with UTC short form or long form
-    if bits[20]:
-        timepoint = timepoint.replace(hour=int(bits[21:26].to01(), 2),
-                                      minute=int(bits[26:32].to01(), 2),
-                                      second=int(bits[32:38].to01(), 2),
-                                      microsecond=int(bits[38:48].to01(), 2) * 1000,
-                                      tzinfo=timezone)
-    else:
-        timepoint = timepoint.replace(hour=int(bits[21:26].to01(), 2), 
-                                      minute=int(bits[26:32].to01(), 2),
-                                      tzinfo=timezone)
-        
-    return timepoint
-
-def encode_bearer(bearer):
-
-    if isinstance(bearer, DabBearer):
-        bits = bitarray(4)
-        bits.setall(False)
-    
-        # b0: RFA(0)
-        
-        # b1: Ensemble Flag. Indicates whether ECC and EId are contained with the
-        # Content ID.
-        # 0 = ECC and EId are not present. The service that is referenced within the
-        # contentID is transmitted on the same ensemble as this EPG service
-        # 1 = ECC and EId are present.
-        if bearer.ecc is not None and bearer.eid is not None: bits[1] = True
-
-        # b2: X-PAD flag. Indicates whether the addressed component is carried in an
-        # X-PAD channel.
-        # 0 = Is not carried in an X-PAD channel.
-        # 1 = Is carried in an X-PAD channel.
-        if bearer.xpad is not None: bits[2] = True
-        
-        # b3: SId encoding flag
-        # 0 = Audio service (SId is 16bit)
-        # 1 = Data service (SId is 32bit)
-        # no audio support right now
-        
-        # b4-7: SCIdS
-        bits += encode_number(bearer.scids, 4)
-        
-        # optional next 8 bits: ECC
-        if bearer.ecc is not None:
-            bits += encode_number(bearer.ecc, 8)
-        
-        # optional next 16 bits: EId
-        if bearer.eid is not None:
-            bits += encode_number(bearer.eid, 16)
-        
-        # next 16/32 bits: SId
-        bits += encode_number(bearer.sid, 16)
-        
-        # optional next 8 bits: X-PAD extension
-        if bearer.xpad is not None:
-            bits += encode_number(bearer.xpad, 8)
-
-    elif isinstance(bearer, IpBearer):
-        return encode_string(bearer.uri)
-    else:
-        raise ValueError('bearer %s not currently supported', bearer)
-
-    return bits
-
-def encode_ensembleid(params):
-
-    ecc, eid = params
-    bits = bitarray()
-    
-    # b0: ECC
-    bits += encode_number(ecc, 8)
-
-    # b8: EId
-    bits += encode_number(eid, 16)
-    return bits
-
-def decode_contentid(bits):
-
-    """decodes a ContentId from a bitarray"""
-    
-    # b0: RFA(0)
-    
-    # b1: Ensemble Flag. Indicates whether ECC and EId are contained with the
-    # Content ID.
-    # 0 = ECC and EId are not present. The service that is referenced within the
-    # contentID is transmitted on the same ensemble as this EPG service
-    # 1 = ECC and EId are present.
-    ecc = None
-    eid = None
-    sid = None
-    scids = None
-    xpad = None
-    
-    try:
-        if bits.length() == 24: # EnsembleId
-            # ECC, EId
-            ecc = int(bits[0:8].to01(), 2)
-            eid = int(bits[8:24].to01(), 2)
-            return (ecc, eid) 
-        else:    
-            ensemble_flag = bits[1]
-            xpad_flag = bits[2]
-            sid_flag = bits[3]
-            
-            # SCIdS
-            scids = int(bits[4:8].to01(), 2)
-            
-            # ECC, EId
-            i = 8
-            if ensemble_flag:
-                ecc = int(bits[8:16].to01(), 2)
-                eid = int(bits[16:32].to01(), 2)
-                i = 32
-            
-            # SId
-            if not sid_flag:
-                sid = int(bits[i:i+16].to01(), 2)
-                i += 16
-            elif sid_flag:
-                sid = int(bits[i:i+32].to01(), 2)
-                i += 32
-                
-            # XPAD
-            if xpad_flag:
-                xpad = int(bits[i+3:i+8].to01(), 2)
-
-            return (ecc, eid, sid, scids, xpad)
-    except:
-        raise ValueError('error parsing ContentId from data: %s', bitarray_to_hex(bits))
-
-def decode_tokentable(bits):
-    
-    tokens = {}
-    
-    i = 0 
-    while i < bits.length():
-        tag = int(bits[i:i+8].to01(), 2)
-        length = int(bits[i+8:i+16].to01(), 2)
-        data = bits[i+16:i+16+(length*8)].tobytes().decode(DEFAULT_ENCODING)
-        tokens[tag] = data
-        i += 16 + (length * 8)
-    return tokens
-
-"""Map of possible num values and their binary equivalents.
-   Note that not all the values are currently implemented, which will
-   cause the decoder to skip over their details"""
-enum_values = {
-    (0x1c, 0x83, 0x01) : False,
-    (0x1c, 0x83, 0x02) : True,
-    (0x1c, 0x84, 0x01) : "on-air",
-    (0x1c, 0x84, 0x02) : "off-air",
-    (0x2b, 0x83, 0x02) : Multimedia.LOGO_UNRESTRICTED,
-    (0x2b, 0x83, 0x04) : Multimedia.LOGO_COLOUR_SQUARE,
-    (0x2b, 0x83, 0x06) : Multimedia.LOGO_COLOUR_RECTANGLE 
-}
-
-def decode_enum(parent_tag, tag, bits):
-    
-    if bits.length() != 8: raise ValueError('enum data for parent/attribute 0x%02x/0x%02x is of incorrect length: %d bytes' % (parent_tag, tag, bits.length()/8))
-    
-    value = int(bits.to01(), 2)
-    key = (parent_tag, tag, value)
-    if key in list(enum_values.keys()):
-        return enum_values.get(key)
-    else:
-        raise NotImplementedError('enum for parent/attribute 0x%02x/0x%02x not implemented' % (parent_tag, tag))
-    
-class CData:
-    
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        return self.value
-
-    def __repr__(self):
-        return '<CData: %s>' % str(self)
-        
-    def tobytes(self):
-        # b0-b7: element tag
-        bits = bitarray()
-        bits.frombytes(b'\x01')
-  
-        # b8-15: element data length (0-253 bytes)
-        # b16-31: extended element length (256-65536 bytes)
-        # b16-39: extended element length (65537-16777216 bytes)
-        datalength = len(self.value.encode()) # ensure we get the right count for the encoding
-        if datalength <= 253:
-            tmp = encode_number(datalength, 8)
-            bits += tmp
-        elif datalength >= 254 and datalength <= 1<<16:
-            tmp = bitarray()
-            tmp.frombytes('\xfe')
-            bits += tmp
-            tmp = encode_number(datalength, 16)
-            bits += tmp
-        elif datalength > 1<<16 and datalength <= 1<<24: 
-            tmp = bitarray()
-            tmp.frombytes('\xff')
-            bits += tmp
-            tmp = encode_number(datalength, 24)
-            bits += tmp
-        else: raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %s > %s' + datalength + " > " + (1<<24))
-        tmp = bitarray()
-        tmp.frombytes(self.value.encode())
-        bits += tmp
-        
-        return bits
-    
-    @staticmethod
-    def frombits(bits):
-                
-        # b0-b7: element tag
-        tag = int(bits[0:8].to01(), 2)
-        if tag != 0x01: raise ValueError('CData does not have the correct tag: 0x%02x != 0x01', tag)
-        
-        # b8-15: element data length (0-253 bytes)
-        # b16-31: extended element length (256-65536 bytes)
-        # b16-39: extended element length (65537-16777216 bytes)
-        datalength = int(bits[8:16].to01(), 2)
-        start = 16
-        if datalength >= 254 and datalength <= 1<<16:
-            datalength = int(bits[16:32].to01(), 2)
-            start = 32
-        elif datalength > 1<<16 and datalength <= 1<<24: 
-            datalength = int(bits[16:40].to01(), 2)
-            start = 40
-        elif datalength > 1<<24:
-            raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %s > %s' + datalength + " > " + (1<<24))
-        data = bits[start:start+(datalength * 8)]
-        
-        return CData(data.tobytes().decode())
-
-def marshall(obj, **kwargs):
-    """Marshalls an :class:Epg or :class:ServiceInfo to its binary document"""
-    if isinstance(obj, ServiceInfo): return marshall_serviceinfo(obj, kwargs.get('ensemble', None))
-    elif isinstance(obj, ProgrammeInfo): return marshall_programmeinfo(obj)
-    
-def marshall_serviceinfo(info, ensemble):
- 
-    # serviceInformation
-    info_element = Element(0x03)
-    if info.version > 1: info_element.attributes.append(Attribute(0x80, info.version, encode_number, 16)) 
-    if info.created: info_element.attributes.append(Attribute(0x81, info.created, encode_timepoint))
-    if info.originator: info_element.attributes.append(Attribute(0x82, info.originator, encode_string))
-    if info.provider: info_element.attributes.append(Attribute(0x83, info.provider, encode_string))
-
-    # default language
-    default_language_element = Element(0x06)
-    default_language_element.attributes.append(Attribute(0x80, DEFAULT_LANGUAGE, encode_string)) # TODO make this configurable in a better way
-    info_element.children.append(default_language_element)
-
-    # ensemble
-    if ensemble is None: raise ValueError('must specify an ensemble')
-    ensemble_element = build_ensemble(ensemble, info.services)
-
-    info_element.children.append(ensemble_element)
-
-    return info_element.tobytes()
-
-def marshall_programmeinfo(info):
-    
-    # epg (default type is DAB, so no need to encode)
-    epg_element = Element(0x02)
-
-    # default language
-    default_language_element = Element(0x06)
-    default_language_element.attributes.append(Attribute(0x80, DEFAULT_LANGUAGE, encode_string)) # TODO make this configurable in a better way
-    epg_element.children.append(default_language_element)    
-     
-    for schedule in info.schedules:
-        schedule_element = build_schedule(schedule)
-        epg_element.children.append(schedule_element)
-
-    return epg_element.tobytes()
-
-def build_schedule(schedule): 
-    
-    # schedule
-    schedule_element = Element(0x21)
-    if schedule.version is not None and schedule.version > 1:
-        schedule_element.attributes.append(Attribute(0x80, schedule.version, encode_number, 16))
-    schedule_element.attributes.append(Attribute(0x81, schedule.created, encode_timepoint))
-    if schedule.originator is not None:
-        schedule_element.attributes.append(Attribute(0x82, schedule.originator, encode_string))
-        
-    # schedule scope TODO
-    #scope = schedule.get_scope()
-    #if scope is not None:
-    #    schedule_element.children.append(build_scope(scope))
-    
-    # programmes
-    for programme in schedule.programmes:
-        programme_element = Element(0x1c)
-        programme_element.attributes.append(Attribute(0x81, programme.shortcrid, encode_number, 24))
-        if programme.crid is not None:
-            programme_element.attributes.append(Attribute(0x80, programme.crid, encode_string))
-        if programme.version is not None:
-            programme_element.attributes.append(Attribute(0x82, programme.version, encode_number, 16))
-        if programme.recommendation:
-            programme_element.attributes.append(Attribute(0x83, 0x02, encode_number, 8)) # hardcoded to 'yes'
-        # names
-        for name in programme.names:
-            child = build_name(name)
-            programme_element.children.append(child)
-        # descriptions
-        for description in programme.descriptions:
-            child = build_description(description)
-            programme_element.children.append(child)
-        # locations
-        for location in programme.locations:
-            child = build_location(location)
-            programme_element.children.append(child)
-        # media
-        if programme.media: programme_element.children.append(build_mediagroup(programme.media))
-        # genre
-        for genre in programme.genres:
-            child = build_genre(genre)
-            programme_element.children.append(child)
-        # membership
-        for membership in programme.memberships:
-            child = build_membership(membership)
-            programme_element.children.append(child)    
-        # link
-        for link in programme.links:
-            child = build_link(link)
-            programme_element.children.append(child)      
-        # events
-        for event in programme.events:
-            child = build_programme_event(event)
-            programme_element.children.append(child) 
-            
-        schedule_element.children.append(programme_element)
-    
-    return schedule_element
-     
-    
-def build_scope(scope):
-    scope_element = Element(0x24)
-    scope_element.attributes.append(Attribute(0x80, scope.start, encode_timepoint))
-    scope_element.attributes.append(Attribute(0x81, scope.end, encode_timepoint))
-    for bearer in scope.bearers:
-        service_scope_element = Element(0x25)
-        service_scope_element.attributes.append(Attribute(0x80, bearer, encode_bearer))
-        scope_element.children.append(service_scope_element)
-    return scope_element
-    
-def build_name(name):
-    name_element = None
-    if isinstance(name, ShortName): name_element = Element(0x10)
-    elif isinstance(name, MediumName): name_element = Element(0x11)
-    elif isinstance(name, LongName): name_element = Element(0x12)
-    name_element.cdata = CData(name.text)
-    if name.language is not None and name.language is not DEFAULT_LANGUAGE: # TODO this should do a comparison with the language of the document
-        name_element.attributes.append(Attribute(0x80, name.language, encode_string))
-    return name_element
-    
-def build_location(location):
-    location_element = Element(0x19)
-    for time in location.times:
-        location_element.children.append(build_time(time))                
-    for bearer in location.bearers:
-        bearer_element = Element(0x2d)
-        bearer_element.attributes.append(Attribute(0x80, bearer, encode_bearer))
-        location_element.children.append(bearer_element)       
-    return location_element  
-
-def build_time(time):
-    time_element = None
-    if isinstance(time, Time):
-        time_element = Element(0x2c)
-        time_element.attributes.append(Attribute(0x80, time.billed_time, encode_timepoint))
-        if time.actual_time is not None:
-            time_element.attributes.append(Attribute(0x82, time.actual_time, encode_timepoint))
-        if time.actual_duration is not None:
-            time_element.attributes.append(Attribute(0x83, time.actual_duration.seconds, encode_number, 16))            
-        time_element.attributes.append(Attribute(0x81, time.billed_duration.seconds, encode_number, 16))
-    elif isinstance(time, RelativeTime):
-        time_element = Element(0x2f)
-        time_element.attributes.append(Attribute(0x80, time.billed_offset.seconds, encode_number, 16))
-        time_element.attributes.append(Attribute(0x81, time.billed_duration.seconds, encode_number, 16))
-        if time.actual_offset is not None:
-            time_element.attributes.append(Attribute(0x82, time.actual_offset.seconds, encode_number, 16))
-        if time.actual_duration is not None:
-            time_element.attributes.append(Attribute(0x83, time.actual_duration.seconds, encode_number, 16))
-    return time_element   
-    
-def build_description(description):
-    mediagroup_element = Element(0x13)
-    if isinstance(description, ShortDescription):
-        description_element = Element(0x1a)
-        description_element.cdata = CData(description.text)
-    elif isinstance(description, LongDescription):
-        description_element = Element(0x1b)
-        description_element.cdata = CData(description.text)        
-    if description.language is not None and description.language is not DEFAULT_LANGUAGE: # TODO this should do a comparison with the language of the document
-        description_element.attributes.append(Attribute(0x80, description.language, encode_string))
-    mediagroup_element.children.append(description_element)
-    return mediagroup_element
-
-def build_mediagroup(all_media):
-    mediagroup_element = Element(0x13)
-    
-    for media in all_media :
-        
-        if not isinstance(media, Multimedia):
-            raise ValueError('object must be of type %s (is %s)' % (Multimedia.__name__, type(media)))
-        
-        media_element = Element(0x2b)
-        
-        if media.content is not None:
-            media_element.attributes.append(Attribute(0x80, media.content, encode_string))
-        if media.url is not None:
-            media_element.attributes.append(Attribute(0x82, media.url, encode_string))
-        if media.type == Multimedia.LOGO_UNRESTRICTED:
-            media_element.attributes.append(Attribute(0x83, 0x02, encode_number, 8))
-            if media.width: media_element.attributes.append(Attribute(0x84, media.width, encode_number, 16))
-            if media.height: media_element.attributes.append(Attribute(0x85, media.height, encode_number, 16))
-        if media.type == Multimedia.LOGO_COLOUR_SQUARE:
-            media_element.attributes.append(Attribute(0x83, 0x04, encode_number, 8))
-        if media.type == Multimedia.LOGO_COLOUR_RECTANGLE:
-            media_element.attributes.append(Attribute(0x83, 0x06, encode_number, 8))
-        
-        mediagroup_element.children.append(media_element)
-
-    return mediagroup_element
-    
-def build_genre(genre):
-    genre_element = Element(0x14)
-    genre_element.attributes.append(Attribute(0x80, genre.href, encode_string))
-    return genre_element    
-    
-def build_membership(membership):
-    membership_element = Element(0x17)
-    if membership.crid is not None:
-        membership_element.attributes.append(Attribute(0x80, membership.crid, encode_string))
-    membership_element.attributes.append(Attribute(0x81, membership.shortcrid, encode_number, 24))
-    if membership.index is not None: 
-        membership_element.attributes.append(0x82, membership.index, encode_number, 16)
-    return membership_element  
-    
-def build_link(link):
-    link_element = Element(0x18)
-    link_element.attributes.append(Attribute(0x80, link.uri, encode_string))
-    if link.description is not None:
-        link_element.attributes.append(Attribute(0x83, link.description, encode_string))
-    if link.content is not None:
-        link_element.attributes.append(Attribute(0x81, link.content, encode_string))
-    if link.expiry is not None:
-        link_element.attributes.append(Attribute(0x84, link.expiry, encode_timepoint))
-    return link_element   
-
-def build_programme_event(event):
-    event_element = Element(0x2e)
-    if event.crid is not None:
-        event_element.attributes.append(Attribute(0x80, event.crid, encode_string))
-    event_element.attributes.append(Attribute(0x81, event.shortcrid, encode_number, 24))
-    if event.version is not None and event.version > 1:
-        event_element.attributes.append(Attribute(0x82, event.version, encode_number, 16))
-    if event.recommendation is True:
-        event_element.attributes.append(Attribute(0x83, 0x02, encode_number, 8))
-    # names
-    for name in event.names:
-        event_element.children.append(build_name(name))
-    # descriptions
-    for description in event.descriptions:
-        event_element.children.append(build_description(description))
-    # locations
-    for location in event.locations:
-        event_element.children.append(build_location(location))    
-    # media
-    if event.media: event_element.children.append(build_mediagroup(event.media))
-    # genre
-    for genre in event.genres:
-        event_element.children.append(build_genre(genre))
-    # membership
-    for membership in event.memberships:
-        event_element.children.append(build_membership(membership))  
-    # link
-    for link in event.links:
-        event_element.children.append(build_link(link))   
-             
-    return event_element
-
-def build_service(service):
-    if not isinstance(service, Service): raise ValueError("must be an object of type %s (is %s)" % (Service.__name__, type(service)))
-
-    logger.debug('building service: %s', service)
-
-    service_element = Element(0x28)
-
-    # version
-    if service.version > 1: service_element.attributes.append(Attribute(0x80, service.version, encode_number, 16)) 
-
-    # service IDs - the first in the list is primary, all others secondary 
-    for bearer in service.bearers:
-        serviceid_element = Element(0x29)
-        serviceid_element.attributes.append(Attribute(0x80, bearer, encode_bearer))    
-        service_element.children.append(serviceid_element)
-
-    # names
-    for name in service.names:
-        service_element.children.append(build_name(name))
-
-    # descriptions
-    for description in service.descriptions:
-        service_element.children.append(build_description(description))
-
-    # media
-    if service.media: service_element.children.append(build_mediagroup(service.media))
-    
-    # genre
-    for genre in service.genres:
-        service_element.children.append(build_genre(genre))
-
-    # language TODO
-
-    # keywords 
-    if len(service.keywords):
-        service_element.children.append(build_keywords(service.keywords))    
-
-    # links TODO
-
-    # radiodns lookup
-    if service.lookup:
-        from urllib.parse import urlparse
-        url = urlparse(service.lookup)
-        lookup_element = Element(0x31)
-        lookup_element.attributes.append(Attribute(0x80, url.netloc, encode_string))
-        lookup_element.attributes.append(Attribute(0x81, url.path[1:], encode_string))
-        service_element.children.append(lookup_element)
-
-    return service_element
-
-def build_keywords(keywords):
-    keywords_element = Element(0x16) # TODO encode langauges
-    keywords_element.cdata = CData(",".join(keywords))
-    return keywords_element
-
-def build_ensemble(ensemble, services):
-    logger.debug('building ensemble: %s', ensemble)
-    ensemble_element = Element(0x26)
-
-    ensemble_element.attributes.append(Attribute(0x80, (ensemble.ecc, ensemble.eid), encode_ensembleid))
-    if ensemble.version > 1: ensemble_element.attributes.append(Attribute(0x81, ensemble.version, encode_number, 16))
-
-    # names
-    for name in ensemble.names:
-        ensemble_element.children.append(build_name(name))
-
-    # descriptions
-    for description in ensemble.descriptions:
-        event_element.children.append(build_description(description))
-
-    # media
-    if ensemble.media: ensemble_element.children.append(build_mediagroup(ensemble.media))
-
-    # keywords
-
-    # links
-
-    # services
-    for service in services:
-        service_element = build_service(service) 
-        ensemble_element.children.append(service_element)
-
-    return ensemble_element
-
-token_table_pattern = re.compile('([\\x01\\x02\\x03\\x04\\x05\\x06\\x07\\x08\\x0b\\x0c\\x0e\\x0f\\x10\\x11\\x12\\x13])')
-def apply_token_table(val, e):
-    x = e
-    while x:
-        if hasattr(x, 'tokens'):
-            tokens = x.tokens
-            matcher = re.findall(token_table_pattern, val)
-            if matcher:
-                for group in matcher: 
-                    logger.debug('replacing 0x%02x with %s', ord(group), tokens[ord(group)])
-                    val = val.replace(group, tokens[ord(group)])
-            matcher = re.search(token_table_pattern, val)
-            if matcher: 
-                logger.warning('%d tokens (%s) still remain in string "%s" from table: %s', len(matcher.groups()), matcher.groups(), val, tokens)
-            break
-        elif hasattr(x, 'parent'):
-            x = x.parent
-        else:
-            break
-    return val        
-
-def print_info(e):
-    print(e.attributes)
-    print(e.children)
-    print(e.cdata)
-
-def parse_time(e):
-    billed_time = e.get_attributes(0x80)[0].value
-    billed_duration = e.get_attributes(0x81)[0].value
-    actual_time = None
-    if e.has_attribute(0x82): actual_time = e.get_attributes(0x82)[0].value
-    actual_duration = None
-    if e.has_attribute(0x82): actual_duration = e.get_attributes(0x83)[0].value
-    time = Time(billed_time, billed_duration, actual_time, actual_duration)
-    return time
-
-def parse_bearer(e):
-    id = e.get_attributes(0x80)[0].value
-    bearer = Bearer(id)
-    return bearer
-    
-
-def parse_location(e):
-    
-    location = Location()
-    
-    # times
-    for c in e.get_children(0x2c):
-        location.times.append(parse_time(c))
-        
-    # bearer
-    for c in e.get_children(0x2d):
-        location.bearers.append(parse_bearer(c)) 
-    
-    # apply a default content ID
-    if not len(location.bearers):
-        x = e
-        while x:
-            if hasattr(x, 'default_contentid'):
-                default_contentid = x.default_contentid
-                location.bearers.append(default_contentid)
-                break
-            elif hasattr(x, 'parent'):
-                x = x.parent
-            else:
-                break   
-    #if not len(location.bearers):
-    #    raise ValueError('location has no bearers and no default content ID is defined')
-    
-    return location
-
-def parse_programme(e):    
-    
-    crid = e.get_attributes(0x80)[0].value
-    shortid = e.get_attributes(0x81)[0].value
-    programme = Programme(crid, shortid)
-    
-    # names
-    for c in e.get_children(0x10):
-        val = apply_token_table(c.cdata.value, e)
-        name = ShortName(val)
-        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
-        programme.names.append(name)
-    for c in e.get_children(0x11):
-        val = apply_token_table(c.cdata.value, e)
-        name = MediumName(val)        
-        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
-        programme.names.append(name)
-    for c in e.get_children(0x12):
-        val = apply_token_table(c.cdata.value, e)
-        name = LongName(val)
-        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
-        programme.names.append(name)
-        
-    # media
-    for c in e.get_children(0x13):
-        # short description
-        for d in c.get_children(0x1a):
-            val = apply_token_table(d.cdata.value, e)
-            description = ShortDescription(val)
-            if(d.has_attribute(0x80)): description.language = d.get_attributes(0x80)[0].value
-            programme.descriptions.append()
-        # long description
-        for d in c.get_children(0x1b):
-            val = apply_token_table(d.cdata.value, e)
-            description = LongDescription(val)
-            if(d.has_attribute(0x80)): description.language = d.get_attributes(0x80)[0].value
-            programme.descriptions.append(description)
-        # multimedia
-        for d in c.get_children(0x2b):
-            url = d.get_attributes(0x82)[0].value
-            multimedia = Multimedia(url)
-            if(d.has_attribute(0x80)): multimedia.content = d.get_getattributes(0x80)[0].value # MIME content type
-            if(d.has_attribute(0x81)): pass # nowhere to store language yet 
-            if(d.has_attribute(0x83)): multimedia.type = d.get_attributes(0x83)[0].value # logo type
-            if(d.has_attribute(0x84)): multimedia.width = d.get_attributes(0x84)[0].value # logo width
-            if(d.has_attribute(0x85)): multimedia.height = d.get_attributes(0x85)[0].value # logo height
-            programme.media.append(multimedia)
-    
-    # location
-    for c in e.get_children(0x19):
-        programme.locations.append(parse_location(c))
-    
-    return programme
- 
-def parse_schedule(e):
-    
-    # scope start, end    
-
-    schedule = Schedule()
-    
-    # programmes
-    programme_elements = e.get_children(0x1c)
-    for p in programme_elements: 
-        programme = parse_programme(p)
-        schedule.programmes.append(programme)
-        
-    return schedule
-
-def parse_epg(e):
-    schedule = parse_schedule(e.get_children(0x21)[0])
-    info = ProgrammeInfo()
-    info.schedules.append(schedule)
-    return info
-
-def parse_service(e):
-    logger.debug('parsing service from element: %s', e)
-    id = e.get_children(0x29)[0].get_attributes(0x80)[0].value
-    service = Service(id)
-    
-    # names
-    logger.debug('parsing service names')
-    for c in e.get_children(0x10):
-        logger.debug('parsing short name from element: %s', c)
-        val = apply_token_table(c.cdata.value, e)
-        service.names.append(ShortName(val))
-    for c in e.get_children(0x11):
-        logger.debug('parsing medium name from element: %s', c)
-        val = apply_token_table(c.cdata.value, e)
-        service.names.append(MediumName(val))
-    for c in e.get_children(0x12):
-        logger.debug('parsing long name from element: %s', c)
-        val = apply_token_table(c.cdata.value, e)
-        service.names.append(LongName(val)) 
-    return service
-    
-
-def parse_ensemble(e):    
-    id = e.get_attributes(0x80)[0].value
-    ensemble = Ensemble(*id)
-    
-    # names
-    for c in e.get_children(0x10):
-        val = apply_token_table(c.cdata.value, e)
-        ensemble.names.append(ShortName(val))
-    for c in e.get_children(0x11):
-        val = apply_token_table(c.cdata.value, e)
-        ensemble.names.append(MediumName(val))
-    for c in e.get_children(0x12):
-        val = apply_token_table(c.cdata.value, e)
-        ensemble.names.append(LongName(val)) 
-        
-    # services
-    services = []
-    for c in e.get_children(0x28):
-        services.append(parse_service(c))
-    
-    return ensemble, services
-
-def parse_service_information(e):
-    service_info = ServiceInfo()
-    if not e.has_child(0x26):
-        raise ValueError('no ensemble subelement (0x26): children=%s' % e.get_children())
-    ensemble, services = parse_ensemble(e.get_children(0x26)[0])
-    service_info.services = services
-    return service_info, ensemble
-    
-def encode_number(i, n):
-    if not isinstance(i, (int, float, complex)): raise ValueError('value must be a number (%s is %s)' % (i, type(i)))
-    if not isinstance(n, (int, float, complex)): raise ValueError('bitlength must be a number')
-    i = int(i)
-    n = int(n)
-    return bitarray(tuple((0,1)[i>>j & 1] for j in range(n-1,-1,-1)))
-
-def bitarray_to_hex(bits):
-    rows = []
-    for i in range(0, len(bits), 256):
-        rows.append(' '.join(["%02X" %x for x in bits[i:i+256].tobytes()]).strip())
-    return '\r\n'.join(rows)
-
-def hex_to_bitarray(hex):
-    b = bitarray()
-    for byte in hex.split(' '):
-        b.extend(encode_number(int('0x%s' % byte, 16), 8))
-    return b
-
-def bitarray_to_binary(bits):
-    rows = []
-    for i in range(0, len(bits), 256):
-        bytes = []
-        for j in range(i, i+256, 8):
-            bytes.append(bits[j:j+8].to01())
-        rows.append(' '.join(bytes))
-    return '\r\n'.join(rows)
-      
-def unmarshall(i):
-    """Unmarshalls a PI or SI binary file to its respective :class:Epg or :class:ServiceInfo object
-    
-    :param i: String or File object to read binary from
-    :type i: str, file
-    """    
-    
-    logger.debug('unmarshalling object of type: %s', type(i))
-    
-    import io
-    b = bitarray()
-    if isinstance(i, io.IOBase):
-        logger.debug('object is a file')
-        b.fromfile(i)
-    else:
-        logger.debug('object is a string of %d bytes', len(str(i)))
-        b.frombytes(i)
-        
-    e = Element.frombits(b)
-    logger.debug('unmarshalled element %s', e)
-    if e.tag == 0x03:
-        si = parse_service_information(e)
-        return si
-    elif e.tag == 0x02:
-        epg = parse_epg(e)
-        return epg
-    else:
-        raise Exception('Arrgh! this be neither serviceInformation nor epg - to Davy Jones\' locker with ye!')    
+from spi import *
+from spi.workers import worker_pool, FRAGMENT_CHUNKSIZE
+
+from bitarray import bitarray, bits2bytes
+import bisect
+import calendar
+import collections
+import copy
+import functools
+import io
+import json
+import math
+import mmap
+import os
+import re
+import datetime, dateutil.tz
+import logging
+import sys
+import time
+import types
+from datetime import timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("spi.binary")
+
+"""A structured event traced while encoding or decoding an element: the action (``encode`` or 
+   ``decode``), element tag, offset of the element within the buffer, its length in bytes including
+   its header, and the time in seconds spent on it and its descendants"""
+TraceEvent = collections.namedtuple('TraceEvent', ['action', 'tag', 'offset', 'length', 'elapsed'])
+
+"""Function called with each :class:TraceEvent, or None if tracing is disabled"""
+trace_hook = None
+
+def set_trace_hook(hook):
+    """
+    Registers a function to be called with a :class:TraceEvent as each element is encoded or 
+    decoded, replacing any already registered. Tracing costs no more than a check of the hook
+    while disabled.
+
+    :param hook: Function to call, or None to disable tracing
+    :type hook: callable
+    """
+    global trace_hook
+    trace_hook = hook
+
+class Ensemble:
+    """
+    Describes a DAB ensemble 
+    
+    :param ecc: Extended Country Code (ECC) 
+    :type ecc: integer
+    :param eid: Ensemble ID (EId)
+    :type eid: integer
+    :param version: Description version 
+    :type version: integer
+    """
+    
+    def __init__(self, ecc, eid, version=1):
+        self.ecc = ecc
+        self.eid = eid
+        self.names = []
+        self.descriptions = []
+        self.media = []
+        self.keywords = []
+        self.links = []
+        self.services = []
+        self.frequencies = []
+        self.version = version
+        
+    def __str__(self):
+        return "%02x.%04x" % (self.ecc, self.eid) 
+    
+    def __repr__(self):
+        return '<Ensemble: %s>' % str(self)
+    
+
+"""Shared empty sequence standing in for the attributes and children of the elements which have 
+   none, until the first is added"""
+EMPTY = ()
+
+"""Shared read-only index of the elements which have no attributes or children"""
+EMPTY_INDEX = types.MappingProxyType({})
+
+"""Shared (token table, default content ID) context of decoded elements which inherit neither"""
+NO_CONTEXT = (None, None)
+
+class Element:
+    """
+    An element of an encoded document. Its attributes and children are the shared :data:EMPTY
+    sequence until they are first accessed, and the token table, default content ID and parent 
+    are only set on the elements that have them.
+
+    Decoded elements also have a context, a tuple of the token table and default content ID in 
+    effect for them whether declared on the element or inherited, resolved once as the document
+    is decoded. Their attributes and children are tuples, indexed by tag once decoded, whereas
+    those of elements being built are lists which may change at any time, so are scanned on each
+    lookup by tag.
+    """
+
+    __slots__ = ('tag', '_attributes', '_children', 'cdata', 'parent', 'tokens', 'default_contentid', 
+                 'context', '_index', '_datalength', '_definitions')
+    
+    def __init__(self, tag, attributes=None, children=None, cdata=None):
+        self.tag = tag
+        self._attributes = (attributes if attributes is not None else EMPTY)
+        self._children = (children if children is not None else EMPTY)
+        self.cdata = cdata
+        self._index = None
+
+    def _get_attributes(self):
+        if self._attributes is EMPTY: 
+            self._attributes = []
+            self._index = None
+        return self._attributes
+
+    def _set_attributes(self, attributes):
+        self._attributes = attributes
+        self._index = None
+
+    attributes = property(_get_attributes, _set_attributes)
+
+    def _get_children(self):
+        if self._children is EMPTY: 
+            self._children = []
+            self._index = None
+        return self._children
+
+    def _set_children(self, children):
+        self._children = children
+        self._index = None
+
+    children = property(_get_children, _set_children)
+
+    def get_index(self):
+        """returns a dict of the attributes and children of a decoded element by tag, or None if the
+           element is being built"""
+        return self._index
+
+    def build_index(self):
+        """indexes the attributes and children of a decoded element by tag, in one pass"""
+        if not self._attributes and not self._children:
+            self._index = EMPTY_INDEX
+            return
+        index = {}
+        for x in self._attributes:
+            bucket = index.get(x.tag)
+            if bucket is None: index[x.tag] = [x]
+            else: bucket.append(x)
+        for x in self._children:
+            bucket = index.get(x.tag)
+            if bucket is None: index[x.tag] = [x]
+            else: bucket.append(x)
+        self._index = index
+        
+    def tobytes(self):
+        buf = bytearray(self.encoded_length())
+        self.encode_into(memoryview(buf), 0)
+        bits = bitarray()
+        bits.frombytes(bytes(buf))
+        return bits
+
+    def datalength(self):
+        """returns the length in bytes of the encoded attributes, children and CData of this
+           element, calculating each subtree length once and caching it for :meth:encode_into"""
+
+        datalength = 0
+
+        # attributes
+        for attribute in self._attributes:
+            try: datalength += attribute.encoded_length(self.tag)
+            except Exception as e:
+                raise ValueError('error rendering attribute %s of %s: %s' % (attribute, self, str(e))).with_traceback(sys.exc_info()[2])
+
+        # token table and default content ID
+        datalength += self.encode_definitions()
+
+        # children
+        for child in self._children:
+            try: datalength += child.encoded_length()
+            except:
+                logger.exception('error rendering child %s of %s', child, self)
+                raise
+
+        # CData
+        if self.cdata is not None:
+            datalength += self.cdata.encoded_length()
+
+        if datalength == 0:
+            raise ValueError('element data length is zero')
+        self._datalength = datalength
+        return datalength
+
+    def encode_definitions(self):
+        """encodes the token table and default content ID declared on this element, if any, returning
+           their length in bytes including their headers"""
+        definitions = []
+        tokens = getattr(self, 'tokens', None)
+        if tokens: 
+            definitions.append((0x04, encode_tokentable(tokens)))
+        default_contentid = getattr(self, 'default_contentid', None)
+        if default_contentid is not None: 
+            definitions.append((0x05, encode_bearer_bytes(default_contentid)))
+        self._definitions = definitions
+        return sum(header_length(len(data)) + len(data) for tag, data in definitions)
+
+    def encoded_length(self):
+        """returns the total length in bytes of this element once encoded, including its header"""
+        datalength = self.datalength()
+        return header_length(datalength) + datalength
+
+    def encode_into(self, buf, offset):
+        """writes this element into a preallocated buffer at the given offset, returning the offset
+           immediately after it. :meth:datalength must have been called beforehand so the lengths
+           of this element and all its descendants are known"""
+
+        if trace_hook is not None: started, start = time.perf_counter(), offset
+        offset = encode_header(buf, offset, self.tag, self._datalength)
+        for attribute in self._attributes:
+            offset = attribute.encode_into(buf, offset)
+        for tag, data in self._definitions:
+            offset = encode_header(buf, offset, tag, len(data))
+            buf[offset:offset + len(data)] = data
+            offset += len(data)
+        for child in self._children:
+            offset = child.encode_into(buf, offset)
+        if self.cdata is not None:
+            offset = self.cdata.encode_into(buf, offset)
+        if trace_hook is not None: trace_hook(TraceEvent('encode', self.tag, start, offset - start, time.perf_counter() - started))
+        return offset
+    
+    def write(self, out, report=None):
+        """encodes this element and writes it to a binary file object, returning the number of 
+           bytes written, and adding them to a :class:SizeReport if one is given"""
+        buf = bytearray(self.encoded_length())
+        self.encode_into(memoryview(buf), 0)
+        out.write(buf)
+        if report is not None: report.add_element(self)
+        return len(buf)
+    
+    def __iter__(self):
+        return iter(self._children)
+    
+    def has_child(self, tag):
+        return len(self.get_children(tag))
+    
+    def get_children(self, tag=None):
+        if tag is not None:
+            index = self.get_index()
+            if index is not None: return list(index.get(tag, EMPTY))
+            return [x for x in self._children if x.tag == tag]
+        return self.children
+    
+    def has_attribute(self, tag):
+        return len(self.get_attributes(tag))
+    
+    def get_attributes(self, tag=None):
+        if tag is not None:
+            index = self.get_index()
+            if index is not None: return list(index.get(tag, EMPTY))
+            return [x for x in self._attributes if x.tag == tag]
+        return self.attributes    
+    
+    @staticmethod
+    def frombits(bits, lazy=False):
+        """parses an element from a bitarray
+        
+        :param lazy: defer decoding of each element until it is accessed, see :class:LazyElement
+        :type lazy: bool
+        """
+        return Element.frombuffer(bits.tobytes(), lazy=lazy)
+
+    @staticmethod
+    def frombuffer(buf, offset=0, lazy=False, context=None):
+        """parses an element from a bytes-like buffer starting at the given offset. The buffer is
+           never copied, the element and its descendants being decoded in place by offset
+        
+        :param lazy: defer decoding of each element until it is accessed, see :class:LazyElement
+        :type lazy: bool
+        :param context: (token table, default content ID) inherited by the element, if it is not
+                        the top-level element of the document
+        :type context: tuple
+        """
+
+        if not isinstance(buf, memoryview): buf = memoryview(buf)
+
+        # b0-b7: element tag
+        tag, datalength, start = decode_header(buf, offset)
+        if tag < 0x02 or tag > 0x36: raise ValueError('invalid value for tag: 0x%02x' % tag)
+        if start + datalength > len(buf):
+            raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (tag, offset, start + datalength, len(buf)))
+
+        return Element.decode(buf, tag, start, start + datalength, lazy=lazy, context=context)
+
+    @staticmethod
+    def decode(buf, tag, start, end, lazy=False, context=None):
+        """decodes the data of an element with the given tag, lying between the start and end offsets
+           of a memoryview, with the (token table, default content ID) context it inherits"""
+
+        if lazy: return LazyElement(buf, tag, start, end, context)
+        if trace_hook is not None: started = time.perf_counter()
+        e = Element(tag)
+        e.decode_data(buf, start, end, context=context)
+        if trace_hook is not None: 
+            length = header_length(end - start) + end - start
+            trace_hook(TraceEvent('decode', tag, end - length, length, time.perf_counter() - started))
+        return e
+
+    def decode_data(self, buf, start, end, lazy=False, context=None):
+        """decodes the attributes, children and CData of this element from between the start and
+           end offsets of a memoryview. The context of the element is that inherited, or otherwise 
+           that of its parent, updated with any token table or default content ID it declares"""
+
+        e = self
+        tag = self.tag
+        if context is None:
+            # decoding more of an element, such as the definitions of the ancestors of one read alone
+            parent = getattr(self, 'parent', None)
+            context = getattr(parent, 'context', NO_CONTEXT) if parent is not None else NO_CONTEXT
+            tokens = getattr(self, 'tokens', None)
+            default_contentid = getattr(self, 'default_contentid', None)
+            if tokens is not None or default_contentid is not None:
+                context = (tokens if tokens is not None else context[0], 
+                           default_contentid if default_contentid is not None else context[1])
+        self.context = context
+        attributes = []
+        children = []
+        i = start
+        while i < end:
+            child_tag, child_datalength, child_start = decode_header(buf, i)
+            child_end = child_start + child_datalength
+            if child_end > end:
+                raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d: %s' % (child_tag, i, child_end, end, bytes_to_hex(buf[i:i+8])))
+
+            # attributes
+            if child_tag >= 0x80 and child_tag <= 0x87:
+                attributes.append(Attribute.decode(tag, child_tag, buf[child_start:child_end]))
+            # token table
+            elif child_tag == 0x04:
+                e.tokens = decode_tokentable_bytes(buf[child_start:child_end])
+                context = e.context = (e.tokens, context[1])
+                if children: set_context(children, context)
+            # default content ID
+            elif child_tag == 0x05:
+                e.default_contentid = decode_contentid_bytes(buf[child_start:child_end])
+                context = e.context = (context[0], e.default_contentid)
+                if children: set_context(children, context)
+            # default language
+            elif child_tag == 0x06: 
+                pass # not yet implemented
+            # children
+            elif child_tag >= 0x02 and child_tag <= 0x36:
+                child = Element.decode(buf, child_tag, child_start, child_end, lazy=lazy, context=context)
+                child.parent = e
+                children.append(child)
+            # cdata
+            elif child_tag == 0x01:
+                e.cdata = CData(bytes(buf[child_start:child_end]).decode())
+            else:
+                raise ValueError('unknown element 0x%02x under parent 0x%02x' % (child_tag, tag))
+            
+            i = child_end
+
+        # tuples are only kept for the elements with attributes or children
+        if attributes: e._attributes = tuple(e._attributes) + tuple(attributes)
+        if children: e._children = tuple(e._children) + tuple(children)
+        e.build_index()
+        
+    def __str__(self):
+        return 'tag=0x%02X, attributes=%s, children=%s, cdata=%s' % (self.tag, self.attributes, self.children, self.cdata)
+    
+    def __repr__(self):
+        return '<Element: 0x%02X>' % self.tag
+
+def set_context(elements, context):
+    """sets the context of decoded elements and their descendants which inherit it, when a token 
+       table or default content ID is declared after the children of an element"""
+    for e in elements:
+        if isinstance(e, LazyElement) and not e._loaded:
+            e.context = context # its own declarations are applied when it is loaded
+            continue
+        tokens = getattr(e, 'tokens', None)
+        default_contentid = getattr(e, 'default_contentid', None)
+        e.context = (tokens if tokens is not None else context[0], 
+                     default_contentid if default_contentid is not None else context[1])
+        set_context(e._children, e.context)
+
+class LazyElement(Element):
+    """
+    An element which records only its tag and the byte range of its data when parsed,
+    deferring decoding of its attributes, CData and children until one of them is first 
+    accessed. Children are themselves lazy, so untouched subtrees are never decoded
+    beyond a scan of their headers. The ``parse_*`` functions read every child of what they parse,
+    so this pays off when reading elements directly or through :func:select rather than when 
+    unmarshalling a whole document.
+    """
+
+    __slots__ = ('_buf', '_start', '_end', '_loaded', '_cdata')
+
+    def __init__(self, buf, tag, start, end, context=None):
+        self.tag = tag
+        self._buf = buf
+        self._start = start
+        self._end = end
+        self._loaded = False
+        self._index = None
+        if context is not None: self.context = context
+
+    def get_index(self):
+        self.load()
+        return self._index
+
+    def load(self):
+        """decodes the data of this element, if it has not already been"""
+        if self._loaded: return
+        self._loaded = True
+        self._attributes = EMPTY
+        self._children = EMPTY
+        self._cdata = None
+        self.decode_data(self._buf, self._start, self._end, lazy=True, context=getattr(self, 'context', None))
+        self._buf = None
+
+    def _get_cdata(self):
+        self.load()
+        return self._cdata
+
+    def _set_cdata(self, cdata):
+        self.load()
+        self._cdata = cdata
+
+    cdata = property(_get_cdata, _set_cdata)
+
+    def __getattr__(self, name):
+        # attributes, children, token tables and default content IDs are only set once the 
+        # element is decoded
+        if name in ('_attributes', '_children', 'tokens', 'default_contentid') and not getattr(self, '_loaded', True):
+            self.load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return '<LazyElement: 0x%02X>' % self.tag
+        
+class StreamedElement(Element):
+    """
+    An element which can be written to a file object without its whole subtree being held 
+    in memory. As well as elements, its children may contain functions returning an iterable
+    of elements, which are called once to measure the elements, and then again to build 
+    and write them one at a time.
+    """
+
+    __slots__ = ()
+
+    def iter_children(self):
+        for child in self.children:
+            if callable(child): yield from child()
+            else: yield child
+
+    def datalength(self):
+        datalength = 0
+        for attribute in self.attributes:
+            try: datalength += attribute.encoded_length(self.tag)
+            except Exception as e:
+                raise ValueError('error rendering attribute %s of %s: %s' % (attribute, self, str(e))).with_traceback(sys.exc_info()[2])
+        datalength += self.encode_definitions()
+        for child in self.iter_children():
+            try: datalength += child.encoded_length()
+            except:
+                logger.exception('error rendering child %s of %s', child, self)
+                raise
+        if self.cdata is not None:
+            datalength += self.cdata.encoded_length()
+        if datalength == 0:
+            raise ValueError('element data length is zero')
+        self._datalength = datalength
+        return datalength
+
+    def encode_into(self, buf, offset):
+        if trace_hook is not None: started, start = time.perf_counter(), offset
+        offset = encode_header(buf, offset, self.tag, self._datalength)
+        for attribute in self.attributes:
+            offset = attribute.encode_into(buf, offset)
+        for tag, data in self._definitions:
+            offset = encode_header(buf, offset, tag, len(data))
+            buf[offset:offset + len(data)] = data
+            offset += len(data)
+        for child in self.iter_children():
+            child.encoded_length() # generated children need measuring again
+            offset = child.encode_into(buf, offset)
+        if self.cdata is not None:
+            offset = self.cdata.encode_into(buf, offset)
+        if trace_hook is not None: trace_hook(TraceEvent('encode', self.tag, start, offset - start, time.perf_counter() - started))
+        return offset
+
+    def write(self, out, report=None):
+        datalength = self.datalength()
+        header = bytearray(header_length(datalength))
+        encode_header(header, 0, self.tag, datalength)
+        out.write(header)
+        for attribute in self.attributes:
+            buf = bytearray(attribute.encoded_length(self.tag))
+            attribute.encode_into(buf, 0)
+            out.write(buf)
+        for tag, data in self._definitions:
+            buf = bytearray(header_length(len(data)))
+            encode_header(buf, 0, tag, len(data))
+            out.write(buf)
+            out.write(data)
+        for child in self.iter_children():
+            child.write(out, report)
+        if self.cdata is not None:
+            buf = bytearray(self.cdata.encoded_length())
+            self.cdata.encode_into(buf, 0)
+            out.write(buf)
+        if report is not None: report.add_node(self)
+        return len(header) + datalength
+        
+class EncodedElement:
+    """
+    An element which has already been encoded, including its header, such as a programme or 
+    service encoded in a worker process. Its bytes are spliced into its parent as they are.
+    """
+
+    __slots__ = ('tag', 'data', 'strings', 'source')
+
+    def __init__(self, tag, data, strings=None):
+        self.tag = tag
+        self.data = data
+        self.strings = strings if strings is not None else []
+        self.source = None
+
+    def tobytes(self):
+        bits = bitarray()
+        bits.frombytes(self.data)
+        return bits
+
+    def encoded_length(self):
+        return len(self.data)
+
+    def encode_into(self, buf, offset):
+        buf[offset:offset + len(self.data)] = self.data
+        return offset + len(self.data)
+
+    def write(self, out, report=None):
+        out.write(self.data)
+        if report is not None: report.add_encoded(self.data)
+        return len(self.data)
+
+    def __repr__(self):
+        return '<EncodedElement: 0x%02X>' % self.tag
+
+class Attribute:
+
+    __slots__ = ('tag', 'value', '_data')
+    
+    def __init__(self, tag, value):
+        if not isinstance(tag, int): raise ValueError('tag must be an integer')
+        self.tag = tag
+        self.value = value
+    
+    def tobytes(self, parent):
+        buf = bytearray(self.encoded_length(parent))
+        self.encode_into(memoryview(buf), 0)
+        bits = bitarray()
+        bits.frombytes(bytes(buf))
+        return bits
+
+    def encoded_length(self, parent):
+        """encodes the attribute value according to its type under the given parent element or 
+           tag, returning the total length in bytes of the attribute including its header"""
+
+        if isinstance(parent, Element): parent_tag = parent.tag
+        else: parent_tag = int(parent)
+        try: f = attribute_encoders[(parent_tag, self.tag)]
+        except KeyError: raise ValueError('dont know how to encode attribute value for parent 0x%02x from tag: 0x%02x' % (parent_tag, self.tag))
+
+        # encode data
+        self._data = f(self.value)
+        return header_length(len(self._data)) + len(self._data)
+
+    def encode_into(self, buf, offset):
+        """writes this attribute into a preallocated buffer at the given offset, returning the offset
+           immediately after it"""
+        data = self._data
+        offset = encode_header(buf, offset, self.tag, len(data))
+        buf[offset:offset + len(data)] = data
+        return offset + len(data)
+    
+    @staticmethod
+    def frombits(parent, bits):
+        """parses an attribute, including its header, from a bitarray"""
+
+        buf = memoryview(bits.tobytes())
+        tag, datalength, start = decode_header(buf, 0)
+        return Attribute.decode(parent, tag, buf[start:start+datalength])
+
+    @staticmethod
+    def decode(parent, tag, data):
+        """decodes the value of an attribute from the bytes-like data following its header,
+           according to its type under the given parent element or tag"""
+
+        if isinstance(parent, Element): parent_tag = parent.tag
+        else: parent_tag = int(parent)
+        try: f = attribute_decoders[(parent_tag, tag)]
+        except KeyError: raise ValueError('dont know how to decode attribute value for parent 0x%02x from tag: 0x%02x' % (parent_tag, tag))
+        return Attribute(tag, f(data))
+    
+    def __str__(self):
+        return str('0x%x' % self.tag)
+    
+    def __repr__(self):
+        return '<Attribute: tag=0x%02X, value=%s>' % (self.tag, self.value) 
+    
+genre_map = dict(
+    IntentionCS=1,
+    FormatCS=2,
+    ContentCS=3, # what happened to 4?!
+    OriginationCS=5,
+    ContentAlertCS=6,
+    MediaTypeCS=7,
+    AtmosphereCS=8
+)
+    
+def pack_fields(*fields):
+    """packs (value, bit width) fields into bytes, most significant first, with integer shifts and 
+       masks rather than a bitarray. The widths must add up to a whole number of bytes"""
+    value = 0
+    n = 0
+    for field, width in fields:
+        value = (value << width) | (field & ((1 << width) - 1))
+        n += width
+    if n % 8: raise ValueError('fields do not fill a whole number of bytes: %d bits' % n)
+    return value.to_bytes(n // 8, 'big')
+
+def unpack_fields(data, *widths):
+    """unpacks fields of the given bit widths from the start of bytes-like data, most significant 
+       first, returning a tuple of their values"""
+    n = len(data) * 8
+    value = int.from_bytes(data, 'big')
+    fields = []
+    for width in widths:
+        n -= width
+        if n < 0: raise ValueError('fields are beyond the end of the data: %d bytes' % len(data))
+        fields.append((value >> n) & ((1 << width) - 1))
+    return tuple(fields)
+
+def pack_number(i, n):
+    """packs an integer into bytes of n bits, truncating any higher bits"""
+    if not isinstance(i, (int, float)): raise ValueError('value must be a number (%s is %s)' % (i, type(i)))
+    i = int(i)
+    if n % 8: raise ValueError('bitlength must be a whole number of bytes: %d' % n)
+    return (i & ((1 << n) - 1)).to_bytes(n // 8, 'big')
+
+def encode_genre(genre):
+    """encodes a genre, returning a bitarray. See :func:encode_genre_bytes"""
+    return buffer_to_bitarray(encode_genre_bytes(genre))
+
+def encode_genre_bytes(genre):
+    
+    segments = genre.href.split(':')
+    if len(segments) < 6: raise ValueError('genre is incorrectly formatted: %s' % genre)
+    
+    # b0-3: RFU(0)
+    # b4-7: CS
+    cs = segments[4]
+    if cs in genre_map: cs_val = genre_map[cs]
+    else: raise ValueError('unknown CS in genre: %s' % cs)
+    data = bytearray(pack_fields((0, 4), (cs_val, 4)))
+    
+    # optional schema levels
+    if len(segments) >= 6:
+        levels = segments[6].split('.')
+        for level in levels:
+            data.append(int(level) & 0xff)
+        
+    return bytes(data)
+
+def genre_length(genre):
+    """returns the length in bytes of an encoded genre, without encoding it"""
+    segments = genre.href.split(':')
+    if len(segments) < 6: raise ValueError('genre is incorrectly formatted: %s' % genre)
+    if segments[4] not in genre_map: raise ValueError('unknown CS in genre: %s' % segments[4])
+    return 1 + len(segments[6].split('.'))
+
+def decode_genre(bits):
+    """decodes a genre from a bitarray. See :func:decode_genre_bytes"""
+    return decode_genre_bytes(bits.tobytes())
+
+def decode_genre_bytes(data):
+    
+    # b4-7: CS
+    cs_val = data[0] & 0x0f
+    if cs_val not in genre_map.values(): raise ValueError('unknown CS value for genre: %d' % cs_val)
+    
+    level = '%d' % cs_val
+    
+    # optional schema levels
+    for sublevel in bytes(data[1:]):
+        level += '.%d' % sublevel
+    
+    return Genre('urn:tva:metadata:cs:ContentCS:2002:%s' % level)
+
+def encode_string(s):
+    return buffer_to_bitarray(s.encode())
+    
+"""Number of recently encoded and decoded timepoints to keep"""
+TIMEPOINT_CACHE_SIZE = 4096
+
+"""Difference between proleptic Gregorian ordinals and Modified Julian Dates"""
+MJD_ORDINAL = 678576
+
+"""Modified Julian Date of the Unix epoch"""
+MJD_EPOCH = 40587
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(offset):
+    """returns a shared timezone for a UTC offset in seconds"""
+    if offset == 0: return dateutil.tz.tzutc()
+    return dateutil.tz.tzoffset(None, offset)
+
+def encode_timepoint(timepoint):
+    """encodes a timepoint, returning a bitarray. See :func:encode_timepoint_bytes"""
+    bits = bitarray()
+    bits.frombytes(encode_timepoint_bytes(timepoint))
+    return bits
+    
+def encode_timepoint_bytes(timepoint):
+    """encodes a timepoint, returning bytes. Naive timepoints are taken to be in UTC, and a local 
+       time offset is encoded for any other timezone. Recently encoded timepoints are cached"""
+
+    if timepoint.tzinfo is None: return pack_timepoint(timepoint, 0)
+    offset = timepoint.utcoffset()
+    return pack_timepoint(timepoint.replace(tzinfo=None), offset.days * 86400 + offset.seconds)
+
+@functools.lru_cache(maxsize=TIMEPOINT_CACHE_SIZE)
+def pack_timepoint(timepoint, offset):
+    """packs a naive local timepoint and its UTC offset in seconds into the bytes of its encoding"""
+
+    utc = timepoint - timedelta(seconds=offset) if offset else timepoint
+    long_form = utc.second > 0
+
+    # b0: RFA(0)
+    # b1-17: Date
+    value = utc.toordinal() - MJD_ORDINAL
+    # b18: RFA(0)
+    value <<= 1
+    # b19: LTO Flag
+    value = (value << 1) | (1 if offset else 0)
+    # b20: UTC Flag
+    value = (value << 1) | (1 if long_form else 0)
+    # b21: UTC - 11 or 27 bits depending on the form
+    value = (value << 5) | utc.hour
+    value = (value << 6) | utc.minute
+    length = 4
+    if long_form:
+        value = (value << 6) | utc.second
+        value <<= 10 # milliseconds
+        length = 6
+    # b32/48: LTO
+    if offset:
+        value = (value << 8) | (0 if offset > 0 else 0x20) | ((abs(offset) // 1800) & 0x1f)
+        length += 1
+
+    return value.to_bytes(length, 'big')
+
+def decode_timepoint(bits):
+    """decodes a timepoint from a bitarray. See :func:decode_timepoint_bytes"""
+    return decode_timepoint_bytes(bits.tobytes())
+
+def decode_timepoint_bytes(data):
+    """decodes a timepoint from bytes, returning a timezone aware datetime, or None for the NOW
+       timepoint. Recently decoded timepoints are cached"""
+    return unpack_timepoint(bytes(data))
+
+@functools.lru_cache(maxsize=TIMEPOINT_CACHE_SIZE)
+def unpack_timepoint(data):
+    
+    fields = unpack_timepoint_fields(data)
+    if fields is None: return None # NOW
+    mjd, hour, minute, second, millisecond, offset = fields
+
+    timepoint = datetime.datetime.combine(datetime.date.fromordinal(mjd + MJD_ORDINAL), 
+                                          datetime.time(hour, minute, second, millisecond * 1000, tzinfo=get_timezone(0)))
+    if offset: timepoint = timepoint.astimezone(get_timezone(offset))
+    return timepoint
+
+def unpack_timepoint_fields(data):
+    """unpacks the fields of an encoded timepoint, returning a tuple of (mjd, hour, minute, second, 
+       millisecond, offset) with the time in UTC and the local time offset in seconds, or None for
+       the NOW timepoint"""
+
+    value = int.from_bytes(data, 'big')
+    if not value: return None 
+    n = len(data) * 8
+    
+    mjd = (value >> (n - 18)) & 0x1ffff
+    lto = (value >> (n - 20)) & 0x01
+    long_form = (value >> (n - 21)) & 0x01
+    hour = (value >> (n - 26)) & 0x1f
+    minute = (value >> (n - 32)) & 0x3f
+    second = millisecond = 0
+    if long_form:
+        second = (value >> (n - 38)) & 0x3f
+        millisecond = (value >> (n - 48)) & 0x3ff
+    offset = 0
+    if lto:
+        offset = (value & 0x1f) * 1800 * (-1 if value & 0x20 else 1)
+    return mjd, hour, minute, second, millisecond, offset
+
+def encode_timepoints(timepoints):
+    """Encodes a sequence of timepoints at once. Timepoints given as numbers of seconds since the 
+    Unix epoch, in a list or a NumPy array, are encoded in UTC and vectorised with NumPy when it is
+    available, as are NumPy arrays of datetime64.
+
+    :param timepoints: Datetimes or numbers of seconds since the epoch
+    :type timepoints: list
+    :returns: list of the encoded bytes of each timepoint
+    """
+
+    if numpy is not None and (isinstance(timepoints, numpy.ndarray) or \
+            (len(timepoints) and all(isinstance(x, (int, float)) for x in timepoints))):
+        seconds = numpy.asarray(timepoints)
+        if seconds.dtype.kind == 'M': seconds = seconds.astype('datetime64[s]')
+        seconds = seconds.astype(numpy.int64)
+        mjd = seconds // 86400 + MJD_EPOCH
+        seconds = seconds % 86400
+        hour, minute, second = seconds // 3600, (seconds // 60) % 60, seconds % 60
+        short_form = (mjd << 14) | (hour << 6) | minute
+        long_form = ((mjd << 30) | (1 << 27) | (hour << 22) | (minute << 16) | (second << 10)) << 16 # aligned to the top of 64 bits
+        short_data = short_form.astype('>u4').tobytes()
+        long_data = long_form.astype('>u8').tobytes()
+        return [long_data[i*8:i*8+6] if x else short_data[i*4:i*4+4] for i, x in enumerate((second > 0).tolist())]
+
+    result = []
+    for timepoint in timepoints:
+        if isinstance(timepoint, (int, float)):
+            timepoint = datetime.datetime.fromtimestamp(timepoint, datetime.timezone.utc)
+        result.append(encode_timepoint_bytes(timepoint))
+    return result
+
+def decode_timepoints(values, epoch=False):
+    """Decodes a sequence of encoded timepoints at once, vectorised with NumPy when it is available 
+    and decoding to numbers of seconds since the epoch.
+
+    :param values: Encoded timepoints, as bytes-like objects
+    :type values: list
+    :param epoch: Decode to numbers of seconds since the Unix epoch rather than datetimes
+    :type epoch: bool
+    :returns: list of decoded datetimes or numbers of seconds, with None for the NOW timepoint
+    """
+
+    if not epoch: return [decode_timepoint_bytes(x) for x in values]
+
+    if numpy is not None and len(values):
+        value = numpy.array([int.from_bytes(x, 'big') for x in values], dtype=numpy.uint64)
+        n = numpy.array([len(x) * 8 for x in values], dtype=numpy.uint64)
+        mjd = (value >> (n - 18)) & 0x1ffff
+        long_form = (value >> (n - 21)) & 0x01
+        hour = (value >> (n - 26)) & 0x1f
+        minute = (value >> (n - 32)) & 0x3f
+        second = ((value >> numpy.where(long_form == 1, n - 38, 0)) & 0x3f) * long_form
+        seconds = (mjd.astype(numpy.int64) - MJD_EPOCH) * 86400 + (hour * 3600 + minute * 60 + second).astype(numpy.int64)
+        return [None if not x else y for x, y in zip(value.tolist(), seconds.tolist())]
+
+    return [decode_timepoint_epoch(x) for x in values]
+
+def decode_timepoint_epoch(data):
+    """decodes a timepoint from bytes to a number of seconds since the Unix epoch, or None for the 
+       NOW timepoint"""
+    fields = unpack_timepoint_fields(bytes(data))
+    if fields is None: return None
+    mjd, hour, minute, second, millisecond, offset = fields
+    return (mjd - MJD_EPOCH) * 86400 + hour * 3600 + minute * 60 + second
+
+def encode_bearer(bearer):
+    """encodes a bearer as a content ID, returning a bitarray. See :func:encode_bearer_bytes"""
+    return buffer_to_bitarray(encode_bearer_bytes(bearer))
+
+def encode_bearer_bytes(bearer):
+    """encodes a bearer as a content ID, returning bytes"""
+
+    if isinstance(bearer, DabBearer):
+        # b0: RFA(0)
+        
+        # b1: Ensemble Flag. Indicates whether ECC and EId are contained with the
+        # Content ID.
+        # 0 = ECC and EId are not present. The service that is referenced within the
+        # contentID is transmitted on the same ensemble as this EPG service
+        # 1 = ECC and EId are present.
+        ensemble_flag = bearer.ecc is not None and bearer.eid is not None
+
+        # b2: X-PAD flag. Indicates whether the addressed component is carried in an
+        # X-PAD channel.
+        # 0 = Is not carried in an X-PAD channel.
+        # 1 = Is carried in an X-PAD channel.
+        xpad_flag = bearer.xpad is not None
+        
+        # b3: SId encoding flag
+        # 0 = Audio service (SId is 16bit)
+        # 1 = Data service (SId is 32bit)
+        # no audio support right now
+        
+        # b4-7: SCIdS
+        fields = [(0, 1), (ensemble_flag, 1), (xpad_flag, 1), (0, 1), (bearer.scids, 4)]
+        
+        # optional next 8 bits: ECC
+        if bearer.ecc is not None:
+            fields.append((bearer.ecc, 8))
+        
+        # optional next 16 bits: EId
+        if bearer.eid is not None:
+            fields.append((bearer.eid, 16))
+        
+        # next 16/32 bits: SId
+        fields.append((bearer.sid, 16))
+        
+        # optional next 8 bits: X-PAD extension
+        if xpad_flag:
+            fields.append((bearer.xpad, 8))
+
+        return pack_fields(*fields)
+
+    elif isinstance(bearer, IpBearer):
+        return bearer.uri.encode()
+    else:
+        raise ValueError('bearer %s not currently supported', bearer)
+
+def contentid_length(bearer):
+    """returns the length in bytes of a bearer encoded as a content ID, without encoding it"""
+    if isinstance(bearer, DabBearer):
+        return 3 + (bearer.ecc is not None) + 2 * (bearer.eid is not None) + (bearer.xpad is not None)
+    elif isinstance(bearer, IpBearer):
+        return len(bearer.uri.encode())
+    else:
+        raise ValueError('bearer %s not currently supported', bearer)
+
+def encode_ensembleid(params):
+    """encodes an (ECC, EId) ensemble ID, returning a bitarray. See :func:encode_ensembleid_bytes"""
+    return buffer_to_bitarray(encode_ensembleid_bytes(params))
+
+def encode_ensembleid_bytes(params):
+
+    ecc, eid = params
+    
+    # b0: ECC
+    # b8: EId
+    return pack_number(ecc, 8) + pack_number(eid, 16)
+
+def decode_ensembleid(bits):
+    """decodes an ensemble ID from a bitarray. See :func:decode_ensembleid_bytes"""
+    return decode_ensembleid_bytes(bits.tobytes())
+
+def decode_ensembleid_bytes(data):
+    """decodes an ensemble ID from bytes, returning a tuple of (ECC, EId)"""
+
+    # b0: ECC
+    # b8: EId
+    if len(data) != 3: raise ValueError('error parsing EnsembleId from data: %s' % bytes_to_hex(data))
+    return unpack_fields(data, 8, 16)
+
+def decode_contentid(bits):
+    """decodes a ContentId from a bitarray. See :func:decode_contentid_bytes"""
+    return decode_contentid_bytes(bits.tobytes())
+
+def decode_contentid_bytes(data):
+
+    """decodes a ContentId from bytes, returning a tuple of (ECC, EId, SId, SCIdS, X-PAD). Ensemble
+       IDs have their own encoding. See :func:decode_ensembleid_bytes"""
+    
+    # b0: RFA(0)
+    
+    # b1: Ensemble Flag. Indicates whether ECC and EId are contained with the
+    # Content ID.
+    # 0 = ECC and EId are not present. The service that is referenced within the
+    # contentID is transmitted on the same ensemble as this EPG service
+    # 1 = ECC and EId are present.
+    ecc = None
+    eid = None
+    sid = None
+    scids = None
+    xpad = None
+    
+    try:
+        flags = data[0]
+        ensemble_flag = flags & 0x40
+        xpad_flag = flags & 0x20
+        sid_flag = flags & 0x10
+        
+        # SCIdS
+        scids = flags & 0x0f
+        
+        # ECC, EId
+        i = 1
+        if ensemble_flag:
+            ecc = data[1]
+            eid = int.from_bytes(data[2:4], 'big')
+            i = 4
+        
+        # SId
+        n = 4 if sid_flag else 2
+        if i + n > len(data): raise ValueError('SId is beyond the end of the data')
+        sid = int.from_bytes(data[i:i+n], 'big')
+        i += n
+            
+        # XPAD
+        if xpad_flag:
+            xpad = data[i] & 0x1f
+
+        return (ecc, eid, sid, scids, xpad)
+    except (ValueError, IndexError):
+        raise ValueError('error parsing ContentId from data: %s' % bytes_to_hex(data))
+
+def encode_tokentable(tokens):
+    """encodes the data of a token table from a dict of token tags to their strings, returning
+       bytes"""
+
+    data = bytearray()
+    for tag, value in sorted(tokens.items()):
+        if tag not in TOKENS: raise ValueError('invalid token: 0x%02x' % tag)
+        value = value.encode()
+        if len(value) > 0xff: raise ValueError('token 0x%02x is too long: %d bytes' % (tag, len(value)))
+        data.append(tag)
+        data.append(len(value))
+        data += value
+    return bytes(data)
+
+def decode_tokentable(bits):
+    """decodes a token table from a bitarray. See :func:decode_tokentable_bytes"""
+    return decode_tokentable_bytes(bits.tobytes())
+
+def decode_tokentable_bytes(data):
+    """decodes the data of a token table, returning a dict of token tags to their strings"""
+    
+    tokens = {}
+    
+    i = 0 
+    while i < len(data):
+        tag = data[i]
+        length = data[i + 1]
+        tokens[tag] = bytes(data[i+2:i+2+length]).decode()
+        i += 2 + length
+    return tokens
+
+# attribute types
+INTEGER = 'integer'
+STRING = 'string'
+DURATION = 'duration'
+GENRE = 'genre'
+TIMEPOINT = 'timepoint'
+CONTENTID = 'contentid'
+ENSEMBLEID = 'ensembleid'
+ENUM = 'enum'
+
+"""Registry of attribute types, keyed on the tag of the parent element and the attribute tag,
+   as tuples of (type, bit length, enum table). The bit length is that of fixed width integers
+   and enums. Enum tables map encoded values to their equivalents in the object model, though 
+   note that not all the values are currently implemented, which will cause the decoder to skip 
+   over their details"""
+attribute_types = {
+    # epg
+    (0x02, 0x80) : (INTEGER, 8, None), # type
+    # serviceInformation
+    (0x03, 0x80) : (INTEGER, 16, None), # version
+    (0x03, 0x81) : (TIMEPOINT, None, None), # creationTime
+    (0x03, 0x82) : (STRING, None, None), # originator
+    (0x03, 0x83) : (STRING, None, None), # serviceProvider
+    (0x03, 0x84) : (ENUM, 8, {}), # system
+    # defaultLanguage
+    (0x06, 0x80) : (STRING, None, None), # xml:lang
+    # shortName, mediumName, longName
+    (0x10, 0x80) : (STRING, None, None), # xml:lang
+    (0x11, 0x80) : (STRING, None, None),
+    (0x12, 0x80) : (STRING, None, None),
+    # genre
+    (0x14, 0x80) : (STRING, None, None), # href
+    # memberOf
+    (0x17, 0x80) : (STRING, None, None), # id
+    (0x17, 0x81) : (INTEGER, 24, None), # shortId
+    (0x17, 0x82) : (INTEGER, 16, None), # index
+    # link
+    (0x18, 0x80) : (STRING, None, None), # uri
+    (0x18, 0x81) : (STRING, None, None), # mimeValue
+    (0x18, 0x83) : (STRING, None, None), # description
+    (0x18, 0x84) : (TIMEPOINT, None, None), # expiryTime
+    # shortDescription, longDescription
+    (0x1a, 0x80) : (STRING, None, None), # xml:lang
+    (0x1b, 0x80) : (STRING, None, None),
+    # programme
+    (0x1c, 0x80) : (STRING, None, None), # id
+    (0x1c, 0x81) : (INTEGER, 24, None), # shortId
+    (0x1c, 0x82) : (INTEGER, 16, None), # version
+    (0x1c, 0x83) : (ENUM, 8, {0x01 : False, 0x02 : True}), # recommendation
+    (0x1c, 0x84) : (ENUM, 8, {0x01 : "on-air", 0x02 : "off-air"}), # broadcast
+    (0x1c, 0x87) : (INTEGER, 16, None), # bitrate
+    # programmeGroups
+    (0x20, 0x80) : (STRING, None, None),
+    (0x20, 0x81) : (TIMEPOINT, None, None),
+    (0x20, 0x82) : (STRING, None, None),
+    (0x20, 0x86) : (STRING, None, None),
+    # schedule
+    (0x21, 0x80) : (INTEGER, 16, None), # version
+    (0x21, 0x81) : (TIMEPOINT, None, None), # creationTime
+    (0x21, 0x82) : (STRING, None, None), # originator
+    # programmeGroup
+    (0x23, 0x80) : (INTEGER, 24, None),
+    (0x23, 0x81) : (INTEGER, 24, None),
+    (0x23, 0x82) : (INTEGER, 16, None),
+    (0x23, 0x84) : (INTEGER, 16, None),
+    # scope
+    (0x24, 0x80) : (TIMEPOINT, None, None), # startTime
+    (0x24, 0x81) : (TIMEPOINT, None, None), # stopTime
+    # serviceScope
+    (0x25, 0x80) : (CONTENTID, None, None), # id
+    # ensemble
+    (0x26, 0x80) : (ENSEMBLEID, None, None), # id
+    (0x26, 0x81) : (INTEGER, 16, None), # version
+    # service
+    (0x28, 0x80) : (INTEGER, 16, None), # version
+    # serviceID
+    (0x29, 0x80) : (CONTENTID, None, None), # id
+    (0x29, 0x82) : (STRING, None, None),
+    (0x2a, 0x80) : (STRING, None, None),
+    # multimedia
+    (0x2b, 0x80) : (STRING, None, None), # mimeValue
+    (0x2b, 0x81) : (STRING, None, None), # xml:lang
+    (0x2b, 0x82) : (STRING, None, None), # url
+    (0x2b, 0x83) : (ENUM, 8, {0x02 : Multimedia.LOGO_UNRESTRICTED, 
+                              0x04 : Multimedia.LOGO_COLOUR_SQUARE, 
+                              0x06 : Multimedia.LOGO_COLOUR_RECTANGLE}), # type
+    (0x2b, 0x84) : (INTEGER, 16, None), # width
+    (0x2b, 0x85) : (INTEGER, 16, None), # height
+    # time
+    (0x2c, 0x80) : (TIMEPOINT, None, None), # time
+    (0x2c, 0x81) : (DURATION, 16, None), # duration
+    (0x2c, 0x82) : (TIMEPOINT, None, None), # actualTime
+    (0x2c, 0x83) : (DURATION, 16, None), # actualDuration
+    # bearer
+    (0x2d, 0x80) : (CONTENTID, None, None), # id
+    # programmeEvent
+    (0x2e, 0x80) : (STRING, None, None), # id
+    (0x2e, 0x81) : (INTEGER, 24, None), # shortId
+    (0x2e, 0x82) : (INTEGER, 16, None), # version
+    (0x2e, 0x83) : (ENUM, 8, {0x01 : False, 0x02 : True}), # recommendation
+    (0x2e, 0x84) : (ENUM, 8, {0x01 : "on-air", 0x02 : "off-air"}), # broadcast
+    # relativeTime
+    (0x2f, 0x80) : (DURATION, 16, None), # time
+    (0x2f, 0x81) : (DURATION, 16, None), # duration
+    (0x2f, 0x82) : (DURATION, 16, None), # actualTime
+    (0x2f, 0x83) : (DURATION, 16, None), # actualDuration
+    # radiodns
+    (0x31, 0x80) : (STRING, None, None), # fqdn
+    (0x31, 0x81) : (STRING, None, None), # serviceIdentifier
+}
+
+def encode_duration(duration, n):
+    return buffer_to_bitarray(encode_duration_bytes(duration, n))
+
+def encode_duration_bytes(duration, n):
+    if isinstance(duration, timedelta): duration = duration.seconds
+    return pack_number(duration, n)
+
+def encode_enum(key, table, n):
+    values = dict((v, k) for k, v in table.items())
+    def f(value):
+        try: return pack_number(values[value], n)
+        except KeyError: raise ValueError('no enum value for parent/attribute 0x%02x/0x%02x: %s' % (key[0], key[1], value))
+    return f
+
+def decode_enum(key, table):
+    def f(data):
+        try: return table[int.from_bytes(data, 'big')]
+        except KeyError:
+            logger.warning('error decoding enum for parent 0x%02x from tag: 0x%02x - IGNORING for now' % key)
+            return bytes(data)
+    return f
+
+def compile_attribute_codecs(types):
+    """generates the dispatch tables of encoding and decoding functions for a registry of attribute 
+       types, keyed on (parent tag, attribute tag). Encoders return the encoded bytes of a value, 
+       and decoders the value of the encoded data"""
+
+    encoders = {}
+    decoders = {}
+    for key, (type, n, table) in types.items():
+        if type == INTEGER:
+            encoders[key] = lambda value, n=n: pack_number(value, n)
+            decoders[key] = lambda data: int.from_bytes(data, 'big')
+        elif type == STRING:
+            encoders[key] = lambda value: value.encode()
+            decoders[key] = lambda data: bytes(data).decode()
+        elif type == DURATION:
+            encoders[key] = lambda value, n=n: encode_duration_bytes(value, n)
+            decoders[key] = lambda data: datetime.timedelta(seconds=int.from_bytes(data, 'big'))
+        elif type == GENRE:
+            encoders[key] = encode_genre_bytes
+            decoders[key] = decode_genre_bytes
+        elif type == TIMEPOINT:
+            encoders[key] = encode_timepoint_bytes
+            decoders[key] = decode_timepoint_bytes
+        elif type == CONTENTID:
+            encoders[key] = encode_bearer_bytes
+            decoders[key] = decode_contentid_bytes
+        elif type == ENSEMBLEID:
+            encoders[key] = encode_ensembleid_bytes
+            decoders[key] = decode_ensembleid_bytes
+        elif type == ENUM:
+            encoders[key] = encode_enum(key, table, n)
+            decoders[key] = decode_enum(key, table)
+        else:
+            raise ValueError('unknown type for attribute 0x%02x/0x%02x: %s' % (key[0], key[1], type))
+    return encoders, decoders
+
+attribute_encoders, attribute_decoders = compile_attribute_codecs(attribute_types)
+
+def compile_attribute_sizers(types):
+    """generates the dispatch table of functions returning the encoded length in bytes of an attribute 
+       value for a registry of attribute types, keyed on (parent tag, attribute tag). These follow the
+       encoders without allocating the encoded values where the length can be calculated"""
+
+    sizers = {}
+    for key, (type, n, table) in types.items():
+        if type in (INTEGER, DURATION, ENUM):
+            sizers[key] = lambda value, n=n: n // 8
+        elif type == STRING:
+            sizers[key] = lambda value: len(value.encode())
+        elif type == GENRE:
+            sizers[key] = genre_length
+        elif type == TIMEPOINT:
+            sizers[key] = lambda value: len(encode_timepoint_bytes(value))
+        elif type == CONTENTID:
+            sizers[key] = contentid_length
+        elif type == ENSEMBLEID:
+            sizers[key] = lambda value: 3
+        else:
+            raise ValueError('unknown type for attribute 0x%02x/0x%02x: %s' % (key[0], key[1], type))
+    return sizers
+
+attribute_sizers = compile_attribute_sizers(attribute_types)
+
+def compile_raw_decoders(types):
+    """generates the dispatch table of decoding functions for the raw structures of :func:unmarshall,
+       keyed on (parent tag, attribute tag). These decode timepoints to numbers of seconds since the 
+       epoch and durations to numbers of seconds, and otherwise follow the attribute decoders"""
+
+    decoders = dict(attribute_decoders)
+    for key, (type, n, table) in types.items():
+        if type == TIMEPOINT:
+            decoders[key] = decode_timepoint_epoch
+        elif type == DURATION:
+            decoders[key] = lambda data: int.from_bytes(data, 'big')
+    return decoders
+
+raw_attribute_decoders = compile_raw_decoders(attribute_types)
+    
+class CData:
+
+    __slots__ = ('value', '_data')
+    
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return '<CData: %s>' % str(self)
+        
+    def tobytes(self):
+        buf = bytearray(self.encoded_length())
+        self.encode_into(memoryview(buf), 0)
+        bits = bitarray()
+        bits.frombytes(bytes(buf))
+        return bits
+
+    def encoded_length(self):
+        self._data = self.value.encode() # ensure we get the right count for the encoding
+        return header_length(len(self._data)) + len(self._data)
+
+    def encode_into(self, buf, offset):
+        data = self._data
+        offset = encode_header(buf, offset, 0x01, len(data))
+        buf[offset:offset + len(data)] = data
+        return offset + len(data)
+    
+    @staticmethod
+    def frombits(bits):
+
+        buf = memoryview(bits.tobytes())
+        tag, datalength, start = decode_header(buf, 0)
+        if tag != 0x01: raise ValueError('CData does not have the correct tag: 0x%02x != 0x01' % tag)
+        return CData(bytes(buf[start:start+datalength]).decode())
+
+def marshall(obj, out=None, **kwargs):
+    """Marshalls an :class:Epg or :class:ServiceInfo to its binary document
+    
+    :param out: Writable binary file object to stream the document to, rather than returning it. 
+                Programmes and services are then built and written one at a time
+    :type out: file
+    :param tokens: Substitute the most valuable repeated substrings of names and descriptions
+                   with tokens, declaring a token table on the top-level element. See :func:tokenise
+    :type tokens: bool
+    :param default_contentid: Declare the most common bearer of programme and event locations in a
+                              :class:ProgrammeInfo as a default content ID, omitting it from those 
+                              locations. See :func:find_default_contentid
+    :type default_contentid: bool
+    :param workers: Number of worker processes to build and encode programmes and services in, which
+                    are spliced into the document in their original order. The document is the same
+                    as when encoded in this process
+    :type workers: int
+    :param cache: Cache of encoded programmes and programme events to reuse, and to add those encoded
+                  to, when marshalling a :class:ProgrammeInfo
+    :type cache: FragmentCache
+    :param report: Also return a :class:SizeReport of where the bytes of the document went
+    :type report: bool
+    :param profile: Encoding profile, ``compact`` making the reductions of :func:compact, the bytes
+                    saved by each rule being logged and given in the size report as ``savings``
+    :type profile: str
+    :returns: the encoded document, or the number of bytes written if streaming to a file object,
+              followed by the size report in a tuple if one was asked for
+    """
+    report = SizeReport() if kwargs.get('report', False) else None
+    profile = kwargs.get('profile', None)
+    if profile == 'compact':
+        obj, savings = compact(obj)
+        for rule in COMPACT_RULES:
+            logger.info('compact rule %s saves %d bytes', rule, savings[rule])
+        if report is not None: report.savings = savings
+    elif profile is not None:
+        raise ValueError('unknown profile: %s' % profile)
+    if isinstance(obj, ServiceInfo): result = marshall_serviceinfo(obj, kwargs.get('ensemble', None), out=out, tokens=kwargs.get('tokens', False), 
+                                                                   workers=kwargs.get('workers', None), report=report)
+    elif isinstance(obj, ProgrammeInfo): result = marshall_programmeinfo(obj, out=out, tokens=kwargs.get('tokens', False), 
+                                                                         default_contentid=kwargs.get('default_contentid', True),
+                                                                         workers=kwargs.get('workers', None), cache=kwargs.get('cache', None),
+                                                                         report=report)
+    else: return None
+    if report is not None: return result, report
+    return result
+    
+def marshall_serviceinfo(info, ensemble, out=None, tokens=False, workers=None, report=None):
+
+    with worker_pool(workers) as pool:
+        return marshall_serviceinfo_with_pool(info, ensemble, out, tokens, pool, report)
+
+def marshall_serviceinfo_with_pool(info, ensemble, out, tokens, pool, report=None):
+
+    info_element = build_serviceinfo(info, ensemble, streamed=out is not None, tokens=tokens, pool=pool)
+    if out is not None: return info_element.write(out, report)
+    data = info_element.tobytes()
+    if report is not None: report.add_element(info_element)
+    return data
+
+def build_serviceinfo(info, ensemble, streamed=False, tokens=False, pool=None, services=None):
+ 
+    # serviceInformation
+    info_element = Element(0x03) if not streamed else StreamedElement(0x03)
+    if info.version > 1: info_element.attributes.append(Attribute(0x80, info.version)) 
+    if info.created: info_element.attributes.append(Attribute(0x81, info.created))
+    if info.originator: info_element.attributes.append(Attribute(0x82, info.originator))
+    if info.provider: info_element.attributes.append(Attribute(0x83, info.provider))
+
+    # default language
+    default_language_element = Element(0x06)
+    default_language_element.attributes.append(Attribute(0x80, DEFAULT_LANGUAGE)) # TODO make this configurable in a better way
+    info_element.children.append(default_language_element)
+
+    # ensemble
+    if ensemble is None: raise ValueError('must specify an ensemble')
+    ensemble_element = build_ensemble(ensemble, info.services if services is None else services, 
+                                      streamed=streamed, pool=pool, strings=tokens)
+
+    info_element.children.append(ensemble_element)
+
+    if tokens: tokenise(info_element, pool=pool)
+
+    return info_element
+
+def marshall_ensembles(info, ensembles=None, tokens=False, workers=None):
+    """Marshalls a :class:ServiceInfo to a document for each ensemble its services are carried on,
+    encoding each service once however many ensembles it is on.
+
+    :param info: ServiceInfo to marshall
+    :type info: ServiceInfo
+    :param ensembles: Ensembles to marshall documents for, otherwise one for each ECC and EId of the
+                      DAB bearers of the services. See :func:group_services
+    :type ensembles: list
+    :param tokens: Declare a token table for each document, as for :func:marshall
+    :type tokens: bool
+    :param workers: Number of worker processes to encode the services and then assemble the
+                    documents in
+    :type workers: int
+    :returns: list of tuples of (ensemble, encoded document)
+    """
+
+    groups = group_services(info.services)
+    if ensembles is None: ensembles = [Ensemble(ecc, eid) for ecc, eid in groups]
+
+    # each distinct service, encoded once
+    services = []
+    seen = set()
+    for ensemble in ensembles:
+        for service in groups.get((ensemble.ecc, ensemble.eid), []):
+            if id(service) in seen: continue
+            seen.add(id(service))
+            services.append(service)
+
+    with worker_pool(workers) as pool:
+        fragments = dict(zip(map(id, services), encode_fragments(pool, [(x, None) for x in services], strings=tokens)))
+
+        # the document header without its services, which are passed as their shared encodings
+        header = ServiceInfo(created=info.created, version=info.version, originator=info.originator, 
+                             provider=info.provider, language=info.language)
+        args = [(header, ensemble, [fragments[id(x)] for x in groups.get((ensemble.ecc, ensemble.eid), [])], tokens) 
+                for ensemble in ensembles]
+        if pool is None: documents = [assemble_serviceinfo(x) for x in args]
+        else: documents = list(pool.map(assemble_serviceinfo, args))
+
+    return list(zip(ensembles, documents))
+
+def assemble_serviceinfo(args):
+    """assembles a service information document for an ensemble from its encoded services. This is
+       run in a worker process if the documents are assembled in parallel"""
+
+    info, ensemble, fragments, tokens = args
+
+    # copies, as a token table encodes the services again for this document only
+    services = []
+    for fragment in fragments:
+        service = EncodedElement(fragment.tag, fragment.data, fragment.strings)
+        service.source = fragment.source
+        services.append(service)
+    return build_serviceinfo(info, ensemble, tokens=tokens, services=services).tobytes()
+
+def group_services(services):
+    """groups services by the ensembles their DAB bearers are on, returning an ordered dictionary of
+       lists of services keyed on the (ECC, EId) of each ensemble, in the order they first appear"""
+
+    groups = collections.OrderedDict()
+    for service in services:
+        keys = []
+        for bearer in service.bearers:
+            if not isinstance(bearer, DabBearer) or bearer.ecc is None or bearer.eid is None: continue
+            key = (bearer.ecc, bearer.eid)
+            if key not in keys: keys.append(key)
+        for key in keys:
+            groups.setdefault(key, []).append(service)
+    return groups
+
+def marshall_programmeinfo(info, out=None, tokens=False, default_contentid=True, workers=None, cache=None, report=None):
+
+    with worker_pool(workers) as pool:
+        return marshall_programmeinfo_with_pool(info, out, tokens, default_contentid, pool, cache, report)
+
+def marshall_programmeinfo_with_pool(info, out, tokens, default_contentid, pool, cache=None, report=None):
+
+    epg_element = build_programmeinfo(info, streamed=out is not None, tokens=tokens, default_contentid=default_contentid, 
+                                      pool=pool, cache=cache)
+    if out is not None: return epg_element.write(out, report)
+    data = epg_element.tobytes()
+    if report is not None: report.add_element(epg_element)
+    return data
+
+def build_programmeinfo(info, streamed=False, tokens=False, default_contentid=True, pool=None, cache=None):
+    
+    # epg (default type is DAB, so no need to encode)
+    epg_element = Element(0x02) if not streamed else StreamedElement(0x02)
+
+    # default language
+    default_language_element = Element(0x06)
+    default_language_element.attributes.append(Attribute(0x80, DEFAULT_LANGUAGE)) # TODO make this configurable in a better way
+    epg_element.children.append(default_language_element)    
+
+    # default content IDs, declared once for the epg if all schedules share the same one
+    defaults = [find_default_contentid(schedule) if default_contentid else None for schedule in info.schedules]
+    keys = set(contentid_key(x) for x in defaults)
+    if len(keys) == 1 and None not in keys: 
+        epg_element.default_contentid = defaults[0]
+     
+    for schedule, schedule_default in zip(info.schedules, defaults):
+        schedule_element = build_schedule(schedule, streamed=streamed, default_contentid=schedule_default, 
+                                          pool=pool, strings=tokens, cache=cache)
+        if schedule_default is not None and not hasattr(epg_element, 'default_contentid'):
+            schedule_element.default_contentid = schedule_default
+        epg_element.children.append(schedule_element)
+
+    if tokens: tokenise(epg_element, pool=pool, cache=cache)
+
+    return epg_element
+
+def contentid_key(bearer):
+    """returns a key identifying the content ID a bearer is encoded as, or None if it cannot be
+       used as a default content ID"""
+    if not isinstance(bearer, DabBearer): return None
+    return (bearer.ecc, bearer.eid, bearer.sid, bearer.scids, bearer.xpad)
+
+def find_default_contentid(schedule):
+    """finds the most common bearer of the programme and programme event locations in a schedule 
+       that have a single bearer, which can be declared as a default content ID. Returns None
+       if there is no such bearer"""
+
+    counts = collections.Counter()
+    bearers = {}
+    for programme in schedule.programmes:
+        locations = list(programme.locations)
+        for event in programme.events: locations.extend(event.locations)
+        for location in locations:
+            if len(location.bearers) != 1: continue
+            key = contentid_key(location.bearers[0])
+            if key is None: continue
+            counts[key] += 1
+            bearers.setdefault(key, location.bearers[0])
+    if not counts: return None
+    key, count = counts.most_common(1)[0]
+    logger.debug('found default content ID %s used by %d locations', bearers[key], count)
+    return bearers[key]
+
+"""Reductions made by the compact profile, each leaving the document meaning the same to a receiver 
+   following the specification:
+
+   * ``version`` - programme versions of 1 are omitted, being the default
+   * ``actual_time`` - actual times and durations the same as the billed ones are omitted
+
+   CRIDs are kept, as they cannot be rebuilt from the shortcrids, and timepoints keep their local 
+   time offsets, which receivers display times in.
+"""
+COMPACT_RULES = ('version', 'actual_time')
+
+def compact(obj):
+    """Applies the reductions of the compact profile to a :class:ProgrammeInfo or :class:ServiceInfo.
+    See :data:COMPACT_RULES
+
+    :returns: a copy of the object with the reductions applied, and a dictionary of the number of
+              bytes each rule saves. This is counted over the attributes omitted or shortened, so
+              is a lower bound if any element headers are shortened too
+    """
+
+    savings = dict((x, 0) for x in COMPACT_RULES)
+
+    def attribute_length(key, value):
+        length = attribute_sizers[key](value)
+        return header_length(length) + length
+
+    def compact_time(time):
+        if isinstance(time, Time):
+            time = copy.copy(time)
+            if time.actual_time is not None and time.actual_time == time.billed_time:
+                savings['actual_time'] += attribute_length((0x2c, 0x82), time.actual_time)
+                time.actual_time = None
+            if time.actual_duration is not None and time.actual_duration == time.billed_duration:
+                savings['actual_time'] += attribute_length((0x2c, 0x83), time.actual_duration)
+                time.actual_duration = None
+        elif isinstance(time, RelativeTime):
+            time = copy.copy(time)
+            if time.actual_offset is not None and time.actual_offset == time.billed_offset:
+                savings['actual_time'] += attribute_length((0x2f, 0x82), time.actual_offset)
+                time.actual_offset = None
+            if time.actual_duration is not None and time.actual_duration == time.billed_duration:
+                savings['actual_time'] += attribute_length((0x2f, 0x83), time.actual_duration)
+                time.actual_duration = None
+        return time
+
+    def compact_locations(locations):
+        result = []
+        for location in locations:
+            location = copy.copy(location)
+            location.times = [compact_time(x) for x in location.times]
+            result.append(location)
+        return result
+
+    def compact_programme(programme, tag):
+        programme = copy.copy(programme)
+        if tag == 0x1c and programme.version == 1:
+            savings['version'] += attribute_length((tag, 0x82), programme.version)
+            programme.version = None
+        programme.locations = compact_locations(programme.locations)
+        if tag == 0x1c: programme.events = [compact_programme(x, 0x2e) for x in programme.events]
+        return programme
+
+    if isinstance(obj, ProgrammeInfo):
+        result = copy.copy(obj)
+        result.schedules = []
+        for schedule in obj.schedules:
+            schedule = copy.copy(schedule)
+            schedule.programmes = [compact_programme(x, 0x1c) for x in schedule.programmes]
+            result.schedules.append(schedule)
+    elif isinstance(obj, ServiceInfo):
+        result = copy.copy(obj) # none of the rules apply to services
+    else:
+        raise ValueError('cannot compact %s' % obj)
+
+    return result, savings
+
+"""Encoded size of an element, including its header, with those of its child elements"""
+SizeEstimate = collections.namedtuple('SizeEstimate', ['tag', 'size', 'children'])
+
+def estimate_size(obj, **kwargs):
+    """Calculates the exact size of an object once marshalled, without encoding it, with the sizes
+    of each element of the document so that content can be packed against a byte budget.
+
+    Programmes and schedules are sized from the object model without building their elements, 
+    as the ``estimate_*`` functions. Token tables depend on the strings of the whole document, so 
+    a :class:ProgrammeInfo with a token table, like a :class:ServiceInfo, is sized from its elements
+    once built.
+
+    :param obj: Object to size, one of :class:ProgrammeInfo, :class:ServiceInfo, :class:Schedule
+                or :class:Programme
+    :param ensemble: Ensemble to size a :class:ServiceInfo with, as for :func:marshall
+    :type ensemble: Ensemble
+    :param tokens: Size a :class:ProgrammeInfo or :class:ServiceInfo with a token table, as for :func:marshall
+    :type tokens: bool
+    :param default_contentid: Whether to declare a default content ID for a :class:ProgrammeInfo, as
+                              for :func:marshall, or the bearer declared as the default content ID of
+                              the document a :class:Schedule or :class:Programme is sized for
+    :param sizes: Dictionary to keep the sizes of programmes in, to reuse when sizing several documents 
+                  holding the same programmes, which must not be changed in the meantime
+    :type sizes: dict
+    :returns: the size of the top-level element, with the sizes of its descendants
+    :rtype: SizeEstimate
+    """
+
+    sizes = kwargs.get('sizes', None)
+    if isinstance(obj, ServiceInfo): 
+        return measure(build_serviceinfo(obj, kwargs.get('ensemble', None), tokens=kwargs.get('tokens', False)))
+    elif isinstance(obj, ProgrammeInfo) and kwargs.get('tokens', False): 
+        return measure(build_programmeinfo(obj, tokens=True, default_contentid=kwargs.get('default_contentid', True)))
+    elif isinstance(obj, ProgrammeInfo): 
+        return estimate_programmeinfo(obj, default_contentid=kwargs.get('default_contentid', True), sizes=sizes)
+    elif isinstance(obj, Schedule): 
+        return estimate_schedule(obj, default_contentid=kwargs.get('default_contentid', None), sizes=sizes)
+    elif isinstance(obj, Programme): 
+        return estimate_programme(obj, default_contentid=kwargs.get('default_contentid', None), sizes=sizes)
+    else:
+        raise ValueError('cannot estimate the size of %s' % obj)
+
+def estimate_element(tag, attributes=(), children=None, cdata=None, tokens=None, default_contentid=None):
+    """returns the encoded size of an element as a :class:SizeEstimate, from its attributes as (tag, 
+       value) tuples, the estimates of its children, its CData and any token table and default content 
+       ID it declares, calculated from the attribute types without encoding the element"""
+
+    datalength = 0
+    if children is None: children = []
+    for child in children:
+        datalength += child.size
+    for attribute_tag, value in attributes:
+        try: f = attribute_sizers[(tag, attribute_tag)]
+        except KeyError: raise ValueError('dont know how to encode attribute value for parent 0x%02x from tag: 0x%02x' % (tag, attribute_tag))
+        length = f(value)
+        datalength += header_length(length) + length
+
+    if tokens:
+        length = len(encode_tokentable(tokens))
+        datalength += header_length(length) + length
+    if default_contentid is not None:
+        length = contentid_length(default_contentid)
+        datalength += header_length(length) + length
+
+    if cdata is not None:
+        length = len(cdata.encode())
+        datalength += header_length(length) + length
+
+    if datalength == 0: raise ValueError('element data length is zero')
+    return SizeEstimate(tag, header_length(datalength) + datalength, children)
+
+def measure(element):
+    """returns the encoded size of an element and its descendants as a :class:SizeEstimate, 
+       calculated from the attribute types without encoding the element"""
+
+    if isinstance(element, EncodedElement): return SizeEstimate(element.tag, len(element.data), [])
+    return estimate_element(element.tag, [(x.tag, x.value) for x in element.attributes], [measure(x) for x in element.children],
+                            element.cdata.value if element.cdata is not None else None, 
+                            getattr(element, 'tokens', None), getattr(element, 'default_contentid', None))
+
+def estimate_programmeinfo(info, default_contentid=True, sizes=None):
+    """returns the :class:SizeEstimate of the element :func:build_programmeinfo builds, without a token table"""
+    children = [estimate_element(0x06, [(0x80, DEFAULT_LANGUAGE)])]
+    defaults = [find_default_contentid(schedule) if default_contentid else None for schedule in info.schedules]
+    keys = set(contentid_key(x) for x in defaults)
+    shared = defaults[0] if len(keys) == 1 and None not in keys else None
+    for schedule, schedule_default in zip(info.schedules, defaults):
+        children.append(estimate_schedule(schedule, schedule_default, declared=shared is None, sizes=sizes))
+    return estimate_element(0x02, children=children, default_contentid=shared)
+
+def estimate_schedule(schedule, default_contentid=None, declared=False, sizes=None):
+    """returns the :class:SizeEstimate of the element :func:build_schedule builds, which declares the 
+       default content ID itself if ``declared``"""
+    attributes = []
+    if schedule.version is not None and schedule.version > 1: attributes.append((0x80, schedule.version))
+    attributes.append((0x81, schedule.created))
+    if schedule.originator is not None: attributes.append((0x82, schedule.originator))
+    children = []
+    scope = schedule.get_scope()
+    if scope is not None and scope.start is not None and scope.end is not None:
+        children.append(estimate_scope(scope))
+    children.extend(estimate_programme(x, default_contentid, sizes) for x in schedule.programmes)
+    return estimate_element(0x21, attributes, children, default_contentid=default_contentid if declared else None)
+
+def estimate_scope(scope):
+    children = [estimate_element(0x25, [(0x80, x)]) for x in scope.bearers]
+    return estimate_element(0x24, [(0x80, scope.start), (0x81, scope.end)], children)
+
+def estimate_programme(programme, default_contentid=None, sizes=None):
+    """returns the :class:SizeEstimate of the element :func:build_programme builds, kept in and reused 
+       from ``sizes`` if given, keyed by the programme and the default content ID"""
+    if sizes is not None:
+        key = (id(programme), contentid_key(default_contentid))
+        estimate = sizes.get(key)
+        if estimate is None: estimate = sizes[key] = estimate_programme(programme, default_contentid)
+        return estimate
+
+    attributes = [(0x81, programme.shortcrid)]
+    if programme.crid is not None: attributes.append((0x80, programme.crid))
+    if programme.version is not None: attributes.append((0x82, programme.version))
+    if programme.recommendation: attributes.append((0x83, True))
+    children = [estimate_name(x) for x in programme.names]
+    children.extend(estimate_description(x) for x in programme.descriptions)
+    children.extend(estimate_location(x, default_contentid) for x in programme.locations)
+    if programme.media: children.append(estimate_mediagroup(programme.media))
+    children.extend(estimate_genre(x) for x in programme.genres)
+    children.extend(estimate_membership(x) for x in programme.memberships)
+    children.extend(estimate_link(x) for x in programme.links)
+    children.extend(estimate_programme_event(x, default_contentid) for x in programme.events)
+    return estimate_element(0x1c, attributes, children)
+
+def estimate_programme_event(event, default_contentid=None):
+    attributes = []
+    if event.crid is not None: attributes.append((0x80, event.crid))
+    attributes.append((0x81, event.shortcrid))
+    if event.version is not None and event.version > 1: attributes.append((0x82, event.version))
+    if event.recommendation is True: attributes.append((0x83, True))
+    children = [estimate_name(x) for x in event.names]
+    children.extend(estimate_description(x) for x in event.descriptions)
+    children.extend(estimate_location(x, default_contentid) for x in event.locations)
+    if event.media: children.append(estimate_mediagroup(event.media))
+    children.extend(estimate_genre(x) for x in event.genres)
+    children.extend(estimate_membership(x) for x in event.memberships)
+    children.extend(estimate_link(x) for x in event.links)
+    return estimate_element(0x2e, attributes, children)
+
+def estimate_name(name):
+    if isinstance(name, ShortName): tag = 0x10
+    elif isinstance(name, MediumName): tag = 0x11
+    elif isinstance(name, LongName): tag = 0x12
+    attributes = [(0x80, name.language)] if name.language is not None and name.language != DEFAULT_LANGUAGE else []
+    return estimate_element(tag, attributes, cdata=name.text)
+
+def estimate_description(description):
+    tag = 0x1a if isinstance(description, ShortDescription) else 0x1b
+    attributes = [(0x80, description.language)] if description.language is not None and description.language != DEFAULT_LANGUAGE else []
+    return estimate_element(0x13, children=[estimate_element(tag, attributes, cdata=description.text)])
+
+def estimate_location(location, default_contentid=None):
+    children = [estimate_time(x) for x in location.times]
+    # a single bearer matching the default content ID is inherited
+    if not (default_contentid is not None and location.times and len(location.bearers) == 1 and 
+            contentid_key(location.bearers[0]) == contentid_key(default_contentid)):
+        children.extend(estimate_element(0x2d, [(0x80, x)]) for x in location.bearers)
+    return estimate_element(0x19, children=children)
+
+def estimate_time(time):
+    if isinstance(time, Time):
+        attributes = [(0x80, time.billed_time)]
+        if time.actual_time is not None: attributes.append((0x82, time.actual_time))
+        if time.actual_duration is not None: attributes.append((0x83, time.actual_duration.seconds))
+        attributes.append((0x81, time.billed_duration.seconds))
+        return estimate_element(0x2c, attributes)
+    elif isinstance(time, RelativeTime):
+        attributes = [(0x80, time.billed_offset.seconds), (0x81, time.billed_duration.seconds)]
+        if time.actual_offset is not None: attributes.append((0x82, time.actual_offset.seconds))
+        if time.actual_duration is not None: attributes.append((0x83, time.actual_duration.seconds))
+        return estimate_element(0x2f, attributes)
+
+def estimate_mediagroup(all_media):
+    children = []
+    for media in all_media:
+        if not isinstance(media, Multimedia):
+            raise ValueError('object must be of type %s (is %s)' % (Multimedia.__name__, type(media)))
+        attributes = []
+        if media.content is not None: attributes.append((0x80, media.content))
+        if media.url is not None: attributes.append((0x82, media.url))
+        if media.type in (Multimedia.LOGO_UNRESTRICTED, Multimedia.LOGO_COLOUR_SQUARE, Multimedia.LOGO_COLOUR_RECTANGLE):
+            attributes.append((0x83, media.type))
+        if media.type == Multimedia.LOGO_UNRESTRICTED:
+            if media.width: attributes.append((0x84, media.width))
+            if media.height: attributes.append((0x85, media.height))
+        children.append(estimate_element(0x2b, attributes))
+    return estimate_element(0x13, children=children)
+
+def estimate_genre(genre):
+    return estimate_element(0x14, [(0x80, genre.href)])
+
+def estimate_membership(membership):
+    attributes = []
+    if membership.crid is not None: attributes.append((0x80, membership.crid))
+    attributes.append((0x81, membership.shortcrid))
+    if membership.index is not None: attributes.append((0x82, membership.index))
+    return estimate_element(0x17, attributes)
+
+def estimate_link(link):
+    attributes = [(0x80, link.uri)]
+    if link.description is not None: attributes.append((0x83, link.description))
+    if link.content is not None: attributes.append((0x81, link.content))
+    if link.expiry is not None: attributes.append((0x84, link.expiry))
+    return estimate_element(0x18, attributes)
+
+"""Content types of the items of a document which are not attributes, by tag"""
+CONTENT_TYPES = {0x01 : 'cdata', 0x04 : 'tokens', 0x05 : 'default_contentid', 0x06 : 'default_language'}
+
+class SizeReport:
+    """
+    Where the bytes of an encoded document went, as lists of [count, bytes, header bytes] aggregated
+    by element tag, by attribute (parent tag, attribute tag) and by content type, being the type of
+    attribute values or of the other data. Element bytes include those of their contents, whereas
+    every byte of the document is counted once across the content types and element headers.
+    Extended length headers are those of more than 253 bytes of data, taking 2 or 3 more bytes.
+    """
+
+    def __init__(self):
+        self.elements = {}
+        self.attributes = {}
+        self.types = {}
+        self.savings = {}
+
+    @property
+    def size(self):
+        return sum(x[2] for x in self.elements.values()) + sum(x[1] for x in self.types.values())
+
+    @property
+    def header_bytes(self):
+        return sum(x[2] for x in self.elements.values()) + sum(x[2] for x in self.types.values())
+
+    @property
+    def extended_header_bytes(self):
+        count = sum(x[0] for x in self.elements.values()) + sum(x[0] for x in self.types.values())
+        return self.header_bytes - 2 * count
+
+    def add(self, table, key, header, length):
+        totals = table.get(key)
+        if totals is None: totals = table[key] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += header + length
+        totals[2] += header
+
+    def add_item(self, parent, tag, header, length):
+        """adds an attribute, definition or CData with the given header and data lengths"""
+        if tag >= 0x80 and tag <= 0x87:
+            key = (parent, tag)
+            self.add(self.attributes, key, header, length)
+            type = attribute_types[key][0] if key in attribute_types else 'unknown'
+        else:
+            type = CONTENT_TYPES.get(tag, 'unknown')
+        self.add(self.types, type, header, length)
+
+    def add_node(self, element):
+        """adds an encoded element without its child elements"""
+        datalength = element._datalength
+        self.add(self.elements, element.tag, 2 if datalength <= 253 else header_length(datalength), datalength)
+        for attribute in element.attributes:
+            length = len(attribute._data)
+            self.add_item(element.tag, attribute.tag, 2 if length <= 253 else header_length(length), length)
+        for tag, data in element._definitions:
+            self.add_item(element.tag, tag, header_length(len(data)), len(data))
+        if element.cdata is not None:
+            length = len(element.cdata._data)
+            self.add_item(element.tag, 0x01, 2 if length <= 253 else header_length(length), length)
+
+    def add_element(self, element):
+        """adds an encoded element and its descendants"""
+        if isinstance(element, EncodedElement): return self.add_encoded(element.data)
+        self.add_node(element)
+        for child in element.children: 
+            self.add_element(child)
+
+    def add_encoded(self, data):
+        """adds the elements of encoded data, walking their headers"""
+        for header in iterheaders(data):
+            self.add_header(header)
+
+    def add_header(self, header):
+        """adds an element, attribute, definition or CData by its :class:Header"""
+        if header.tag >= 0x02 and header.tag <= 0x36 and header.tag not in (0x04, 0x05, 0x06):
+            self.add(self.elements, header.tag, header.start - header.offset, header.length)
+        else:
+            self.add_item(header.parent, header.tag, header.start - header.offset, header.length)
+
+    def __repr__(self):
+        return '<SizeReport: %d bytes, %d in headers>' % (self.size, self.header_bytes)
+
+"""Encoded document holding part of a :class:ProgrammeInfo, with the start and end of the time it covers"""
+ProgrammeInfoPart = collections.namedtuple('ProgrammeInfoPart', ['data', 'start', 'end'])
+
+def split_programmeinfo(info, max_size, **kwargs):
+    """Splits a :class:ProgrammeInfo into documents which each encode to no more than a maximum size,
+    holding the programmes starting within contiguous windows of time and declaring their window as
+    the scope of their schedules. Each window ends where the next begins, so a programme may run on
+    past the end of the scope of its part. Parts are sized without a token table, which can only 
+    make them smaller.
+
+    :param info: ProgrammeInfo to split
+    :type info: ProgrammeInfo
+    :param max_size: Maximum size in bytes of each encoded document
+    :type max_size: int
+    :param kwargs: Passed on to :func:marshall to encode each document
+    :returns: the encoded documents in time order
+    :rtype: list of ProgrammeInfoPart
+    """
+
+    default_contentid = kwargs.get('default_contentid', True)
+
+    # programmes in time order, with their end time and the index of their schedule
+    programmes = []
+    for index, schedule in enumerate(info.schedules):
+        for programme in schedule.programmes:
+            times = programme.get_times()
+            if not times: raise ValueError('programme has no times to split on: %s' % programme)
+            programmes.append((min(x[0] for x in times), max(x[0] + x[1] for x in times), index, programme))
+    programmes.sort(key=lambda x: x[0])
+    if not programmes: return [ProgrammeInfoPart(marshall(info, **kwargs), None, None)]
+
+    first = min([programmes[0][0]] + [x.scope.start for x in info.schedules if x.scope.start is not None])
+    last = max([x[1] for x in programmes] + [x.scope.end for x in info.schedules if x.scope.end is not None])
+
+    def build_part(start, end):
+        window_start = first if start == 0 else programmes[start][0]
+        window_end = programmes[end][0] if end < len(programmes) else last
+        schedules = []
+        for index, schedule in enumerate(info.schedules):
+            selected = [x[3] for x in programmes[start:end] if x[2] == index]
+            if not selected: continue
+            part_schedule = Schedule(Scope(window_start, window_end, list(schedule.scope.bearers or [])), 
+                                     created=schedule.created, version=schedule.version, originator=schedule.originator)
+            part_schedule.programmes = selected
+            schedules.append(part_schedule)
+        return ProgrammeInfo(schedules=schedules), window_start, window_end
+
+    # sizes of each programme in the whole document, and of the document around them, the sizes of 
+    # the programmes being kept for sizing the parts
+    estimate_sizes = {}
+    estimate = estimate_size(info, default_contentid=default_contentid, sizes=estimate_sizes)
+    schedule_estimates = [x for x in estimate.children if x.tag == 0x21]
+    sizes = {}
+    for schedule, schedule_estimate in zip(info.schedules, schedule_estimates):
+        programme_estimates = [x for x in schedule_estimate.children if x.tag == 0x1c]
+        for programme, programme_estimate in zip(schedule.programmes, programme_estimates):
+            sizes[id(programme)] = programme_estimate.size
+    overhead = estimate.size - sum(sizes.values())
+
+    parts = []
+    start = 0
+    while start < len(programmes):
+
+        # take as many programmes as their sizes in the whole document allow, then bisect for the 
+        # most which actually fit if not all of those do, as the default content ID or scope of
+        # this part may differ
+        size, end = overhead, start
+        while end < len(programmes) and size + sizes[id(programmes[end][3])] <= max_size:
+            size += sizes[id(programmes[end][3])]
+            end += 1
+        end = max(end, start + 1)
+
+        def build_fitting_part(end):
+            part = build_part(start, end)
+            return part if estimate_size(part[0], default_contentid=default_contentid, sizes=estimate_sizes).size <= max_size else None
+
+        fitting = build_fitting_part(end)
+        if fitting is None:
+            low, high = start, end # the most programmes known to fit, and the fewest known not to
+            while high - low > 1:
+                middle = (low + high) // 2
+                part = build_fitting_part(middle)
+                if part is not None: low, fitting = middle, part
+                else: high = middle
+            if fitting is None: raise ValueError('programme does not fit within %d bytes: %s' % (max_size, programmes[start][3]))
+            end = low
+
+        part, window_start, window_end = fitting
+        parts.append(ProgrammeInfoPart(marshall(part, **kwargs), window_start, window_end))
+        start = end
+
+    return parts
+
+def encode_fragment(args, cache=None):
+    """builds and encodes a programme, programme event or service, returning it as an 
+       :class:EncodedElement. This is run in a worker process unless a cache is given"""
+
+    obj, default_contentid, tokens, strings = args
+    if isinstance(obj, Programme): element = build_programme(obj, default_contentid, cache=cache, tokens=tokens)
+    elif isinstance(obj, ProgrammeEvent): element = build_programme_event(obj, default_contentid)
+    elif isinstance(obj, Service): element = build_service(obj)
+    else: raise ValueError('cannot encode fragment from: %s' % obj)
+    fragment_strings = list(iter_tokenised_strings(element)) if strings else None
+    if tokens: substitute_tokens(element, tokens)
+    data = bytearray(element.encoded_length())
+    element.encode_into(memoryview(data), 0)
+    return EncodedElement(element.tag, bytes(data), fragment_strings)
+
+def encode_fragments(pool, sources, tokens=None, strings=False, cache=None):
+    """builds and encodes programmes, programme events or services from a list of tuples of (object,
+       default content ID), returning a list of :class:EncodedElement in the same order. Each keeps 
+       its source so it can be encoded again. They are encoded in a pool of worker processes if one 
+       is given, and only those missing from a cache if one is given"""
+
+    fragments = [None] * len(sources)
+    misses = []
+    keys = []
+    for i, (obj, default_contentid) in enumerate(sources):
+        if cache is not None:
+            key = cache.key(obj, default_contentid, tokens)
+            fragments[i] = cache.get(key)
+            keys.append(key)
+        if fragments[i] is None: misses.append(i)
+
+    # cached fragments always keep their strings, as they may be reused with tokens
+    args = [(sources[i][0], sources[i][1], tokens, strings or cache is not None) for i in misses]
+    if pool is None: encoded = [encode_fragment(x, cache) for x in args]
+    else: encoded = pool.map(encode_fragment, args, chunksize=FRAGMENT_CHUNKSIZE)
+    for i, fragment in zip(misses, encoded):
+        fragments[i] = fragment
+        if cache is not None: cache.put(keys[i], fragment)
+
+    for fragment, source in zip(fragments, sources):
+        fragment.source = source
+    return fragments
+
+class FragmentCache:
+    """
+    Cache of encoded programmes and programme events, so that only those which have changed need 
+    to be encoded again when a :class:ProgrammeInfo is marshalled repeatedly.
+    
+    Each is keyed on a fingerprint of the fields it is encoded from, along with the default content
+    ID and token table it was encoded with. Events are cached separately, so the unchanged events of a changed
+    programme are reused too.
+
+    :param maxsize: Maximum number of encoded elements to keep, the least recently used being evicted
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+
+    @staticmethod
+    def fingerprint(obj):
+        """returns a fingerprint of a programme or programme event, a tuple of the fields it is encoded
+           from. Timepoints are keyed with their UTC offsets, as they are encoded with them"""
+
+        def timepoint(value):
+            return (value, value.utcoffset()) if value is not None else None
+
+        def time(value):
+            if isinstance(value, Time): return (Time, timepoint(value.billed_time), value.billed_duration, timepoint(value.actual_time), value.actual_duration)
+            else: return (type(value), value.billed_offset, value.billed_duration, value.actual_offset, value.actual_duration)
+
+        def bearer(value):
+            key = contentid_key(value)
+            return key if key is not None else str(value)
+
+        return (type(obj), obj.crid, obj.shortcrid, obj.version, obj.recommendation,
+                tuple((type(x), x.text, x.language) for x in obj.names),
+                tuple((type(x), x.text, x.language) for x in obj.descriptions),
+                tuple((tuple(time(t) for t in x.times), tuple(bearer(b) for b in x.bearers)) for x in obj.locations),
+                tuple((x.content, x.url, x.type, x.width, x.height) for x in obj.media),
+                tuple(x.href for x in obj.genres),
+                tuple((x.crid, x.shortcrid, x.index) for x in obj.memberships),
+                tuple((x.uri, x.description, x.content, timepoint(x.expiry)) for x in obj.links),
+                tuple(FragmentCache.fingerprint(x) for x in getattr(obj, 'events', ())))
+
+    def key(self, obj, default_contentid=None, tokens=None):
+        return (self.fingerprint(obj), contentid_key(default_contentid), tuple(sorted(tokens.items())) if tokens else None)
+
+    def get(self, key):
+        """returns a new :class:EncodedElement for the entry with the given key, or None if there is 
+           no such entry"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        tag, data, strings = entry
+        return EncodedElement(tag, data, list(strings))
+
+    def put(self, key, fragment):
+        self.entries[key] = (fragment.tag, fragment.data, tuple(fragment.strings))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return '<FragmentCache: %d entries, %d hits, %d misses>' % (len(self.entries), self.hits, self.misses)
+
+def build_schedule(schedule, streamed=False, default_contentid=None, pool=None, strings=False, cache=None): 
+    
+    # schedule
+    schedule_element = Element(0x21) if not streamed else StreamedElement(0x21)
+    if schedule.version is not None and schedule.version > 1:
+        schedule_element.attributes.append(Attribute(0x80, schedule.version))
+    schedule_element.attributes.append(Attribute(0x81, schedule.created))
+    if schedule.originator is not None:
+        schedule_element.attributes.append(Attribute(0x82, schedule.originator))
+        
+    # schedule scope
+    scope = schedule.get_scope()
+    if scope is not None and scope.start is not None and scope.end is not None:
+        schedule_element.children.append(build_scope(scope))
+    
+    # programmes
+    if pool is not None or cache is not None:
+        schedule_element.children.extend(encode_fragments(pool, [(x, default_contentid) for x in schedule.programmes], strings=strings, cache=cache))
+    elif streamed:
+        schedule_element.children.append(lambda: (build_programme(x, default_contentid) for x in schedule.programmes))
+    else:
+        for programme in schedule.programmes:
+            schedule_element.children.append(build_programme(programme, default_contentid))
+    
+    return schedule_element
+
+def build_programme(programme, default_contentid=None, cache=None, tokens=None):
+    programme_element = Element(0x1c)
+    programme_element.attributes.append(Attribute(0x81, programme.shortcrid))
+    if programme.crid is not None:
+        programme_element.attributes.append(Attribute(0x80, programme.crid))
+    if programme.version is not None:
+        programme_element.attributes.append(Attribute(0x82, programme.version))
+    if programme.recommendation:
+        programme_element.attributes.append(Attribute(0x83, True))
+    # names
+    for name in programme.names:
+        child = build_name(name)
+        programme_element.children.append(child)
+    # descriptions
+    for description in programme.descriptions:
+        child = build_description(description)
+        programme_element.children.append(child)
+    # locations
+    for location in programme.locations:
+        child = build_location(location, default_contentid)
+        programme_element.children.append(child)
+    # media
+    if programme.media: programme_element.children.append(build_mediagroup(programme.media))
+    # genre
+    for genre in programme.genres:
+        child = build_genre(genre)
+        programme_element.children.append(child)
+    # membership
+    for membership in programme.memberships:
+        child = build_membership(membership)
+        programme_element.children.append(child)    
+    # link
+    for link in programme.links:
+        child = build_link(link)
+        programme_element.children.append(child)      
+    # events
+    if cache is not None:
+        programme_element.children.extend(encode_fragments(None, [(x, default_contentid) for x in programme.events], tokens=tokens, cache=cache))
+    else:
+        for event in programme.events:
+            child = build_programme_event(event, default_contentid)
+            programme_element.children.append(child)
+    
+    return programme_element
+     
+    
+def build_scope(scope):
+    scope_element = Element(0x24)
+    scope_element.attributes.append(Attribute(0x80, scope.start))
+    scope_element.attributes.append(Attribute(0x81, scope.end))
+    for bearer in scope.bearers:
+        service_scope_element = Element(0x25)
+        service_scope_element.attributes.append(Attribute(0x80, bearer))
+        scope_element.children.append(service_scope_element)
+    return scope_element
+    
+def build_name(name):
+    name_element = None
+    if isinstance(name, ShortName): name_element = Element(0x10)
+    elif isinstance(name, MediumName): name_element = Element(0x11)
+    elif isinstance(name, LongName): name_element = Element(0x12)
+    name_element.cdata = CData(name.text)
+    if name.language is not None and name.language != DEFAULT_LANGUAGE: # TODO this should do a comparison with the language of the document
+        name_element.attributes.append(Attribute(0x80, name.language))
+    return name_element
+    
+def build_location(location, default_contentid=None):
+    location_element = Element(0x19)
+    for time in location.times:
+        location_element.children.append(build_time(time))                
+    # a single bearer matching the default content ID is inherited
+    if default_contentid is not None and location.times and len(location.bearers) == 1 and \
+            contentid_key(location.bearers[0]) == contentid_key(default_contentid):
+        return location_element
+    for bearer in location.bearers:
+        bearer_element = Element(0x2d)
+        bearer_element.attributes.append(Attribute(0x80, bearer))
+        location_element.children.append(bearer_element)       
+    return location_element  
+
+def build_time(time):
+    time_element = None
+    if isinstance(time, Time):
+        time_element = Element(0x2c)
+        time_element.attributes.append(Attribute(0x80, time.billed_time))
+        if time.actual_time is not None:
+            time_element.attributes.append(Attribute(0x82, time.actual_time))
+        if time.actual_duration is not None:
+            time_element.attributes.append(Attribute(0x83, time.actual_duration.seconds))            
+        time_element.attributes.append(Attribute(0x81, time.billed_duration.seconds))
+    elif isinstance(time, RelativeTime):
+        time_element = Element(0x2f)
+        time_element.attributes.append(Attribute(0x80, time.billed_offset.seconds))
+        time_element.attributes.append(Attribute(0x81, time.billed_duration.seconds))
+        if time.actual_offset is not None:
+            time_element.attributes.append(Attribute(0x82, time.actual_offset.seconds))
+        if time.actual_duration is not None:
+            time_element.attributes.append(Attribute(0x83, time.actual_duration.seconds))
+    return time_element   
+    
+def build_description(description):
+    mediagroup_element = Element(0x13)
+    if isinstance(description, ShortDescription):
+        description_element = Element(0x1a)
+        description_element.cdata = CData(description.text)
+    elif isinstance(description, LongDescription):
+        description_element = Element(0x1b)
+        description_element.cdata = CData(description.text)        
+    if description.language is not None and description.language != DEFAULT_LANGUAGE: # TODO this should do a comparison with the language of the document
+        description_element.attributes.append(Attribute(0x80, description.language))
+    mediagroup_element.children.append(description_element)
+    return mediagroup_element
+
+def build_mediagroup(all_media):
+    mediagroup_element = Element(0x13)
+    
+    for media in all_media :
+        
+        if not isinstance(media, Multimedia):
+            raise ValueError('object must be of type %s (is %s)' % (Multimedia.__name__, type(media)))
+        
+        media_element = Element(0x2b)
+        
+        if media.content is not None:
+            media_element.attributes.append(Attribute(0x80, media.content))
+        if media.url is not None:
+            media_element.attributes.append(Attribute(0x82, media.url))
+        if media.type in (Multimedia.LOGO_UNRESTRICTED, Multimedia.LOGO_COLOUR_SQUARE, Multimedia.LOGO_COLOUR_RECTANGLE):
+            media_element.attributes.append(Attribute(0x83, media.type))
+        if media.type == Multimedia.LOGO_UNRESTRICTED:
+            if media.width: media_element.attributes.append(Attribute(0x84, media.width))
+            if media.height: media_element.attributes.append(Attribute(0x85, media.height))
+        
+        mediagroup_element.children.append(media_element)
+
+    return mediagroup_element
+    
+def build_genre(genre):
+    genre_element = Element(0x14)
+    genre_element.attributes.append(Attribute(0x80, genre.href))
+    return genre_element    
+    
+def build_membership(membership):
+    membership_element = Element(0x17)
+    if membership.crid is not None:
+        membership_element.attributes.append(Attribute(0x80, membership.crid))
+    membership_element.attributes.append(Attribute(0x81, membership.shortcrid))
+    if membership.index is not None: 
+        membership_element.attributes.append(Attribute(0x82, membership.index))
+    return membership_element  
+    
+def build_link(link):
+    link_element = Element(0x18)
+    link_element.attributes.append(Attribute(0x80, link.uri))
+    if link.description is not None:
+        link_element.attributes.append(Attribute(0x83, link.description))
+    if link.content is not None:
+        link_element.attributes.append(Attribute(0x81, link.content))
+    if link.expiry is not None:
+        link_element.attributes.append(Attribute(0x84, link.expiry))
+    return link_element   
+
+def build_programme_event(event, default_contentid=None):
+    event_element = Element(0x2e)
+    if event.crid is not None:
+        event_element.attributes.append(Attribute(0x80, event.crid))
+    event_element.attributes.append(Attribute(0x81, event.shortcrid))
+    if event.version is not None and event.version > 1:
+        event_element.attributes.append(Attribute(0x82, event.version))
+    if event.recommendation is True:
+        event_element.attributes.append(Attribute(0x83, True))
+    # names
+    for name in event.names:
+        event_element.children.append(build_name(name))
+    # descriptions
+    for description in event.descriptions:
+        event_element.children.append(build_description(description))
+    # locations
+    for location in event.locations:
+        event_element.children.append(build_location(location, default_contentid))    
+    # media
+    if event.media: event_element.children.append(build_mediagroup(event.media))
+    # genre
+    for genre in event.genres:
+        event_element.children.append(build_genre(genre))
+    # membership
+    for membership in event.memberships:
+        event_element.children.append(build_membership(membership))  
+    # link
+    for link in event.links:
+        event_element.children.append(build_link(link))   
+             
+    return event_element
+
+def build_service(service):
+    if not isinstance(service, Service): raise ValueError("must be an object of type %s (is %s)" % (Service.__name__, type(service)))
+
+    logger.debug('building service: %s', service)
+
+    service_element = Element(0x28)
+
+    # version
+    if service.version > 1: service_element.attributes.append(Attribute(0x80, service.version)) 
+
+    # service IDs - the first in the list is primary, all others secondary 
+    for bearer in service.bearers:
+        serviceid_element = Element(0x29)
+        serviceid_element.attributes.append(Attribute(0x80, bearer))    
+        service_element.children.append(serviceid_element)
+
+    # names
+    for name in service.names:
+        service_element.children.append(build_name(name))
+
+    # descriptions
+    for description in service.descriptions:
+        service_element.children.append(build_description(description))
+
+    # media
+    if service.media: service_element.children.append(build_mediagroup(service.media))
+    
+    # genre
+    for genre in service.genres:
+        service_element.children.append(build_genre(genre))
+
+    # language TODO
+
+    # keywords 
+    if len(service.keywords):
+        service_element.children.append(build_keywords(service.keywords))    
+
+    # links TODO
+
+    # radiodns lookup
+    if service.lookup:
+        if isinstance(service.lookup, Lookup):
+            fqdn, identifier = service.lookup.fqdn, service.lookup.serviceIdentifier
+        else: # a URL of the FQDN and service identifier
+            from urllib.parse import urlparse
+            url = urlparse(service.lookup)
+            fqdn, identifier = url.netloc, url.path[1:]
+        lookup_element = Element(0x31)
+        lookup_element.attributes.append(Attribute(0x80, fqdn))
+        lookup_element.attributes.append(Attribute(0x81, identifier))
+        service_element.children.append(lookup_element)
+
+    return service_element
+
+def build_keywords(keywords):
+    keywords_element = Element(0x16) # TODO encode langauges
+    keywords_element.cdata = CData(",".join(keywords))
+    return keywords_element
+
+def build_ensemble(ensemble, services, streamed=False, pool=None, strings=False):
+    logger.debug('building ensemble: %s', ensemble)
+    ensemble_element = Element(0x26) if not streamed else StreamedElement(0x26)
+
+    ensemble_element.attributes.append(Attribute(0x80, (ensemble.ecc, ensemble.eid)))
+    if ensemble.version > 1: ensemble_element.attributes.append(Attribute(0x81, ensemble.version))
+
+    # names
+    for name in ensemble.names:
+        ensemble_element.children.append(build_name(name))
+
+    # descriptions
+    for description in ensemble.descriptions:
+        ensemble_element.children.append(build_description(description))
+
+    # media
+    if ensemble.media: ensemble_element.children.append(build_mediagroup(ensemble.media))
+
+    # keywords
+
+    # links
+
+    # services
+    if pool is not None:
+        ensemble_element.children.extend(encode_fragments(pool, [(x, None) for x in services], strings=strings))
+    elif streamed:
+        ensemble_element.children.append(lambda: (x if isinstance(x, EncodedElement) else build_service(x) for x in services))
+    else:
+        for service in services:
+            service_element = service if isinstance(service, EncodedElement) else build_service(service) 
+            ensemble_element.children.append(service_element)
+
+    return ensemble_element
+
+"""Tags of the token which can be declared in a token table, being the control characters
+   other than tab, line feed and carriage return"""
+TOKENS = (0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x0b, 0x0c, 0x0e, 0x0f, 0x10, 0x11, 0x12, 0x13)
+
+"""Tags of the elements whose CData may contain tokens"""
+TOKENISED_ELEMENTS = (0x10, 0x11, 0x12, 0x1a, 0x1b)
+
+def iter_tokenised_strings(element):
+    """yields the strings of an element and its descendants which may contain tokens, including
+       those of generated children and those kept by encoded elements"""
+
+    if isinstance(element, EncodedElement): 
+        yield from element.strings
+        return
+    if element.tag in TOKENISED_ELEMENTS and element.cdata is not None:
+        yield element.cdata.value
+    children = element.iter_children() if isinstance(element, StreamedElement) else element.children
+    for child in children:
+        yield from iter_tokenised_strings(child)
+
+def substitute_tokens(element, tokens):
+    """replaces the strings of a token table with their tokens in the names and descriptions of an 
+       element and its descendants. Generated children are substituted as they are built, and 
+       encoded elements must be encoded again"""
+
+    if isinstance(element, EncodedElement): return element
+    if element.tag in TOKENISED_ELEMENTS and element.cdata is not None:
+        element.cdata.value = replace_tokens(element.cdata.value, tokens)
+    for i, child in enumerate(element.children):
+        if callable(child):
+            element.children[i] = lambda f=child: (substitute_tokens(x, tokens) for x in f())
+        else:
+            substitute_tokens(child, tokens)
+    return element
+
+def replace_tokens(s, tokens):
+    for tag, value in tokens.items():
+        s = s.replace(value, chr(tag))
+    return s
+
+token_word_pattern = re.compile('\\s*[^\\s\\x01-\\x08\\x0b\\x0c\\x0e-\\x13]+')
+token_split_pattern = re.compile('[\\x01-\\x08\\x0b\\x0c\\x0e-\\x13]')
+
+def build_token_table(strings, tags=TOKENS, max_words=4):
+    """Chooses the token table giving the greatest saving for a list of strings, greedily picking 
+    the repeated runs of up to ``max_words`` words which save the most bytes over the cost of their 
+    declaration, and substituting each before choosing the next.
+
+    :param strings: Strings to tokenise
+    :type strings: list
+    :param tags: Token tags which may be declared
+    :type tags: list
+    :returns: the token table, as a dict of token tags to their strings
+    """
+    
+    strings = list(strings)
+    tokens = {}
+    for tag in tags:
+        counts = collections.Counter()
+        for s in strings:
+            for segment in token_split_pattern.split(s):
+                words = token_word_pattern.findall(segment)
+                for i in range(len(words)):
+                    candidate = ''
+                    for word in words[i:i+max_words]:
+                        candidate += word
+                        counts[candidate] += 1
+
+        # each occurrence saves all but the token byte, less the token declaration itself
+        best, best_saving = None, 0
+        for candidate, count in counts.items():
+            if count < 2: continue
+            length = len(candidate.encode())
+            if length > 0xff: continue
+            saving = count * (length - 1) - (length + 2)
+            if saving > best_saving: best, best_saving = candidate, saving
+        if best is None: break
+
+        tokens[tag] = best
+        strings = [s.replace(best, chr(tag)) for s in strings]
+        logger.debug('chose token 0x%02x for "%s", saving up to %d bytes', tag, best, best_saving)
+    
+    return tokens
+
+def iter_encoded_elements(element):
+    if isinstance(element, EncodedElement): 
+        yield element
+        return
+    for child in element.children:
+        if not callable(child): yield from iter_encoded_elements(child)
+
+def tokenise(element, max_words=4, pool=None, cache=None):
+    """Substitutes the most valuable repeated substrings of the names and descriptions of an element
+    and its descendants with tokens, declaring the token table on the element. Tokens already used
+    in the strings are never declared.
+
+    :param element: Element to tokenise, usually the top-level element of a document
+    :type element: Element
+    :param pool: Pool of worker processes to encode any encoded elements again in, with the tokens
+    :type pool: concurrent.futures.Executor
+    :param cache: Cache to encode any encoded elements again through
+    :type cache: FragmentCache
+    :returns: the number of bytes saved. This is counted over the character data and the token table,
+              so is a lower bound if any element headers are shortened too
+    """
+
+    strings = list(iter_tokenised_strings(element))
+    used = set(ord(c) for s in strings for c in token_split_pattern.findall(s))
+    tokens = build_token_table(strings, tags=[x for x in TOKENS if x not in used], max_words=max_words)
+    if not tokens: 
+        logger.info('no token table gives a saving')
+        return 0
+
+    def cdata_length(s):
+        length = len(s.encode())
+        return header_length(length) + length
+
+    saving = sum(cdata_length(s) - cdata_length(replace_tokens(s, tokens)) for s in strings)
+    table = len(encode_tokentable(tokens))
+    saving -= header_length(table) + table
+    if saving <= 0:
+        logger.info('no token table gives a saving')
+        return 0
+
+    substitute_tokens(element, tokens)
+    fragments = list(iter_encoded_elements(element))
+    if fragments:
+        for fragment, encoded in zip(fragments, encode_fragments(pool, [x.source for x in fragments], tokens=tokens, cache=cache)):
+            fragment.data = encoded.data
+    element.tokens = tokens
+    logger.info('token table of %d tokens saves %d bytes', len(tokens), saving)
+    return saving
+
+token_table_pattern = re.compile('([\\x01\\x02\\x03\\x04\\x05\\x06\\x07\\x08\\x0b\\x0c\\x0e\\x0f\\x10\\x11\\x12\\x13])')
+def find_inherited(e, name):
+    """returns the token table or default content ID in effect for an element, from the context 
+       resolved when it was decoded, or otherwise by walking up its parents"""
+    context = getattr(e, 'context', None)
+    if context is not None: return context[0] if name == 'tokens' else context[1]
+    x = e
+    while x:
+        if hasattr(x, name):
+            return getattr(x, name)
+        elif hasattr(x, 'parent'):
+            x = x.parent
+        else:
+            break
+    return None
+
+def apply_token_table(val, e):
+    tokens = find_inherited(e, 'tokens')
+    if tokens is not None:
+        matcher = token_table_pattern.findall(val)
+        if not matcher: return val
+        for group in matcher: 
+            val = val.replace(group, tokens[ord(group)])
+        matcher = token_table_pattern.search(val)
+        if matcher: 
+            logger.warning('%d tokens (%s) still remain in string "%s" from table: %s', len(matcher.groups()), matcher.groups(), val, tokens)
+    return val        
+
+def print_info(e):
+    print(e.attributes)
+    print(e.children)
+    print(e.cdata)
+
+def parse_time(e):
+    billed_time = e.get_attributes(0x80)[0].value
+    billed_duration = e.get_attributes(0x81)[0].value
+    actual_time = None
+    if e.has_attribute(0x82): actual_time = e.get_attributes(0x82)[0].value
+    actual_duration = None
+    if e.has_attribute(0x82): actual_duration = e.get_attributes(0x83)[0].value
+    time = Time(billed_time, billed_duration, actual_time, actual_duration)
+    return time
+
+def parse_contentid(contentid):
+    """returns the :class:DabBearer of a decoded (ECC, EId, SId, SCIdS, X-PAD) content ID, without an
+       ECC and EId if the service is on the same ensemble as the document"""
+    ecc, eid, sid, scids, xpad = contentid
+    return DabBearer(ecc, eid, sid, scids, xpad=xpad)
+
+def parse_bearer(e):
+    id = e.get_attributes(0x80)[0].value
+    bearer = parse_contentid(id)
+    return bearer
+    
+
+def parse_location(e):
+    
+    location = Location()
+    
+    # times
+    for c in e.get_children(0x2c):
+        location.times.append(parse_time(c))
+        
+    # bearer
+    for c in e.get_children(0x2d):
+        location.bearers.append(parse_bearer(c)) 
+    
+    # apply a default content ID
+    if not len(location.bearers):
+        default_contentid = find_inherited(e, 'default_contentid')
+        if default_contentid is not None: location.bearers.append(parse_contentid(default_contentid))
+    #if not len(location.bearers):
+    #    raise ValueError('location has no bearers and no default content ID is defined')
+    
+    return location
+
+def parse_programme(e):    
+    
+    crid = e.get_attributes(0x80)[0].value
+    shortid = e.get_attributes(0x81)[0].value
+    programme = Programme(crid, shortid)
+    
+    # names
+    for c in e.get_children(0x10):
+        val = apply_token_table(c.cdata.value, e)
+        name = ShortName(val)
+        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
+        programme.names.append(name)
+    for c in e.get_children(0x11):
+        val = apply_token_table(c.cdata.value, e)
+        name = MediumName(val)        
+        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
+        programme.names.append(name)
+    for c in e.get_children(0x12):
+        val = apply_token_table(c.cdata.value, e)
+        name = LongName(val)
+        if(c.has_attribute(0x80)): name.language = c.get_attributes(0x80)[0].value
+        programme.names.append(name)
+        
+    # media
+    for c in e.get_children(0x13):
+        # short description
+        for d in c.get_children(0x1a):
+            val = apply_token_table(d.cdata.value, e)
+            description = ShortDescription(val)
+            if(d.has_attribute(0x80)): description.language = d.get_attributes(0x80)[0].value
+            programme.descriptions.append(description)
+        # long description
+        for d in c.get_children(0x1b):
+            val = apply_token_table(d.cdata.value, e)
+            description = LongDescription(val)
+            if(d.has_attribute(0x80)): description.language = d.get_attributes(0x80)[0].value
+            programme.descriptions.append(description)
+        # multimedia
+        for d in c.get_children(0x2b):
+            url = d.get_attributes(0x82)[0].value
+            multimedia = Multimedia(url, type=None)
+            if(d.has_attribute(0x80)): multimedia.content = d.get_attributes(0x80)[0].value # MIME content type
+            if(d.has_attribute(0x81)): pass # nowhere to store language yet 
+            if(d.has_attribute(0x83)): multimedia.type = d.get_attributes(0x83)[0].value # logo type
+            if(d.has_attribute(0x84)): multimedia.width = d.get_attributes(0x84)[0].value # logo width
+            if(d.has_attribute(0x85)): multimedia.height = d.get_attributes(0x85)[0].value # logo height
+            programme.media.append(multimedia)
+    
+    # location
+    for c in e.get_children(0x19):
+        programme.locations.append(parse_location(c))
+    
+    return programme
+ 
+def parse_schedule(e):
+    
+    # scope start, end    
+    scope = Scope(None, None)
+    for scope_element in e.get_children(0x24):
+        start = scope_element.get_attributes(0x80)
+        end = scope_element.get_attributes(0x81)
+        bearers = [parse_contentid(x.get_attributes(0x80)[0].value) for x in scope_element.get_children(0x25) if x.has_attribute(0x80)]
+        scope = Scope(start[0].value if start else None, end[0].value if end else None, bearers)
+
+    schedule = Schedule(scope)
+    
+    # programmes
+    programme_elements = e.get_children(0x1c)
+    for p in programme_elements: 
+        programme = parse_programme(p)
+        schedule.programmes.append(programme)
+        
+    return schedule
+
+def parse_epg(e):
+    schedule = parse_schedule(e.get_children(0x21)[0])
+    info = ProgrammeInfo(schedules=[]) # not the shared default list
+    info.schedules.append(schedule)
+    return info
+
+def parse_service(e):
+    logger.debug('parsing service from element: %s', e)
+    id = e.get_children(0x29)[0].get_attributes(0x80)[0].value
+    service = Service(id)
+    
+    # names
+    for c in e.get_children(0x10):
+        val = apply_token_table(c.cdata.value, e)
+        service.names.append(ShortName(val))
+    for c in e.get_children(0x11):
+        val = apply_token_table(c.cdata.value, e)
+        service.names.append(MediumName(val))
+    for c in e.get_children(0x12):
+        val = apply_token_table(c.cdata.value, e)
+        service.names.append(LongName(val)) 
+    return service
+    
+
+def parse_ensemble(e):    
+    id = e.get_attributes(0x80)[0].value
+    ensemble = Ensemble(*id)
+    
+    # names
+    for c in e.get_children(0x10):
+        val = apply_token_table(c.cdata.value, e)
+        ensemble.names.append(ShortName(val))
+    for c in e.get_children(0x11):
+        val = apply_token_table(c.cdata.value, e)
+        ensemble.names.append(MediumName(val))
+    for c in e.get_children(0x12):
+        val = apply_token_table(c.cdata.value, e)
+        ensemble.names.append(LongName(val)) 
+        
+    # services
+    services = []
+    for c in e.get_children(0x28):
+        services.append(parse_service(c))
+    
+    return ensemble, services
+
+def parse_service_information(e):
+    service_info = ServiceInfo()
+    if not e.has_child(0x26):
+        raise ValueError('no ensemble subelement (0x26): children=%s' % e.get_children())
+    ensemble, services = parse_ensemble(e.get_children(0x26)[0])
+    service_info.services = services
+    return service_info, ensemble
+    
+"""Kinds of the names and descriptions in raw structures, keyed on their element tags"""
+RAW_NAMES = {0x10 : 'short', 0x11 : 'medium', 0x12 : 'long'}
+RAW_DESCRIPTIONS = {0x1a : 'short', 0x1b : 'long'}
+
+"""Classes of the names and descriptions of raw structures, keyed on their kinds"""
+RAW_NAME_KINDS = {'short' : ShortName, 'medium' : MediumName, 'long' : LongName}
+RAW_DESCRIPTION_KINDS = {'short' : ShortDescription, 'long' : LongDescription}
+
+def scan_raw(buf, tag, start, end):
+    """decodes the data of an element between the start and end offsets of a memoryview without 
+       building an :class:Element, returning a tuple of a dict of its raw attribute values by tag, a
+       list of the (tag, start, end) of its children, its CData, token table and default content ID"""
+
+    attributes = {}
+    children = []
+    cdata = tokens = default_contentid = None
+    i = start
+    while i < end:
+        child_tag, child_datalength, child_start = decode_header(buf, i)
+        child_end = child_start + child_datalength
+        if child_end > end:
+            raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (child_tag, i, child_end, end))
+        if child_tag >= 0x80 and child_tag <= 0x87:
+            try: f = raw_attribute_decoders[(tag, child_tag)]
+            except KeyError: raise ValueError('dont know how to decode attribute value for parent 0x%02x from tag: 0x%02x' % (tag, child_tag))
+            attributes[child_tag] = f(buf[child_start:child_end])
+        elif child_tag == 0x01:
+            cdata = bytes(buf[child_start:child_end]).decode()
+        elif child_tag == 0x04:
+            tokens = decode_tokentable_bytes(buf[child_start:child_end])
+        elif child_tag == 0x05:
+            default_contentid = decode_contentid_bytes(buf[child_start:child_end])
+        elif child_tag == 0x06:
+            pass # not yet implemented
+        elif child_tag >= 0x02 and child_tag <= 0x36:
+            children.append((child_tag, child_start, child_end))
+        else:
+            raise ValueError('unknown element 0x%02x under parent 0x%02x' % (child_tag, tag))
+        i = child_end
+    return attributes, children, cdata, tokens, default_contentid
+
+def parse_raw_text(buf, tag, start, end, tokens, kinds):
+    """returns a (kind, text, language) tuple of a name or description, with its tokens applied"""
+    attributes, _, cdata, _, _ = scan_raw(buf, tag, start, end)
+    if cdata is not None and tokens: cdata = cdata.translate(tokens)
+    return kinds[tag], cdata, attributes.get(0x80)
+
+def parse_raw_location(buf, start, end, default_contentid):
+    _, children, _, _, _ = scan_raw(buf, 0x19, start, end)
+    times = []
+    relative_times = []
+    bearers = []
+    for tag, child_start, child_end in children:
+        if tag in (0x2c, 0x2f):
+            attributes = scan_raw(buf, tag, child_start, child_end)[0]
+            (times if tag == 0x2c else relative_times).append((attributes.get(0x80), attributes.get(0x81), attributes.get(0x82), attributes.get(0x83)))
+        elif tag == 0x2d:
+            attributes = scan_raw(buf, tag, child_start, child_end)[0]
+            if 0x80 in attributes: bearers.append(attributes[0x80])
+    if not bearers and default_contentid is not None: bearers.append(default_contentid)
+    return {'times' : times, 'relative_times' : relative_times, 'bearers' : bearers}
+
+def parse_raw_described(buf, tag, start, end, tokens, item):
+    """decodes a child element of the kinds common to programmes, programme events and services into
+       the raw structure of its parent, returning whether it was one of them"""
+    if tag in RAW_NAMES:
+        item['names'].append(parse_raw_text(buf, tag, start, end, tokens, RAW_NAMES))
+    elif tag == 0x13:
+        for media_tag, media_start, media_end in scan_raw(buf, tag, start, end)[1]:
+            if media_tag in RAW_DESCRIPTIONS:
+                item['descriptions'].append(parse_raw_text(buf, media_tag, media_start, media_end, tokens, RAW_DESCRIPTIONS))
+            elif media_tag == 0x2b:
+                media = scan_raw(buf, media_tag, media_start, media_end)[0]
+                item['media'].append((media.get(0x82), media.get(0x80), media.get(0x83), media.get(0x84), media.get(0x85), media.get(0x81)))
+    elif tag == 0x14:
+        item['genres'].append(scan_raw(buf, tag, start, end)[0].get(0x80))
+    elif tag == 0x16:
+        cdata = scan_raw(buf, tag, start, end)[2]
+        if cdata: item['keywords'].extend(x.strip() for x in cdata.split(','))
+    elif tag == 0x17:
+        attributes = scan_raw(buf, tag, start, end)[0]
+        item['memberships'].append((attributes.get(0x80), attributes.get(0x81), attributes.get(0x82)))
+    elif tag == 0x18:
+        attributes = scan_raw(buf, tag, start, end)[0]
+        item['links'].append((attributes.get(0x80), attributes.get(0x81), attributes.get(0x83), attributes.get(0x84)))
+    else:
+        return False
+    return True
+
+def parse_raw_programme(buf, start, end, tokens, default_contentid, tag=0x1c):
+    """decodes a programme, or a programme event with the tag 0x2e"""
+    attributes, children, _, programme_tokens, programme_contentid = scan_raw(buf, tag, start, end)
+    if programme_tokens is not None: tokens = programme_tokens
+    if programme_contentid is not None: default_contentid = programme_contentid
+    programme = {'crid' : attributes.get(0x80), 'shortcrid' : attributes.get(0x81), 'version' : attributes.get(0x82),
+                 'recommendation' : attributes.get(0x83), 'broadcast' : attributes.get(0x84),
+                 'names' : [], 'descriptions' : [], 'media' : [], 'genres' : [], 'keywords' : [], 'memberships' : [], 
+                 'links' : [], 'locations' : []}
+    if tag == 0x1c: programme['events'] = []
+    for child_tag, child_start, child_end in children:
+        if parse_raw_described(buf, child_tag, child_start, child_end, tokens, programme): continue
+        elif child_tag == 0x19:
+            programme['locations'].append(parse_raw_location(buf, child_start, child_end, default_contentid))
+        elif child_tag == 0x2e and tag == 0x1c:
+            programme['events'].append(parse_raw_programme(buf, child_start, child_end, tokens, default_contentid, tag=0x2e))
+    return programme
+
+def parse_raw_schedule(buf, start, end, tokens, default_contentid):
+    attributes, children, _, schedule_tokens, schedule_contentid = scan_raw(buf, 0x21, start, end)
+    if schedule_tokens is not None: tokens = schedule_tokens
+    if schedule_contentid is not None: default_contentid = schedule_contentid
+    schedule = {'version' : attributes.get(0x80), 'created' : attributes.get(0x81), 'originator' : attributes.get(0x82),
+                'scope' : None, 'programmes' : []}
+    for tag, child_start, child_end in children:
+        if tag == 0x24:
+            scope, scope_children, _, _, _ = scan_raw(buf, tag, child_start, child_end)
+            bearers = [scan_raw(buf, x, y, z)[0].get(0x80) for x, y, z in scope_children if x == 0x25]
+            schedule['scope'] = (scope.get(0x80), scope.get(0x81), [x for x in bearers if x is not None])
+        elif tag == 0x1c:
+            schedule['programmes'].append(parse_raw_programme(buf, child_start, child_end, tokens, default_contentid))
+    return schedule
+
+def parse_raw_service(buf, start, end, tokens):
+    attributes, children, _, service_tokens, _ = scan_raw(buf, 0x28, start, end)
+    if service_tokens is not None: tokens = service_tokens
+    service = {'version' : attributes.get(0x80), 'bearers' : [], 'names' : [], 'descriptions' : [], 'media' : [], 
+               'genres' : [], 'keywords' : [], 'memberships' : [], 'links' : [], 'lookup' : None}
+    for tag, child_start, child_end in children:
+        if parse_raw_described(buf, tag, child_start, child_end, tokens, service): continue
+        elif tag == 0x29:
+            id = scan_raw(buf, tag, child_start, child_end)[0].get(0x80)
+            if id is not None: service['bearers'].append(id)
+        elif tag == 0x31:
+            lookup = scan_raw(buf, tag, child_start, child_end)[0]
+            service['lookup'] = (lookup.get(0x80), lookup.get(0x81))
+    return service
+
+def parse_raw(buf):
+    """Decodes an encoded PI or SI document to a structure of plain dicts, lists and tuples, without 
+    building the object model. Timepoints are given as numbers of seconds since the Unix epoch, 
+    durations as numbers of seconds, content IDs as tuples of (ECC, EId, SId, SCIdS, X-PAD), names
+    and descriptions as tuples of (kind, text, language) with any tokens applied, multimedia as 
+    tuples of (url, content type, type, width, height, language), memberships as tuples of (crid, 
+    short crid, index), links as tuples of (uri, content type, description, expiry time) and the 
+    RadioDNS lookup of a service as a tuple of (FQDN, service identifier).
+
+    A PI document decodes to ``{'type': 'epg', 'schedules': [...]}`` and an SI document to
+    ``{'type': 'serviceInformation', 'ensemble': {...}, ...}``. Schedules, programmes, programme events,
+    ensembles and services keep all of the attributes and children that :func:marshall encodes. 
+    Default language elements and programme groups are not decoded. See :func:materialize to convert
+    these to the object model.
+
+    :param buf: Encoded document
+    :type buf: memoryview
+    """
+
+    if not isinstance(buf, memoryview): buf = memoryview(buf)
+    tag, datalength, start = decode_header(buf, 0)
+    end = start + datalength
+    if end > len(buf):
+        raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (tag, 0, end, len(buf)))
+    attributes, children, _, tokens, default_contentid = scan_raw(buf, tag, start, end)
+
+    if tag == 0x02:
+        return {'type' : 'epg', 'schedules' : [parse_raw_schedule(buf, x, y, tokens, default_contentid) for t, x, y in children if t == 0x21]}
+    elif tag == 0x03:
+        info = {'type' : 'serviceInformation', 'version' : attributes.get(0x80), 'created' : attributes.get(0x81),
+                'originator' : attributes.get(0x82), 'provider' : attributes.get(0x83), 'ensemble' : None}
+        for child_tag, child_start, child_end in children:
+            if child_tag != 0x26: continue
+            ensemble_attributes, ensemble_children, _, ensemble_tokens, _ = scan_raw(buf, child_tag, child_start, child_end)
+            if ensemble_tokens is not None: tokens = ensemble_tokens
+            ensemble = {'id' : ensemble_attributes.get(0x80), 'version' : ensemble_attributes.get(0x81), 'names' : [], 'descriptions' : [], 
+                        'media' : [], 'genres' : [], 'keywords' : [], 'memberships' : [], 'links' : [], 'services' : []}
+            for x, y, z in ensemble_children:
+                if parse_raw_described(buf, x, y, z, tokens, ensemble): continue
+                elif x == 0x28: ensemble['services'].append(parse_raw_service(buf, y, z, tokens))
+            info['ensemble'] = ensemble
+            break
+        if info['ensemble'] is None: raise ValueError('no ensemble subelement (0x26)')
+        return info
+    else:
+        raise ValueError('document is neither serviceInformation nor epg: 0x%02x' % tag)
+
+def materialize_timepoint(value):
+    """returns a UTC datetime for a number of seconds since the Unix epoch"""
+    if value is None: return None
+    return datetime.datetime.fromtimestamp(value, get_timezone(0))
+
+def materialize_duration(value):
+    if value is None: return None
+    return datetime.timedelta(seconds=value)
+
+def materialize_names(names, kinds):
+    result = []
+    for kind, text, language in names:
+        name = kinds[kind](text)
+        if language is not None: name.language = language
+        result.append(name)
+    return result
+
+def materialize_described(item, raw):
+    """adds the names, descriptions, media, genres, keywords and links of a raw programme, programme
+       event, ensemble or service to its object"""
+    item.names.extend(materialize_names(raw['names'], RAW_NAME_KINDS))
+    item.descriptions.extend(materialize_names(raw['descriptions'], RAW_DESCRIPTION_KINDS))
+    for url, content, type, width, height, language in raw['media']:
+        item.media.append(Multimedia(url, type=type, content=content, height=height, width=width, language=language))
+    for href in raw['genres']: item.genres.append(Genre(href))
+    item.keywords.extend(raw['keywords'])
+    for uri, content, description, expiry in raw['links']:
+        item.links.append(Link(uri, content=content, description=description, expiry=materialize_timepoint(expiry)))
+
+def materialize_location(raw):
+    location = Location(times=[Time(materialize_timepoint(a), materialize_duration(b), materialize_timepoint(c), materialize_duration(d)) 
+                               for a, b, c, d in raw['times']])
+    location.times.extend(RelativeTime(*[materialize_duration(x) for x in t]) for t in raw['relative_times'])
+    location.bearers.extend(parse_contentid(x) for x in raw['bearers'])
+    return location
+
+def materialize_programme(raw, cls=Programme):
+    programme = cls(raw['crid'], raw['shortcrid'], recommendation=bool(raw['recommendation']))
+    if raw['version'] is not None: programme.version = raw['version']
+    materialize_described(programme, raw)
+    programme.memberships.extend(Membership(crid, shortcrid, index) for crid, shortcrid, index in raw['memberships'])
+    programme.locations.extend(materialize_location(x) for x in raw['locations'])
+    for event in raw.get('events', ()):
+        programme.events.append(materialize_programme(event, ProgrammeEvent))
+    return programme
+
+def materialize(raw):
+    """Converts a raw structure decoded by :func:unmarshall with ``raw=True`` to the object model. 
+    Timepoints become UTC datetimes and content IDs :class:DabBearer objects, where they have an ECC 
+    and EId. Everything :func:parse_raw decodes is kept except the broadcast flag of programmes, 
+    which the object model has no place for. This includes the genres, memberships, links and 
+    programme events of programmes and the descriptions, media and other details of ensembles and
+    services, which :func:unmarshall does not yet decode.
+
+    :param raw: Raw structure of a PI or SI document
+    :type raw: dict
+    :returns: a :class:ProgrammeInfo, or a tuple of :class:ServiceInfo and :class:Ensemble
+    """
+
+    if raw['type'] == 'epg':
+        info = ProgrammeInfo(schedules=[])
+        for s in raw['schedules']:
+            scope = Scope(None, None)
+            if s['scope'] is not None:
+                start, end, bearers = s['scope']
+                scope = Scope(materialize_timepoint(start), materialize_timepoint(end), [parse_contentid(x) for x in bearers])
+            schedule = Schedule(scope)
+            if s['created'] is not None: schedule.created = materialize_timepoint(s['created'])
+            if s['version'] is not None: schedule.version = s['version']
+            if s['originator'] is not None: schedule.originator = s['originator']
+            schedule.programmes.extend(materialize_programme(x) for x in s['programmes'])
+            info.schedules.append(schedule)
+        return info
+    elif raw['type'] == 'serviceInformation':
+        info = ServiceInfo()
+        if raw['created'] is not None: info.created = materialize_timepoint(raw['created'])
+        if raw['version'] is not None: info.version = raw['version']
+        info.originator, info.provider = raw['originator'], raw['provider']
+        e = raw['ensemble']
+        ensemble = Ensemble(*e['id'])
+        if e['version'] is not None: ensemble.version = e['version']
+        materialize_described(ensemble, e)
+        for s in e['services']:
+            service = Service()
+            if s['version'] is not None: service.version = s['version']
+            service.bearers.extend(parse_contentid(x) for x in s['bearers'])
+            materialize_described(service, s)
+            if s['lookup'] is not None: service.lookup = Lookup(*s['lookup'])
+            info.services.append(service)
+        return info, ensemble
+    else:
+        raise ValueError('unknown type of raw structure: %s' % raw['type'])
+
+def header_length(datalength):
+    """returns the length in bytes of the tag and length header for the given data length"""
+    if datalength <= 253: return 2
+    elif datalength <= 1<<16: return 4
+    elif datalength <= 1<<24: return 5
+    else: raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %d > %d' % (datalength, 1<<24))
+
+def encode_header(buf, offset, tag, datalength):
+    """writes a tag and length header into a buffer at the given offset, returning the offset
+       at which the data should follow"""
+
+    # b0-b7: element tag
+    buf[offset] = tag
+
+    # b8-15: element data length (0-253 bytes)
+    # b16-31: extended element length (256-65536 bytes)
+    # b16-39: extended element length (65537-16777216 bytes)
+    if datalength <= 253:
+        buf[offset + 1] = datalength
+        return offset + 2
+    elif datalength <= 1<<16:
+        buf[offset + 1] = 0xfe
+        buf[offset + 2:offset + 4] = (datalength & 0xffff).to_bytes(2, 'big')
+        return offset + 4
+    elif datalength <= 1<<24:
+        buf[offset + 1] = 0xff
+        buf[offset + 2:offset + 5] = (datalength & 0xffffff).to_bytes(3, 'big')
+        return offset + 5
+    else: raise ValueError('element data length exceeds the maximum allowed by the extended element length (24bits): %d > %d' % (datalength, 1<<24))
+
+def decode_header(buf, offset):
+    """decodes a tag and length header from a buffer at the given offset, returning a tuple of
+       (tag, data length, data offset)"""
+
+    if offset + 2 > len(buf): raise ValueError('header at offset %d is beyond the end of the data: %d' % (offset, len(buf)))
+
+    # b0-b7: element tag
+    tag = buf[offset]
+
+    # b8-15: element data length (0-253 bytes)
+    # b16-31: extended element length (256-65536 bytes)
+    # b16-39: extended element length (65537-16777216 bytes)
+    datalength = buf[offset + 1]
+    if datalength == 0xfe:
+        return tag, int.from_bytes(buf[offset + 2:offset + 4], 'big'), offset + 4
+    elif datalength == 0xff:
+        return tag, int.from_bytes(buf[offset + 2:offset + 5], 'big'), offset + 5
+    return tag, datalength, offset + 2
+
+def buffer_to_bitarray(data):
+    bits = bitarray()
+    bits.frombytes(bytes(data))
+    return bits
+
+def bytes_to_hex(data):
+    return ' '.join(['%02X' % x for x in bytes(data)])
+
+def encode_number(i, n):
+    """encodes an integer as a bitarray of n bits. See :func:pack_number for whole bytes"""
+    if not isinstance(i, (int, float)): raise ValueError('value must be a number (%s is %s)' % (i, type(i)))
+    if not isinstance(n, (int, float)): raise ValueError('bitlength must be a number')
+    i = int(i)
+    n = int(n)
+    if n % 8 == 0: return buffer_to_bitarray(pack_number(i, n))
+    return bitarray(format(i & ((1 << n) - 1), '0%db' % n) if n else '')
+
+def bitarray_to_hex(bits):
+    rows = []
+    for i in range(0, len(bits), 256):
+        rows.append(' '.join(["%02X" %x for x in bits[i:i+256].tobytes()]).strip())
+    return '\r\n'.join(rows)
+
+def hex_to_bitarray(hex):
+    b = bitarray()
+    for byte in hex.split(' '):
+        b.extend(encode_number(int('0x%s' % byte, 16), 8))
+    return b
+
+def bitarray_to_binary(bits):
+    rows = []
+    for i in range(0, len(bits), 256):
+        bytes = []
+        for j in range(i, i+256, 8):
+            bytes.append(bits[j:j+8].to01())
+        rows.append(' '.join(bytes))
+    return '\r\n'.join(rows)
+      
+def unmarshall(i, raw=False):
+    """Unmarshalls a PI or SI binary file to its respective :class:Epg or :class:ServiceInfo object
+    
+    :param i: Bytes, mmap, path or File object to read binary from. Files are memory mapped where 
+              they can be and decoded directly from the mapped pages, see :func:as_buffer
+    :type i: bytes, mmap, str, file
+    :param raw: decode to a structure of plain dicts, lists and tuples rather than the object model,
+                see :func:parse_raw and :func:materialize
+    :type raw: bool
+    """    
+    
+    if raw: return parse_raw(as_buffer(i))
+    e = Element.frombuffer(as_buffer(i))
+    if e.tag == 0x03:
+        si = parse_service_information(e)
+        return si
+    elif e.tag == 0x02:
+        epg = parse_epg(e)
+        return epg
+    else:
+        raise Exception('Arrgh! this be neither serviceInformation nor epg - to Davy Jones\' locker with ye!')    
+
+"""Header of an element, attribute, definition or CData of an encoded document, with the depth of
+   the item, the offset of its header, the tag of its parent element, and the offset and length of 
+   its data"""
+Header = collections.namedtuple('Header', ['depth', 'offset', 'tag', 'parent', 'start', 'length'])
+
+def iterheaders(buf, offset=0, skip=None):
+    """Walks the headers of an encoded document without decoding it, yielding a :class:Header for
+    each element, attribute, token table, default content ID, default language and CData in document 
+    order. Elements are descended into unless skipped, jumping over their data by its length.
+
+    :param buf: Encoded document
+    :type buf: bytes-like
+    :param offset: Offset of the top-level element in the buffer
+    :type offset: int
+    :param skip: Called with the header of each element, returning True to skip over its contents
+    :type skip: callable
+    """
+
+    if not isinstance(buf, memoryview): buf = memoryview(buf)
+
+    tag, datalength, start = decode_header(buf, offset)
+    if tag < 0x02 or tag > 0x36: raise ValueError('invalid value for tag: 0x%02x' % tag)
+    if start + datalength > len(buf):
+        raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (tag, offset, start + datalength, len(buf)))
+    header = Header(0, offset, tag, None, start, datalength)
+    yield header
+    if skip is not None and skip(header): return
+
+    stack = [(tag, start + datalength)] # (tag, end offset) of each open element
+    i = start
+    while stack:
+        parent, end = stack[-1]
+        if i >= end:
+            stack.pop()
+            continue
+        tag, datalength, start = decode_header(buf, i)
+        if start + datalength > end:
+            raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (tag, i, start + datalength, end))
+        header = Header(len(stack), i, tag, parent, start, datalength)
+        yield header
+        if tag >= 0x02 and tag <= 0x36 and tag not in (0x04, 0x05, 0x06) and not (skip is not None and skip(header)):
+            stack.append((tag, start + datalength))
+            i = start
+        else:
+            i = start + datalength
+
+"""Matches a step of a query path: a tag or wildcard, followed by any attribute predicates"""
+PATH_STEP = re.compile(r'^(\*|0x[0-9a-fA-F]{1,2})((?:\[0x[0-9a-fA-F]{1,2}=[^\]]*\])*)$')
+PATH_PREDICATE = re.compile(r'\[(0x[0-9a-fA-F]{1,2})=([^\]]*)\]')
+
+@functools.lru_cache(maxsize=None)
+def compile_path(path):
+    """parses a query path, returning whether it is absolute, a tuple of the (tag, predicates) of each
+       element step, a tag of None matching any element, and the tag of any attribute selected"""
+
+    absolute = path.startswith('/')
+    segments = path.strip('/').split('/')
+    attribute = None
+    if segments[-1].startswith('@'):
+        attribute = int(segments.pop()[1:], 16)
+    steps = []
+    for segment in segments:
+        match = PATH_STEP.match(segment)
+        if match is None: raise ValueError('invalid step in path %s: %s' % (path, segment))
+        tag = None if match.group(1) == '*' else int(match.group(1), 16)
+        predicates = tuple((int(x, 16), value) for x, value in PATH_PREDICATE.findall(match.group(2)))
+        steps.append((tag, predicates))
+    if not steps: raise ValueError('path selects no elements: %s' % path)
+    return absolute, tuple(steps), attribute
+
+def match_value(value, literal):
+    """returns whether a decoded attribute value equals a literal given in a query path"""
+    if str(value) == literal: return True
+    if isinstance(value, int) and not isinstance(value, bool):
+        try: return value == int(literal, 0)
+        except ValueError: return False
+    return False
+
+def select(buf, path, lazy=False):
+    """Queries an encoded document by path, walking its headers and jumping over the data of elements
+    off the path by their length, so that only the elements selected are decoded.
+
+    Paths are ``/`` separated steps of element tags, relative to the top-level element unless starting
+    with ``/``, for example ``0x26/0x28/0x12`` for the long names of the services of an SI document.
+    A step of ``*`` matches any element, and a step may be followed by predicates on its attributes, 
+    such as ``0x21/0x1c[0x81=123456]``. A final step of ``@0x82`` selects the value of an attribute 
+    of the elements, such as ``0x21/0x1c/0x13/0x2b/@0x82`` for the multimedia URLs of programmes.
+
+    Elements are decoded with parents carrying the token tables and default content IDs they inherit.
+
+    :param buf: Encoded document, as a path or anything else accepted by :func:unmarshall
+    :param path: Query path
+    :type path: str
+    :param lazy: decode the elements selected lazily, see :class:LazyElement
+    :type lazy: bool
+    :returns: a generator of the elements, or attribute values, selected in document order
+    """
+
+    return iterselect(as_buffer(buf), compile_path(path), lazy)
+
+def iterselect(buf, path, lazy):
+    """yields the elements or attribute values of a memoryview selected by a compiled query path"""
+
+    absolute, steps, attribute = path
+    base = 0 if absolute else 1 # depth of the element matched by the first step
+    last = base + len(steps) - 1 # depth of the elements selected
+    parents = [] # stubs of the elements descended into, for inherited definitions
+    descend = [False] # whether to descend into the element last visited
+
+    def matches(header):
+        tag, predicates = steps[header.depth - base]
+        if tag is not None and tag != header.tag: return False
+        if not predicates: return True
+        values = {}
+        i, end = header.start, header.start + header.length
+        while i < end:
+            child_tag, child_datalength, child_start = decode_header(buf, i)
+            if child_tag >= 0x80 and child_tag <= 0x87:
+                values[child_tag] = Attribute.decode(header.tag, child_tag, buf[child_start:child_start + child_datalength]).value
+            i = child_start + child_datalength
+        return all(x in values and match_value(values[x], literal) for x, literal in predicates)
+
+    for header in iterheaders(buf, skip=lambda header: not descend[0]):
+        tag, depth = header.tag, header.depth
+        if tag >= 0x80 and tag <= 0x87:
+            if tag == attribute and depth == last + 1:
+                yield Attribute.decode(header.parent, tag, buf[header.start:header.start + header.length]).value
+        elif tag == 0x04 or tag == 0x05:
+            parents[depth - 1].decode_data(buf, header.offset, header.start + header.length)
+        elif tag >= 0x02 and tag <= 0x36 and tag != 0x06:
+            descend[0] = False
+            if depth > last or (depth >= base and not matches(header)): continue
+            if depth == last and attribute is None:
+                element = Element.decode(buf, tag, header.start, header.start + header.length, lazy=lazy,
+                                         context=parents[depth - 1].context if depth else None)
+                if depth: element.parent = parents[depth - 1]
+                yield element
+                continue
+            del parents[depth:]
+            parent = Element(tag)
+            parent.context = parents[depth - 1].context if depth else NO_CONTEXT
+            if depth: parent.parent = parents[depth - 1]
+            parents.append(parent)
+            descend[0] = True
+
+def map_file(path):
+    """memory maps a file for reading, returning a memoryview of its pages. These are unmapped once 
+       nothing refers to them"""
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def as_buffer(i):
+    """returns a memoryview of an encoded document given as a bytes-like object such as an mmap, or as
+       the path or binary file object of a file, which is memory mapped from its current position 
+       where it can be and otherwise read"""
+
+    if isinstance(i, (str, os.PathLike)): return map_file(i)
+    if isinstance(i, (bytes, bytearray, memoryview, mmap.mmap)): return memoryview(i)
+    if hasattr(i, 'read'):
+        try: 
+            offset = i.tell()
+            buf = memoryview(mmap.mmap(i.fileno(), 0, access=mmap.ACCESS_READ))[offset:]
+            i.seek(0, os.SEEK_END)
+            return buf
+        except (AttributeError, OSError, ValueError):
+            return memoryview(i.read())
+    return memoryview(i)
+
+def iterparse(i):
+    """Incrementally parses a PI or SI binary document, yielding a tuple of ``(event, value)`` 
+    for each item as it is read, without loading the whole document into memory. Events are:
+
+    * ``start`` - an element has been opened, value is its tag
+    * ``attribute`` - an :class:Attribute of the current element, with its value decoded
+    * ``cdata`` - the :class:CData of the current element
+    * ``tokens`` - the token table declared on the current element, as a dict
+    * ``default_contentid`` - the default content ID declared on the current element
+    * ``end`` - the current element has been closed, value is its tag
+
+    Stopping iteration early leaves the remainder of the document unread.
+    
+    :param i: Bytes or File object to read binary from
+    :type i: bytes, file
+    """
+
+    if not hasattr(i, 'read'): i = io.BytesIO(i)
+
+    def read(n):
+        data = i.read(n)
+        if len(data) < n: raise ValueError('unexpected end of data: %d of %d bytes read' % (len(data), n))
+        return data
+
+    stack = [] # (tag, end offset) of each open element
+    offset = 0
+    while True:
+
+        # close any elements that end here
+        while stack and stack[-1][1] == offset:
+            yield ('end', stack.pop()[0])
+
+        header = i.read(2)
+        if not len(header):
+            if stack: raise ValueError('unexpected end of data within element with tag 0x%02x' % stack[-1][0])
+            return
+        if len(header) < 2: raise ValueError('unexpected end of data in header at offset %d' % offset)
+
+        # b0-b7: tag
+        # b8-15: data length (0-253 bytes)
+        # b16-31: extended length (256-65536 bytes)
+        # b16-39: extended length (65537-16777216 bytes)
+        tag, datalength = header[0], header[1]
+        offset += 2
+        if datalength == 0xfe:
+            datalength = int.from_bytes(read(2), 'big')
+            offset += 2
+        elif datalength == 0xff:
+            datalength = int.from_bytes(read(3), 'big')
+            offset += 3
+        end = offset + datalength
+        if stack and end > stack[-1][1]:
+            raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond its parent: %d > %d' % (tag, offset, end, stack[-1][1]))
+        parent_tag = stack[-1][0] if stack else None
+
+        # elements
+        if tag >= 0x02 and tag <= 0x36 and tag not in (0x04, 0x05, 0x06):
+            stack.append((tag, end))
+            yield ('start', tag)
+            continue
+
+        if parent_tag is None: raise ValueError('invalid value for tag: 0x%02x' % tag)
+        data = memoryview(read(datalength))
+        offset = end
+        # attributes
+        if tag >= 0x80 and tag <= 0x87:
+            yield ('attribute', Attribute.decode(parent_tag, tag, data))
+        # token table
+        elif tag == 0x04:
+            yield ('tokens', decode_tokentable_bytes(data))
+        # default content ID
+        elif tag == 0x05:
+            yield ('default_contentid', decode_contentid_bytes(data))
+        # default language
+        elif tag == 0x06:
+            pass
+        # cdata
+        elif tag == 0x01:
+            yield ('cdata', CData(bytes(data).decode()))
+        else:
+            raise ValueError('unknown element 0x%02x under parent 0x%02x' % (tag, parent_tag))
+
+"""Suffix of the sidecar file the :class:Index of an encoded document file is saved to"""
+INDEX_SUFFIX = '.toc'
+
+"""Depth of the elements whose tag paths are indexed, being the top-level element, the schedules or
+   ensembles, and the programmes or services"""
+INDEX_DEPTH = 3
+
+"""Maximum number of indexes of document files to keep in memory"""
+INDEX_CACHE_SIZE = 64
+
+def format_path(tags):
+    """formats a sequence of element tags as a path, such as ``0x02/0x21/0x1c``"""
+    return '/'.join('0x%02x' % x for x in tags)
+
+def epoch_seconds(timepoint):
+    """returns a datetime, taken as UTC if it has no timezone, as seconds since the epoch"""
+    if isinstance(timepoint, datetime.datetime): return calendar.timegm(timepoint.utctimetuple())
+    return timepoint
+
+class Index:
+    """
+    Table of contents of an encoded document, locating its elements by the byte offset and length
+    of their encoding so that they can be read without decoding the rest of the document.
+
+    :param size: Size in bytes of the indexed document
+    :type size: int
+    :param paths: Lists of (offset, length) of the elements at each tag path, see :func:format_path
+    :type paths: dict
+    :param shortcrids: (offset, length) of each programme, keyed on its shortcrid
+    :type shortcrids: dict
+    :param times: Sorted list of (start, offset, length) of each programme, with its earliest billed 
+                  time as seconds since the epoch
+    :type times: list
+    :param definitions: List of (offset, end, tag, definition offset, definition length) of each token
+                        table and default content ID, with the extent and tag of the element declaring it
+    :type definitions: list
+    """
+
+    def __init__(self, size, paths=None, shortcrids=None, times=None, definitions=None):
+        self.size = size
+        self.paths = paths if paths is not None else {}
+        self.shortcrids = shortcrids if shortcrids is not None else {}
+        self.times = times if times is not None else []
+        self.definitions = definitions if definitions is not None else []
+
+    def find(self, path):
+        """returns the (offset, length) of the elements at a tag path, given as a string or a sequence of tags"""
+        if not isinstance(path, str): path = format_path(path)
+        return self.paths.get(path.lower(), [])
+
+    def find_programme(self, shortcrid):
+        """returns the (offset, length) of the programme with a shortcrid"""
+        try: return self.shortcrids[shortcrid]
+        except KeyError: raise ValueError('no programme with shortcrid: %s' % shortcrid)
+
+    def find_programmes(self, start, end):
+        """returns the (offset, length) of the programmes starting at or after a start time and before 
+           an end time, as datetimes or seconds since the epoch"""
+        lo = bisect.bisect_left(self.times, (epoch_seconds(start),))
+        hi = bisect.bisect_left(self.times, (epoch_seconds(end),))
+        return [(offset, length) for start, offset, length in self.times[lo:hi]]
+
+    def find_definitions(self, offset):
+        """returns the (tag, offset, length) of the token tables and default content IDs inherited by the 
+           element at an offset, declared by the elements enclosing it, outermost first"""
+        return [x[2:] for x in self.definitions if x[0] < offset < x[1]]
+
+    def dump(self, f):
+        """saves this index as JSON to a text file object"""
+        json.dump({'size': self.size, 'paths': self.paths, 'shortcrids': list(self.shortcrids.items()), 
+                   'times': self.times, 'definitions': self.definitions}, f)
+
+    @staticmethod
+    def load(f):
+        """loads an index saved by :meth:dump from a text file object"""
+        data = json.load(f)
+        return Index(data['size'], 
+                     dict((k, [tuple(x) for x in v]) for k, v in data['paths'].items()), 
+                     dict((k, tuple(v)) for k, v in data['shortcrids']),
+                     [tuple(x) for x in data['times']], 
+                     [tuple(x) for x in data['definitions']])
+
+    def __repr__(self):
+        return '<Index: %d bytes, %d programmes>' % (self.size, len(self.shortcrids))
+
+def build_index(buf, depth=INDEX_DEPTH):
+    """builds the :class:Index of an encoded document by walking the headers of its elements down to
+       the given depth, decoding only the shortcrids and billed times of programmes"""
+
+    if not isinstance(buf, memoryview): buf = memoryview(buf)
+    index = Index(len(buf))
+
+    def walk(path, offset, start, end):
+        i = start
+        while i < end:
+            tag, datalength, child_start = decode_header(buf, i)
+            child_end = child_start + datalength
+            if child_end > end:
+                raise ValueError('end of data for element with tag 0x%02x at offset %d requested is beyond length: %d > %d' % (tag, i, child_end, end))
+            if tag in (0x04, 0x05):
+                index.definitions.append((offset, end, path[-1], i, child_end - i))
+            elif tag >= 0x02 and tag <= 0x36 and tag != 0x06:
+                child_path = path + (tag,)
+                index.paths.setdefault(format_path(child_path), []).append((i, child_end - i))
+                if tag == 0x1c: index_programme(i, child_start, child_end)
+                if len(child_path) < depth: walk(child_path, i, child_start, child_end)
+            i = child_end
+
+    def index_programme(offset, start, end):
+        shortcrid = None
+        times = []
+        for tag, data in iter_fields(start, end):
+            if tag == 0x81: shortcrid = int.from_bytes(data, 'big')
+            elif tag == 0x19:
+                for time_tag, time_data in iter_fields(data.start, data.stop):
+                    if time_tag != 0x2c: continue
+                    times.extend(bytes(x) for x_tag, x in iter_fields(time_data.start, time_data.stop) if x_tag == 0x80)
+        if shortcrid is not None: index.shortcrids[shortcrid] = (offset, end - offset)
+        times = [x for x in decode_timepoints(times, epoch=True) if x is not None]
+        if times: index.times.append((min(times), offset, end - offset))
+
+    def iter_fields(start, end):
+        i = start
+        while i < end:
+            tag, datalength, data_start = decode_header(buf, i)
+            i = data_start + datalength
+            yield tag, (buf[data_start:i] if tag >= 0x80 else slice(data_start, i))
+
+    tag, datalength, start = decode_header(buf, 0)
+    if start + datalength > len(buf):
+        raise ValueError('end of data for element with tag 0x%02x at offset 0 requested is beyond length: %d > %d' % (tag, start + datalength, len(buf)))
+    index.paths[format_path((tag,))] = [(0, start + datalength)]
+    walk((tag,), 0, start, start + datalength)
+    index.times.sort()
+    return index
+
+index_cache = collections.OrderedDict()
+
+def load_index(path):
+    """Returns the :class:Index of an encoded document file. This is loaded from its sidecar file if 
+    that is up to date, otherwise built and saved to the sidecar, and kept in memory until the document
+    changes. See :data:INDEX_SUFFIX
+
+    :param path: Path of the encoded document
+    :type path: str
+    """
+
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if path in index_cache and index_cache[path][0] == key:
+        index_cache.move_to_end(path)
+        return index_cache[path][1]
+
+    sidecar = path + INDEX_SUFFIX
+    index = None
+    try:
+        if os.stat(sidecar).st_mtime_ns >= stat.st_mtime_ns:
+            with open(sidecar) as f: index = Index.load(f)
+            if index.size != stat.st_size: index = None
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    if index is None:
+        index = build_index(map_file(path))
+        try:
+            with open(sidecar, 'w') as f: index.dump(f)
+        except OSError as e:
+            logger.warning('could not save index to %s: %s', sidecar, e)
+
+    index_cache[path] = (key, index)
+    while len(index_cache) > INDEX_CACHE_SIZE: index_cache.popitem(last=False)
+    return index
+
+def read_element(f, index, offset, length):
+    """reads and decodes the element at an offset of an encoded document file object, with the token 
+       tables and default content IDs it inherits declared on its parents"""
+
+    parent = None
+    for tag, definition_offset, definition_length in index.find_definitions(offset):
+        f.seek(definition_offset)
+        data = memoryview(f.read(definition_length))
+        if parent is None or parent.tag != tag:
+            ancestor = Element(tag)
+            if parent is not None: ancestor.parent = parent
+            parent = ancestor
+        parent.decode_data(data, 0, len(data))
+
+    f.seek(offset)
+    element = Element.frombuffer(f.read(length), context=parent.context if parent is not None else None)
+    if parent is not None: element.parent = parent
+    return element
+
+def read_programme(path, shortcrid):
+    """Reads a programme from an encoded PI document file, decoding only that programme and the
+    token tables and default content IDs it inherits, located by the :class:Index of the document.
+
+    :param path: Path of the encoded document
+    :type path: str
+    :param shortcrid: Shortcrid of the programme
+    :type shortcrid: int
+    :returns: the programme
+    :rtype: Programme
+    """
+
+    index = load_index(path)
+    offset, length = index.find_programme(shortcrid)
+    with open(path, 'rb') as f:
+        return parse_programme(read_element(f, index, offset, length))
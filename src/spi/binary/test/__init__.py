@@ -0,0 +1,19 @@
+import datetime
+
+from spi import *
+
+
+START = datetime.datetime(2014, 4, 25, 6, 0, tzinfo=datetime.timezone.utc)
+
+def make_schedule(count=3, start=START, shortcrid=1, step=datetime.timedelta(hours=1), contentid=(0xe1, 0xc185, 0xc0da), customise=None):
+    """returns a schedule of hour long programmes with consecutive short CRIDs, each ``step`` after the last and on
+       the DAB bearer ``contentid``, if any, calling ``customise(programme, i)`` to add whatever else a test needs"""
+    schedule = Schedule(Scope(start, start), created=start)
+    for i in range(count):
+        programme = Programme('crid://www.capitalfm.com/4772/%d' % i, shortcrid + i)
+        location = Location(times=[Time(start + step * i, datetime.timedelta(hours=1))])
+        if contentid is not None: location.bearers.append(DabBearer(*contentid))
+        programme.locations.append(location)
+        if customise is not None: customise(programme, i)
+        schedule.programmes.append(programme)
+    return schedule
@@ -0,0 +1,360 @@
+import unittest
+
+from spi import *
+from spi.binary import *
+from spi.binary.test import START, make_schedule
+
+
+def model_state(obj):
+    """returns the attributes of objects of the object model, recursively, for comparing decoded objects"""
+    if isinstance(obj, (list, tuple)): return [model_state(x) for x in obj]
+    if hasattr(obj, '__dict__'): return (type(obj).__name__, dict((k, model_state(v)) for k, v in vars(obj).items()))
+    return obj
+
+class Test(unittest.TestCase):
+
+
+    def test_decode_element(self):
+        e = Element.frombuffer(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+        self.assertEqual(e.tag, 0x1c)
+        self.assertEqual(e.get_attributes(0x81)[0].value, 123456)
+        self.assertEqual([x.tag for x in e.children], [0x10, 0x11])
+        self.assertEqual(e.get_children(0x11)[0].cdata.value, 'No.1 Pun')
+        self.assertIs(e.children[0].parent, e)
+
+    def test_shared_empty_nodes(self):
+        import spi.binary
+        e = Element.frombuffer(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+        self.assertFalse(hasattr(e, '__dict__') or hasattr(e.attributes[0], '__dict__') or hasattr(e.children[0].cdata, '__dict__'))
+        self.assertIs(e.children[0]._attributes, spi.binary.EMPTY)
+        self.assertIs(e.children[0]._children, spi.binary.EMPTY)
+        self.assertEqual(e.children[0].get_children(), [])
+        self.assertFalse(hasattr(e, 'tokens'))
+
+    def test_index_by_tag(self):
+        e = Element.frombuffer(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+        self.assertEqual([x.cdata.value for x in e.get_children(0x11)], ['No.1 Pun'])
+        self.assertEqual(e.get_attributes(0x81)[0].value, 123456)
+        self.assertTrue(e.has_attribute(0x81))
+        self.assertFalse(e.has_child(0x12))
+        e.get_children(0x11).clear() # a copy
+        self.assertEqual(len(e.get_children(0x11)), 1)
+        e.children = list(e.children) + [Element(0x12, cdata=CData('Pun of the Day'))] # drops the index
+        self.assertEqual(len(e.get_children(0x12)), 1)
+        # the lists of elements being built are scanned, however they are changed
+        e = Element(0x1c)
+        children = e.children
+        children.append(Element(0x10, cdata=CData('Pun')))
+        self.assertEqual(len(e.get_children(0x10)), 1)
+        children.append(Element(0x10, cdata=CData('No.1 Pun')))
+        self.assertEqual(len(e.get_children(0x10)), 2)
+
+    def test_inherited_context(self):
+        # token table declared before the children, and a default content ID after them
+        data = b'\x1c\x18\x04\x06\x01\x04Capi\x10\x06\x01\x04\x01tal\x05\x06\x40\xe1\xc1\x85\xc0\xda'
+        for lazy in (False, True):
+            e = Element.frombuffer(data, lazy=lazy)
+            child = e.children[0]
+            self.assertEqual(child.context, ({0x01: 'Capi'}, (0xe1, 0xc185, 0xc0da, 0, None)))
+            self.assertEqual(apply_token_table(child.cdata.value, child), 'Capital')
+        e = Element.frombuffer(b'\x10\x06\x01\x04\x01tal', context=({0x01: 'Capi'}, None))
+        self.assertEqual(apply_token_table(e.cdata.value, e), 'Capital')
+
+    def test_decode_extended_length(self):
+        element = Element(0x1b, cdata=CData('x' * 300))
+        e = Element.frombuffer(element.tobytes().tobytes())
+        self.assertEqual(e.cdata.value, 'x' * 300)
+
+    def test_decode_at_offset(self):
+        e = Element.frombuffer(b'\x00\x00\x10\x05\x01\x03Pun', 2)
+        self.assertEqual(e.cdata.value, 'Pun')
+
+    def test_frombits(self):
+        bits = Element(0x10, cdata=CData('Capital')).tobytes()
+        self.assertEqual(Element.frombits(bits).cdata.value, 'Capital')
+
+    def test_truncated_element(self):
+        with self.assertRaises(ValueError):
+            Element.frombuffer(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01')
+
+    def test_lazy_decode(self):
+        data = b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun'
+        e = Element.frombuffer(data, lazy=True)
+        self.assertIsInstance(e, LazyElement)
+        self.assertFalse(e._loaded)
+        self.assertEqual(e.get_attributes(0x81)[0].value, 123456)
+        self.assertTrue(e._loaded)
+        child = e.get_children(0x11)[0]
+        self.assertFalse(child._loaded)
+        self.assertEqual(child.cdata.value, 'No.1 Pun')
+        self.assertFalse(e.children[0]._loaded)
+
+    def test_lazy_inherited_tokens(self):
+        data = b'\x1c\x10\x04\x06\x01\x04Capi\x10\x06\x01\x04\x01tal'
+        e = Element.frombuffer(data, lazy=True)
+        self.assertEqual(apply_token_table(e.children[0].cdata.value, e), 'Capital')
+
+    def test_iterparse(self):
+        data = b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun'
+        events = [(event, value if event in ('start', 'end') else value.value) for event, value in iterparse(data)]
+        self.assertEqual(events, [('start', 0x1c), ('attribute', 123456), 
+                                  ('start', 0x10), ('cdata', 'Pun'), ('end', 0x10),
+                                  ('start', 0x11), ('cdata', 'No.1 Pun'), ('end', 0x11),
+                                  ('end', 0x1c)])
+
+    def test_iterparse_stops_early(self):
+        import io
+        f = io.BytesIO(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+        for event, value in iterparse(f):
+            if event == 'attribute': break
+        self.assertEqual(f.tell(), 7)
+
+    def test_iterparse_truncated(self):
+        with self.assertRaises(ValueError):
+            list(iterparse(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01'))
+
+    def test_roundtrip_serviceinfo(self):
+        info = ServiceInfo(originator='Global Radio')
+        service = Service()
+        service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe))
+        service.names.append(ShortName('Capital'))
+        service.names.append(MediumName('Capital London'))
+        info.services.append(service)
+        ensemble = Ensemble(0xe1, 0xcfff)
+        ensemble.names.append(ShortName('London 1'))
+
+        si, decoded_ensemble = unmarshall(marshall(info, ensemble=ensemble).tobytes())
+        self.assertEqual((decoded_ensemble.ecc, decoded_ensemble.eid), (0xe1, 0xcfff))
+        self.assertEqual(decoded_ensemble.names[0].text, 'London 1')
+        self.assertEqual([x.text for x in si.services[0].names], ['Capital', 'Capital London'])
+
+    def test_iterheaders(self):
+        data = b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun'
+        self.assertEqual([(x.depth, x.offset, x.tag, x.parent, x.length) for x in iterheaders(data)],
+                         [(0, 0, 0x1c, None, 24), (1, 2, 0x81, 0x1c, 3), (1, 7, 0x10, 0x1c, 5), (2, 9, 0x01, 0x10, 3),
+                          (1, 14, 0x11, 0x1c, 10), (2, 16, 0x01, 0x11, 8)])
+        headers = list(iterheaders(data, skip=lambda x: x.tag == 0x10))
+        self.assertEqual([x.tag for x in headers], [0x1c, 0x81, 0x10, 0x11, 0x01])
+        with self.assertRaises(ValueError):
+            list(iterheaders(data[:-1]))
+
+    def test_select(self):
+        def customise(programme, i):
+            programme.names.append(LongName('Capital Breakfast %d' % i))
+            programme.media.append(Multimedia('http://owdo.thisisglobal.com/%d/logo.png' % i, Multimedia.LOGO_COLOUR_SQUARE))
+        schedule = make_schedule(shortcrid=100, customise=customise)
+        data = marshall(ProgrammeInfo(schedules=[schedule]), tokens=True).tobytes()
+        self.assertEqual([x.tag for x in select(data, '0x21/0x1c')], [0x1c, 0x1c, 0x1c])
+        self.assertEqual(len(list(select(data, '/0x02/0x21'))), 1)
+        self.assertEqual(list(select(data, '0x21/0x1c/0x13/0x2b/@0x82')), ['http://owdo.thisisglobal.com/%d/logo.png' % i for i in range(3)])
+        selected = list(select(data, '*/0x1c[0x81=101]'))
+        self.assertEqual(len(selected), 1)
+        programme = parse_programme(selected[0])
+        self.assertEqual(programme.names[0].text, 'Capital Breakfast 1') # with the inherited token table
+        self.assertEqual([str(x) for x in programme.locations[0].bearers], ['dab:ce1.c185.c0da.0'])
+        self.assertEqual(list(select(data, '0x21/0x1c[0x81=0x66]/@0x80')), ['crid://www.capitalfm.com/4772/2'])
+        self.assertEqual(list(select(data, '0x26/0x28')), [])
+        with self.assertRaises(ValueError):
+            select(data, '0x21/programme')
+
+    def test_unmarshall_raw(self):
+        import datetime
+        def customise(programme, i):
+            programme.names.append(LongName('Capital Breakfast %d' % i))
+            programme.descriptions.append(ShortDescription('Capital Breakfast, every weekday'))
+        schedule = make_schedule(shortcrid=100, customise=customise)
+        data = marshall(ProgrammeInfo(schedules=[schedule]), tokens=True).tobytes()
+        raw = unmarshall(data, raw=True)
+        programme = raw['schedules'][0]['programmes'][1]
+        self.assertEqual((programme['crid'], programme['shortcrid']), ('crid://www.capitalfm.com/4772/1', 101))
+        self.assertEqual(programme['names'], [('long', 'Capital Breakfast 1', None)])
+        self.assertEqual(programme['descriptions'], [('short', 'Capital Breakfast, every weekday', None)])
+        self.assertEqual(programme['locations'], [{'times' : [(1398409200, 3600, None, None)], 'relative_times' : [], 
+                                                    'bearers' : [(0xe1, 0xc185, 0xc0da, 0, None)]}])
+        info = materialize(raw)
+        expected = unmarshall(data).schedules[0].programmes[1]
+        programme = info.schedules[0].programmes[1]
+        self.assertEqual([(type(x), x.text) for x in programme.names], [(type(x), x.text) for x in expected.names])
+        self.assertEqual(programme.locations[0].times[0].billed_time, expected.locations[0].times[0].billed_time)
+        self.assertEqual(programme.locations[0].times[0].billed_duration, datetime.timedelta(hours=1))
+        self.assertEqual([str(x) for x in programme.locations[0].bearers], [str(x) for x in expected.locations[0].bearers])
+
+        info = ServiceInfo(originator='Global Radio', created=START)
+        service = Service()
+        service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe))
+        service.names.append(ShortName('Capital'))
+        info.services.append(service)
+        raw = unmarshall(marshall(info, ensemble=Ensemble(0xe1, 0xcfff)).tobytes(), raw=True)
+        self.assertEqual((raw['created'], raw['originator'], raw['ensemble']['id']), (1398405600, 'Global Radio', (0xe1, 0xcfff)))
+        self.assertEqual(raw['ensemble']['services'], [{'version' : None, 'bearers' : [(0xe1, 0xcfff, 0xc0fe, 0, None)], 'names' : [('short', 'Capital', None)],
+                                                        'descriptions' : [], 'media' : [], 'genres' : [], 'keywords' : [], 'memberships' : [], 
+                                                        'links' : [], 'lookup' : None}])
+        info, ensemble = materialize(raw)
+        self.assertEqual((ensemble.ecc, ensemble.eid), (0xe1, 0xcfff))
+        self.assertEqual(str(info.services[0].bearers[0]), 'dab:ce1.cfff.c0fe.0')
+
+    def test_materialize_raw(self):
+        import datetime
+        def customise(programme, i):
+            programme.recommendation, programme.version = i == 1, 2
+            programme.names.append(LongName('Capital Breakfast %d' % i))
+            programme.names.append(ShortName('Brekkie', language='fr'))
+            programme.descriptions.append(ShortDescription('Capital Breakfast, every weekday'))
+            programme.descriptions.append(LongDescription('Capital Breakfast with Roman Kemp, every weekday', language='fr'))
+            programme.media.append(Multimedia('http://owdo.thisisglobal.com/%d/logo.png' % i, Multimedia.LOGO_COLOUR_SQUARE))
+            programme.media.append(Multimedia('http://owdo.thisisglobal.com/%d/big.png' % i, content='image/png', width=128, height=128))
+            programme.genres.append(Genre('urn:tva:metadata:cs:ContentCS:2002:3.6.8'))
+            programme.memberships.append(Membership('crid://www.capitalfm.com/4772', 4772, index=i))
+            programme.links.append(Link('mailto:breakfast@capitalfm.com', content='text/plain', description='Email the team!', expiry=START))
+            time = programme.locations[0].times[0]
+            time.actual_time, time.actual_duration = time.billed_time + datetime.timedelta(seconds=30), datetime.timedelta(minutes=59)
+            if i == 0: programme.locations[0].bearers[0] = DabBearer(0xe1, 0xc185, 0xc0de)
+            event = ProgrammeEvent('crid://thisisglobal.com/4772/%d/788946' % i, 788946 + i)
+            event.names.append(MediumName('No.1 Pun'))
+            event.locations.append(Location(times=[RelativeTime(datetime.timedelta(hours=3, minutes=10), datetime.timedelta(minutes=25))]))
+            event.locations[0].bearers.append(DabBearer(0xe1, 0xc185, 0xc0da))
+            event.links.append(Link('http://www.capitalfm.com/pun'))
+            programme.events.append(event)
+        schedule = make_schedule(shortcrid=100, customise=customise)
+        schedule.scope.end, schedule.originator = START + datetime.timedelta(days=1), 'Global Radio'
+        data = marshall(ProgrammeInfo(schedules=[schedule]), tokens=True).tobytes()
+        info = materialize(unmarshall(data, raw=True))
+        self.assertEqual(model_state(info.schedules[0].programmes), model_state(schedule.programmes))
+        self.assertEqual(model_state(info.schedules[0].scope), model_state(schedule.scope))
+        self.assertEqual((info.schedules[0].created, info.schedules[0].originator), (START, 'Global Radio'))
+
+        info = ServiceInfo(originator='Global Radio', provider='Global', created=START)
+        ensemble = Ensemble(0xe1, 0xc185)
+        ensemble.names.append(ShortName('Digital1'))
+        ensemble.descriptions.append(ShortDescription('London multiplex'))
+        for i in range(2):
+            service = Service(lookup=Lookup('www.capitalfm.com', 'london%d' % i))
+            service.bearers.append(DabBearer(0xe1, 0xc185, 0xc0da + i))
+            service.bearers.append(DabBearer(0xe1, 0xc185, 0xc0da + i, 1, xpad=3))
+            service.names.append(ShortName('Capital'))
+            service.names.append(LongName('Capital London %d' % i))
+            service.descriptions.append(ShortDescription("The UK's No.1 Hit Music Station"))
+            service.media.append(Multimedia('http://owdo.thisisglobal.com/2.0/id/25/logo/32x32.png', Multimedia.LOGO_COLOUR_SQUARE))
+            service.genres.append(Genre('urn:tva:metadata:cs:ContentCS:2004:3.6.10'))
+            service.keywords.extend(['London', 'music', 'pop'])
+            info.services.append(service)
+        decoded, decoded_ensemble = materialize(unmarshall(marshall(info, ensemble=ensemble, tokens=True).tobytes(), raw=True))
+        self.assertEqual(model_state(decoded.services), model_state(info.services))
+        self.assertEqual(model_state(decoded_ensemble), model_state(ensemble))
+        self.assertEqual((decoded.created, decoded.originator, decoded.provider), (START, 'Global Radio', 'Global'))
+
+    def test_unmarshall_mapped(self):
+        import io, mmap, os, tempfile
+        info = ServiceInfo(originator='Global Radio')
+        service = Service()
+        service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe))
+        service.names.append(ShortName('Capital'))
+        info.services.append(service)
+        data = marshall(info, ensemble=Ensemble(0xe1, 0xcfff)).tobytes()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'SI.bin')
+            with open(path, 'wb') as f: f.write(data)
+            with open(path, 'rb') as f:
+                sources = [path, f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), io.BytesIO(data), data]
+                for source in sources:
+                    si, _ = unmarshall(source)
+                    self.assertEqual(si.services[0].names[0].text, 'Capital')
+                self.assertEqual(f.tell(), len(data))
+
+    def test_attribute_registry(self):
+        element = Element(0x2b)
+        element.attributes.append(Attribute(0x83, Multimedia.LOGO_COLOUR_SQUARE))
+        element.attributes.append(Attribute(0x84, 32))
+        data = element.tobytes().tobytes()
+        self.assertEqual(data, b'\x2b\x07\x83\x01\x04\x84\x02\x00\x20')
+        decoded = Element.frombuffer(data)
+        self.assertEqual([(x.tag, x.value) for x in decoded.attributes],
+                         [(0x83, Multimedia.LOGO_COLOUR_SQUARE), (0x84, 32)])
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(ValueError):
+            Element(0x2b, attributes=[Attribute(0x86, 1)]).tobytes()
+        with self.assertRaises(ValueError):
+            Element.frombuffer(b'\x2b\x03\x86\x01\x01')
+
+    def test_timepoint_roundtrip(self):
+        import datetime, dateutil.tz
+        for timepoint in [datetime.datetime(2014, 4, 25, 23, 30, tzinfo=dateutil.tz.tzutc()),
+                          datetime.datetime(2014, 4, 25, 0, 50, 31, tzinfo=dateutil.tz.tzutc()),
+                          datetime.datetime(2014, 4, 25, 0, 30, tzinfo=dateutil.tz.tzoffset(None, 3600)),
+                          datetime.datetime(2014, 12, 31, 20, 0, 15, tzinfo=dateutil.tz.tzoffset(None, -18000))]:
+            decoded = decode_timepoint_bytes(encode_timepoint_bytes(timepoint))
+            self.assertEqual(decoded, timepoint)
+            self.assertEqual(decoded.utcoffset(), timepoint.utcoffset())
+        self.assertIsNone(decode_timepoint_bytes(b'\x00\x00\x00\x00'))
+
+    def test_decode_timepoints(self):
+        data = [b'\x37\x71\x01\x80', b'\x37\x71\x09\x80\x78\x00', b'\x37\x71\x11\x80\x02', b'\x00\x00\x00\x00']
+        self.assertEqual(decode_timepoints(data, epoch=True), [1398405600, 1398405630, 1398405600, None])
+        self.assertEqual(decode_timepoints(data)[0].isoformat(), '2014-04-25T06:00:00+00:00')
+
+    def test_trace_hook(self):
+        import spi.binary
+        events = []
+        set_trace_hook(events.append)
+        try:
+            Element.frombuffer(b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+        finally:
+            set_trace_hook(None)
+        self.assertEqual([(x.action, x.tag, x.offset, x.length) for x in events], 
+                         [('decode', 0x10, 7, 7), ('decode', 0x11, 14, 12), ('decode', 0x1c, 0, 26)])
+        self.assertIsNone(spi.binary.trace_hook)
+
+    def test_decode_schedule_scope(self):
+        import datetime, dateutil.tz
+        start = datetime.datetime(2014, 4, 25, 6, 0, tzinfo=dateutil.tz.tzutc())
+        schedule = Schedule(Scope(start, start + datetime.timedelta(days=1), [DabBearer(0xe1, 0xc185, 0xc0da)]), created=start)
+        decoded = parse_schedule(Element.frombuffer(build_schedule(schedule).tobytes().tobytes()))
+        self.assertEqual((decoded.scope.start, decoded.scope.end), (schedule.scope.start, schedule.scope.end))
+        self.assertEqual([str(x) for x in decoded.scope.bearers], ['dab:ce1.c185.c0da.0'])
+
+    def test_same_ensemble_bearer(self):
+        # content IDs without an ECC and EId are decoded as bearers without them, which encode the same
+        def customise(programme, i):
+            programme.locations[0].bearers.append(DabBearer(None, None, 0xc0db, 2))
+        info = ProgrammeInfo(schedules=[make_schedule(customise=customise)])
+        data = marshall(info).tobytes()
+        for decoded in (unmarshall(data), materialize(unmarshall(data, raw=True))):
+            bearers = decoded.schedules[0].programmes[0].locations[0].bearers
+            self.assertEqual([type(x) for x in bearers], [DabBearer, DabBearer])
+            self.assertEqual([(x.ecc, x.eid, x.sid, x.scids) for x in bearers], [(0xe1, 0xc185, 0xc0da, 0), (None, None, 0xc0db, 2)])
+            redecoded = unmarshall(marshall(decoded).tobytes()).schedules[0].programmes[0].locations[0].bearers
+            self.assertEqual([encode_bearer_bytes(x) for x in redecoded], [encode_bearer_bytes(x) for x in bearers])
+        with self.assertRaises(ValueError):
+            DabBearer(0xe1, None, 0xc0db)
+
+    def test_read_programme(self):
+        import datetime, os, tempfile
+        def customise(programme, i):
+            programme.names.append(LongName('Capital Breakfast with Roman Kemp %d' % i))
+            programme.descriptions.append(ShortDescription('Capital Breakfast with Roman Kemp, every weekday'))
+        schedule = make_schedule(5, shortcrid=100, customise=customise)
+        data = marshall(ProgrammeInfo(schedules=[schedule]), tokens=True).tobytes()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'PI.bin')
+            with open(path, 'wb') as f: f.write(data)
+            programme = read_programme(path, 103)
+            self.assertTrue(os.path.exists(path + INDEX_SUFFIX))
+            self.assertEqual(programme.shortcrid, 103)
+            self.assertEqual(programme.names[0].text, 'Capital Breakfast with Roman Kemp 3')
+            self.assertEqual(programme.descriptions[0].text, 'Capital Breakfast with Roman Kemp, every weekday')
+            self.assertEqual([str(x) for x in programme.locations[0].bearers], ['dab:ce1.c185.c0da.0'])
+            with self.assertRaises(ValueError):
+                read_programme(path, 99)
+
+            with open(path + INDEX_SUFFIX) as f: index = Index.load(f)
+            self.assertEqual(index.find('0x02/0x21/0x1c'), index.find((0x02, 0x21, 0x1c)))
+            self.assertEqual(len(index.find('0x02/0x21/0x1c')), 5)
+            offsets = index.find_programmes(START + datetime.timedelta(hours=1), START + datetime.timedelta(hours=3))
+            self.assertEqual(offsets, [index.find_programme(101), index.find_programme(102)])
+            offset, length = offsets[0]
+            self.assertEqual(Element.frombuffer(data[offset:offset + length]).get_attributes(0x81)[0].value, 101)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,294 @@
+import unittest
+
+from spi import *
+from spi.binary import *
+from spi.binary.test import START, make_schedule
+
+
+class Test(unittest.TestCase):
+
+
+    def test_element_header(self):
+        element = Element(0x10, cdata=CData('Capital'))
+        self.assertEqual(element.tobytes().tobytes(), b'\x10\x09\x01\x07Capital')
+
+    def test_extended_element_length(self):
+        element = Element(0x1b, cdata=CData('x' * 300))
+        data = element.tobytes().tobytes()
+        self.assertEqual(data[0:8], b'\x1b\xfe\x01\x30\x01\xfe\x01\x2c')
+        self.assertEqual(len(data), 308)
+        self.assertEqual(element.encoded_length(), 308)
+
+    def test_nested_elements(self):
+        element = Element(0x1c)
+        element.attributes.append(Attribute(0x81, 123456))
+        element.children.append(Element(0x10, cdata=CData('Pun')))
+        element.children.append(Element(0x11, cdata=CData('No.1 Pun')))
+        self.assertEqual(element.tobytes().tobytes(), 
+                         b'\x1c\x18\x81\x03\x01\xe2\x40\x10\x05\x01\x03Pun\x11\x0a\x01\x08No.1 Pun')
+
+    def test_streamed_element(self):
+        import io
+        element = StreamedElement(0x21)
+        element.attributes.append(Attribute(0x82, 'Global Radio'))
+        element.children.append(lambda: (Element(0x10, cdata=CData(x)) for x in ['Pun', 'Capital']))
+        expected = b'\x21\x20\x82\x0cGlobal Radio\x10\x05\x01\x03Pun\x10\x09\x01\x07Capital'
+        self.assertEqual(element.tobytes().tobytes(), expected)
+        out = io.BytesIO()
+        self.assertEqual(element.write(out), len(expected))
+        self.assertEqual(out.getvalue(), expected)
+
+    def test_marshall_to_file(self):
+        import io
+        info = ServiceInfo(originator='Global Radio')
+        service = Service()
+        service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe))
+        service.names.append(ShortName('Capital'))
+        info.services.append(service)
+        ensemble = Ensemble(0xe1, 0xcfff)
+        out = io.BytesIO()
+        written = marshall(info, ensemble=ensemble, out=out)
+        self.assertEqual(out.getvalue(), marshall(info, ensemble=ensemble).tobytes())
+        self.assertEqual(written, len(out.getvalue()))
+
+    def test_zero_length_element(self):
+        with self.assertRaises(ValueError):
+            Element(0x13).tobytes()
+
+    def test_token_table(self):
+        element = Element(0x02)
+        for i in range(3):
+            element.children.append(Element(0x12, cdata=CData('Capital Breakfast %d' % i)))
+        saving = tokenise(element)
+        self.assertEqual(element.tokens, {0x01: 'Capital Breakfast'})
+        self.assertEqual(element.children[0].cdata.value, '\x01 0')
+        self.assertEqual(element.tobytes().tobytes()[0:30], b'\x02\x2a\x04\x13\x01\x11Capital Breakfast\x12\x05\x01\x03\x01 0')
+        self.assertEqual(saving, 3 * 16 - 21)
+
+    def test_token_table_roundtrip(self):
+        info = ServiceInfo(originator='Global Radio')
+        for i in range(3):
+            service = Service()
+            service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe + i))
+            service.names.append(LongName('Capital London %d' % i))
+            info.services.append(service)
+        ensemble = Ensemble(0xe1, 0xcfff)
+        data = marshall(info, ensemble=ensemble, tokens=True).tobytes()
+        self.assertLess(len(data), len(marshall(info, ensemble=ensemble).tobytes()))
+        decoded, _ = unmarshall(data)
+        self.assertEqual([x.names[0].text for x in decoded.services], ['Capital London 0', 'Capital London 1', 'Capital London 2'])
+
+    def test_default_contentid(self):
+        import datetime
+        info = ProgrammeInfo(schedules=[make_schedule(step=datetime.timedelta(0))])
+        data = marshall(info).tobytes()
+        self.assertLess(len(data), len(marshall(info, default_contentid=False).tobytes()))
+        epg = Element.frombuffer(data)
+        self.assertEqual(epg.default_contentid, (0xe1, 0xc185, 0xc0da, 0, None))
+        locations = [c for p in epg.get_children(0x21)[0].get_children(0x1c) for c in p.get_children(0x19)]
+        self.assertEqual([len(x.get_children(0x2d)) for x in locations], [0, 0, 0])
+        self.assertEqual([str(x) for x in parse_location(locations[0]).bearers], ['dab:ce1.c185.c0da.0'])
+        for data in (data, marshall(info, default_contentid=False).tobytes()):
+            bearers = [b for p in unmarshall(data).schedules[0].programmes for l in p.locations for b in l.bearers]
+            self.assertEqual([(type(x), str(x)) for x in bearers], [(DabBearer, 'dab:ce1.c185.c0da.0')] * 3)
+            bearers = [b for p in materialize(unmarshall(data, raw=True)).schedules[0].programmes for l in p.locations for b in l.bearers]
+            self.assertEqual([(type(x), str(x)) for x in bearers], [(DabBearer, 'dab:ce1.c185.c0da.0')] * 3)
+
+    def test_encode_timepoint(self):
+        import datetime
+        self.assertEqual(encode_timepoint_bytes(datetime.datetime(2014, 4, 25, 6, 0)), b'\x37\x71\x01\x80')
+        self.assertEqual(encode_timepoint_bytes(datetime.datetime(2014, 4, 25, 6, 0, 30)), b'\x37\x71\x09\x80\x78\x00')
+        bst = datetime.timezone(datetime.timedelta(hours=1))
+        self.assertEqual(encode_timepoint_bytes(datetime.datetime(2014, 4, 25, 7, 0, tzinfo=bst)), b'\x37\x71\x11\x80\x02')
+        self.assertEqual(encode_timepoints([1398405600, 1398405630]), [b'\x37\x71\x01\x80', b'\x37\x71\x09\x80\x78\x00'])
+
+    def test_field_primitives(self):
+        self.assertEqual(pack_fields((0, 1), (1, 1), (0, 2), (3, 4), (0xe1, 8)), b'\x43\xe1')
+        self.assertEqual(unpack_fields(b'\x43\xe1', 1, 1, 2, 4, 8), (0, 1, 0, 3, 0xe1))
+        self.assertEqual(pack_number(0x1c0da, 16), b'\xc0\xda')
+        self.assertEqual(encode_number(5, 3).to01(), '101')
+        with self.assertRaises(ValueError):
+            pack_fields((1, 3))
+        bearer = DabBearer(0xe1, 0xc185, 0xc0da, 3, xpad=0x1f)
+        self.assertEqual(encode_bearer_bytes(bearer), b'\x63\xe1\xc1\x85\xc0\xda\x1f')
+        self.assertEqual(encode_bearer(bearer).tobytes(), encode_bearer_bytes(bearer))
+        self.assertEqual(decode_contentid_bytes(encode_bearer_bytes(bearer)), (0xe1, 0xc185, 0xc0da, 3, 0x1f))
+        self.assertEqual(encode_ensembleid_bytes((0xe1, 0xc479)), b'\xe1\xc4\x79')
+        self.assertEqual(decode_ensembleid_bytes(b'\xe1\xc4\x79'), (0xe1, 0xc479))
+        # without an ECC and EId, a content ID is three bytes long like an ensemble ID
+        self.assertEqual(decode_contentid_bytes(b'\x02\xc0\xda'), (None, None, 0xc0da, 2, None))
+        self.assertEqual(attribute_decoders[(0x2d, 0x80)](b'\x02\xc0\xda'), (None, None, 0xc0da, 2, None))
+        self.assertEqual(attribute_decoders[(0x26, 0x80)](b'\xe1\xc4\x79'), (0xe1, 0xc479))
+        self.assertEqual(encode_genre_bytes(Genre('urn:tva:metadata:cs:ContentCS:2002:3.6.8')), b'\x03\x03\x06\x08')
+        self.assertEqual(decode_tokentable_bytes(encode_tokentable({0x01: 'Capital', 0x02: 'London'})), {0x01: 'Capital', 0x02: 'London'})
+
+    def test_marshall_workers(self):
+        info = ServiceInfo(originator='Global Radio')
+        for i in range(5):
+            service = Service()
+            service.bearers.append(DabBearer(0xe1, 0xcfff, 0xc0fe + i))
+            service.names.append(ShortName('Capital'))
+            service.names.append(LongName('Capital London %d' % i))
+            info.services.append(service)
+        ensemble = Ensemble(0xe1, 0xcfff)
+        self.assertEqual(marshall(info, ensemble=ensemble, workers=2).tobytes(), marshall(info, ensemble=ensemble).tobytes())
+        self.assertEqual(marshall(info, ensemble=ensemble, workers=2, tokens=True).tobytes(), 
+                         marshall(info, ensemble=ensemble, tokens=True).tobytes())
+
+    def test_marshall_ensembles(self):
+        info = ServiceInfo(originator='Global Radio')
+        for i in range(4):
+            service = Service()
+            service.bearers.append(DabBearer(0xe1, 0xc479, 0xc0fe + i))
+            service.bearers.append(DabBearer(0xe1, 0xc1c8 + i % 2, 0xc0fe + i))
+            service.names.append(LongName('Capital London %d' % i))
+            info.services.append(service)
+        self.assertEqual(list(group_services(info.services)), [(0xe1, 0xc479), (0xe1, 0xc1c8), (0xe1, 0xc1c9)])
+        for tokens in (False, True):
+            documents = marshall_ensembles(info, tokens=tokens)
+            self.assertEqual([str(x) for x, _ in documents], ['e1.c479', 'e1.c1c8', 'e1.c1c9'])
+            for ensemble, data in documents:
+                single = ServiceInfo(originator='Global Radio', created=info.created)
+                single.services = [x for x in info.services if (ensemble.ecc, ensemble.eid) in [(b.ecc, b.eid) for b in x.bearers]]
+                self.assertEqual(data.tobytes(), marshall(single, ensemble=ensemble, tokens=tokens).tobytes())
+        self.assertEqual([x.tobytes() for _, x in marshall_ensembles(info, tokens=True, workers=2)], [x.tobytes() for _, x in documents])
+
+    def test_fragment_cache(self):
+        import datetime, dateutil.tz
+        schedule = make_schedule(step=datetime.timedelta(0), contentid=None,
+                                 customise=lambda programme, i: programme.names.append(ShortName('Show %d' % i)))
+        info = ProgrammeInfo(schedules=[schedule])
+        cache = FragmentCache(maxsize=10)
+        self.assertEqual(marshall(info, cache=cache).tobytes(), marshall(info).tobytes())
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 3, 3))
+        schedule.programmes[1].names[0].text = 'Changed'
+        self.assertEqual(marshall(info, cache=cache).tobytes(), marshall(info).tobytes())
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (2, 4, 4))
+        cache = FragmentCache(maxsize=2)
+        marshall(info, cache=cache)
+        self.assertEqual(len(cache), 2)
+        # the same content with other time zone instances and without shared objects is found
+        cache = FragmentCache()
+        marshall(info, cache=cache)
+        copied = make_schedule(start=START.replace(tzinfo=dateutil.tz.tzutc()), step=datetime.timedelta(0), contentid=None,
+                               customise=lambda programme, i: programme.names.append(ShortName('Changed' if i == 1 else 'Show %d' % i)))
+        self.assertEqual(FragmentCache.fingerprint(copied.programmes[0]), FragmentCache.fingerprint(schedule.programmes[0]))
+        self.assertEqual(marshall(ProgrammeInfo(schedules=[copied]), cache=cache).tobytes(), marshall(info).tobytes())
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+    def test_estimate_size(self):
+        import datetime
+        def customise(programme, i):
+            programme.names.append(ShortName('Show %d' % i))
+            programme.descriptions.append(LongDescription('x' * 100 * i))
+            programme.genres.append(Genre('urn:tva:metadata:cs:ContentCS:2002:3.6.8'))
+        schedule = make_schedule(step=datetime.timedelta(seconds=30), customise=customise)
+        info = ProgrammeInfo(schedules=[schedule])
+        for kwargs in ({'tokens': True}, {}, {'default_contentid': False}):
+            estimate = estimate_size(info, **kwargs)
+            self.assertEqual(estimate.size, len(marshall(info, **kwargs).tobytes()))
+        schedule_estimate = estimate.children[1]
+        self.assertEqual(schedule_estimate.tag, 0x21)
+        self.assertEqual([x.size for x in schedule_estimate.children if x.tag == 0x1c],
+                         [len(build_programme(x).tobytes().tobytes()) for x in schedule.programmes])
+        self.assertEqual(estimate_size(schedule.programmes[2]).size, len(build_programme(schedule.programmes[2]).tobytes().tobytes()))
+
+        # sized from the model the same as from the elements built, for everything a programme encodes
+        def customise(programme, i):
+            programme.version, programme.recommendation = i + 1, i == 1
+            programme.names.append(LongName('Capital Breakfast %d' % i, language='fr'))
+            programme.descriptions.append(ShortDescription('Capital Breakfast, every weekday'))
+            programme.media.append(Multimedia('http://owdo.thisisglobal.com/%d/big.png' % i, content='image/png', width=128, height=128))
+            programme.media.append(Multimedia('http://owdo.thisisglobal.com/%d/logo.png' % i, Multimedia.LOGO_COLOUR_SQUARE))
+            programme.memberships.append(Membership('crid://www.capitalfm.com/4772', 4772, index=i))
+            programme.links.append(Link('mailto:breakfast@capitalfm.com', content='text/plain', description='Email the team!', expiry=START))
+            time = programme.locations[0].times[0]
+            time.actual_time, time.actual_duration = time.billed_time, datetime.timedelta(minutes=59)
+            if i == 2: programme.locations[0].bearers.append(DabBearer(0xe1, 0xc185, 0xc0de))
+            event = ProgrammeEvent('crid://thisisglobal.com/4772/%d/788946' % i, 788946 + i, version=2)
+            event.names.append(MediumName('No.1 Pun'))
+            event.locations.append(Location(times=[RelativeTime(datetime.timedelta(hours=3), datetime.timedelta(minutes=25), 
+                                                                 datetime.timedelta(hours=3, minutes=1))]))
+            event.locations[0].bearers.append(DabBearer(0xe1, 0xc185, 0xc0da))
+            event.links.append(Link('http://www.capitalfm.com/pun'))
+            programme.events.append(event)
+        info = ProgrammeInfo(schedules=[make_schedule(customise=customise), make_schedule(contentid=(0xe1, 0xc186, 0xc0db), customise=customise)])
+        for default_contentid in (True, False):
+            sizes = {}
+            estimate = estimate_size(info, default_contentid=default_contentid, sizes=sizes)
+            self.assertEqual(estimate, measure(build_programmeinfo(info, default_contentid=default_contentid)))
+            self.assertEqual(estimate.size, len(marshall(info, default_contentid=default_contentid).tobytes()))
+            self.assertEqual(len(sizes), 6)
+            self.assertEqual(estimate_size(info, default_contentid=default_contentid, sizes=sizes), estimate)
+
+    def test_size_report(self):
+        import datetime, io
+        def customise(programme, i):
+            programme.names.append(ShortName('Show %d' % i))
+            programme.descriptions.append(LongDescription('x' * 300))
+        info = ProgrammeInfo(schedules=[make_schedule(step=datetime.timedelta(0), contentid=None, customise=customise)])
+        data, report = marshall(info, report=True)
+        self.assertEqual(data.tobytes(), marshall(info).tobytes())
+        self.assertEqual(report.size, len(data.tobytes()))
+        self.assertEqual(report.elements[0x1c][0], 3)
+        self.assertEqual(report.attributes[(0x1c, 0x81)], [3, 15, 6])
+        self.assertEqual(report.types['timepoint'][0], 6)
+        self.assertEqual(report.types['cdata'], [6, 3 * 304 + 3 * 8, 3 * 4 + 3 * 2])
+        self.assertEqual(report.extended_header_bytes, 2 * (3 * 4 + 2)) # CData, descriptions, media groups, programmes, schedule and epg
+        out = io.BytesIO()
+        written, streamed_report = marshall(info, out=out, report=True, workers=2)
+        self.assertEqual(written, report.size)
+        self.assertEqual((streamed_report.elements, streamed_report.attributes, streamed_report.types),
+                         (report.elements, report.attributes, report.types))
+
+    def test_compact_profile(self):
+        import datetime, dateutil.tz
+        def customise(programme, i):
+            programme.names.append(ShortName('Show %d' % i))
+            time = programme.locations[0].times[0]
+            time.actual_time, time.actual_duration = time.billed_time, time.billed_duration
+        start = datetime.datetime(2014, 4, 25, 6, 0, 0, tzinfo=dateutil.tz.tzoffset(None, 3600))
+        schedule = make_schedule(start=start, contentid=None, customise=customise)
+        info = ProgrammeInfo(schedules=[schedule])
+        default = marshall(info).tobytes()
+        data, report = marshall(info, profile='compact', report=True)
+        data = data.tobytes()
+        self.assertEqual(report.savings, {'version': 3 * 4, 'actual_time': 3 * 11})
+        self.assertLessEqual(len(data), len(default) - sum(report.savings.values()))
+        self.assertEqual(schedule.programmes[0].version, 1) # not changed
+        self.assertEqual(marshall(info).tobytes(), default)
+        decoded = unmarshall(data)
+        self.assertEqual([(x.crid, x.shortcrid) for x in decoded.schedules[0].programmes], 
+                         [(x.crid, x.shortcrid) for x in schedule.programmes])
+        self.assertEqual([x.locations[0].times[0].billed_time for x in decoded.schedules[0].programmes],
+                         [x.locations[0].times[0].billed_time for x in schedule.programmes])
+        self.assertEqual(decoded.schedules[0].programmes[0].locations[0].times[0].billed_time.utcoffset(), datetime.timedelta(hours=1))
+        with self.assertRaises(ValueError):
+            marshall(info, profile='tiny')
+
+    def test_split_programmeinfo(self):
+        import datetime
+        def customise(programme, i):
+            programme.names.append(LongName('Capital Breakfast %d' % i))
+            if i == 0: programme.locations[0].times[0].billed_duration = datetime.timedelta(hours=6) # overruns the next parts
+        info = ProgrammeInfo(schedules=[make_schedule(10, contentid=None, customise=customise)])
+        parts = split_programmeinfo(info, 200)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(len(x.data.tobytes()) <= 200 for x in parts))
+        self.assertEqual(parts[0].start, START)
+        self.assertEqual(parts[-1].end, START + datetime.timedelta(hours=10))
+        self.assertEqual([x.end for x in parts[:-1]], [x.start for x in parts[1:]])
+        self.assertTrue(all(x.start < x.end for x in parts))
+        counts = []
+        for part in parts:
+            schedule_element = Element.frombuffer(part.data.tobytes()).get_children(0x21)[0]
+            counts.append(len(schedule_element.get_children(0x1c)))
+            scope_element = schedule_element.get_children(0x24)[0]
+            self.assertEqual([x.value for x in scope_element.attributes], [part.start, part.end])
+        self.assertEqual(sum(counts), 10)
+        with self.assertRaises(ValueError):
+            split_programmeinfo(info, 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
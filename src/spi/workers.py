@@ -0,0 +1,35 @@
+#===============================================================================
+# Python Hybrid Radio SPI - API to support ETSI TS 102 818
+# 
+# Copyright (C) 2015, Ben Poor
+# 
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+# 
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#===============================================================================
+
+import concurrent.futures
+import contextlib
+
+@contextlib.contextmanager
+def worker_pool(workers):
+    """provides a pool of worker processes to build and encode programmes and services in, or 
+       None if no workers are requested"""
+    if not workers:
+        yield None
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        yield pool
+
+"""Number of programmes or services sent to a worker process at a time"""
+FRAGMENT_CHUNKSIZE = 32
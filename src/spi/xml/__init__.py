@@ -19,10 +19,12 @@
 #===============================================================================
 
 from spi import *
+import io
 import xml.dom.minidom
 import isodate
 from xml.dom import XML_NAMESPACE
 from urllib.parse import urlparse
+from spi.workers import worker_pool, FRAGMENT_CHUNKSIZE
 import logging
 
 SCHEMA_NS = 'http://www.worlddab.org/schemas/spi/31'
@@ -46,6 +48,15 @@ class UnmarshallListener:
 def marshall(obj, listener=MarshallListener(), indent=None, **kwargs):
     """
     Marshalls a :class:ProgrammeInfo, :class:GroupInfo or :class:ServiceInfo to its XML document
+
+    :param workers: Number of worker processes to build the programmes or services of a 
+                    :class:ProgrammeInfo or :class:ServiceInfo in. Each is written out as text
+                    in its worker, which is spliced into the document in the original order as a
+                    :class:FragmentText. The document is the same as when built in this process,
+                    though the listener is then notified of the elements of each programme or 
+                    service in the worker processes, and of the spliced text in place of each
+                    programme element
+    :type workers: int
     """
     
     if isinstance(obj, ServiceInfo): return marshall_serviceinfo(obj, listener=listener, indent=indent, **kwargs)
@@ -53,13 +64,14 @@ def marshall(obj, listener=MarshallListener(), indent=None, **kwargs):
     elif isinstance(obj, GroupInfo): return marshall_groupinfo(obj, listener=listener, indent=indent, **kwargs)
     else: raise ValueError('Captain SPI says: neither a ServiceInfo, ProgrammeInfo not GroupInfo be')
     
-def marshall_serviceinfo(info, listener=MarshallListener(), indent=None, **kwargs):
+def marshall_serviceinfo(info, listener=MarshallListener(), indent=None, workers=None, **kwargs):
     """
     Encodes a ServiceInfo object into XML
     
     :info: object to encode
     :listener: Observer notified when an element is created
     :indent: Characters to use for XML indentation
+    :workers: Number of worker processes to build services in
     """
     
 
@@ -107,46 +119,13 @@ def marshall_serviceinfo(info, listener=MarshallListener(), indent=None, **kwarg
         services_element.appendChild(provider_element)
          
     # service
-    for service in info.services:
-        service_element = doc.createElement('service')
-        if service.version > 1: service_element.setAttribute('version', str(service.version))
-        # names
-        for name in service.names:
-            service_element.appendChild(build_name(doc, name, listener))
-        # descriptions
-        for description in service.descriptions:
-            service_element.appendChild(build_description(doc, description, listener))
-        # media
-        for media in service.media:
-            service_element.appendChild(build_mediagroup(doc, media, listener)) 
-        # genre
-        for genre in service.genres:
-            service_element.appendChild(build_genre(doc, genre, listener))    
-        # links
-        for link in service.links:
-            service_element.appendChild(build_link(doc, link, listener))                    
-        # keywords
-        if len(service.keywords) > 0:
-            keywords_element = doc.createElement('keywords')
-            keywords_element.appendChild(doc.createCDATASection(', '.join(service.keywords)))
-            listener.on_element(doc, service.keywords, keywords_element)
-            service_element.appendChild(keywords_element)
-        # bearers
-        for bearer in service.bearers:
-            service_element.appendChild(build_bearer(doc, bearer, listener))
-        # lookup
-        if service.lookup:
-            lookup_element = doc.createElement('radiodns')
-            lookup_element.setAttribute('fqdn', service.lookup.fqdn)
-            lookup_element.setAttribute('serviceIdentifier', service.lookup.serviceIdentifier)
-            listener.on_element(doc, service.lookup, lookup_element)
-            service_element.appendChild(lookup_element)
-        # geolocation
-        if len(service.geolocations) > 0:
-            service_element.appendChild(build_geolocation(doc, service.geolocations, listener))            
-            
-        listener.on_element(doc, service, service_element)
-        services_element.appendChild(service_element)
+    with worker_pool(workers) as pool:
+        if pool is not None: 
+            service_elements = build_fragments(doc, pool, info.services, listener, fragment_layout(indent or '\t', 2))
+        else:
+            service_elements = (build_service(doc, service, listener) for service in info.services)
+        for service_element in service_elements:
+            services_element.appendChild(service_element)
             
     listener.on_element(doc, info.services, services_element)
     root.appendChild(services_element)
@@ -159,13 +138,14 @@ def marshall_serviceinfo(info, listener=MarshallListener(), indent=None, **kwarg
     else:
         return doc.toprettyxml()
 
-def marshall_programmeinfo(info, listener=MarshallListener(), indent=None):
+def marshall_programmeinfo(info, listener=MarshallListener(), indent=None, workers=None):
     """
     Encodes a ProgrammeInfo object into XML
     
     :info: object to encode
     :listener: Observer notified when an element is created
     :indent: Characters to use for XML indentation
+    :workers: Number of worker processes to build programmes in
     """
     
     doc = xml.dom.minidom.Document()
@@ -181,10 +161,11 @@ def marshall_programmeinfo(info, listener=MarshallListener(), indent=None):
     epg_element.setAttribute('xml:lang', 'en')
     
     # schedule
-    for schedule in info.schedules:
-        schedule_element = build_schedule(doc, schedule, listener)
-        listener.on_element(doc, schedule_element, epg_element)
-        epg_element.appendChild(schedule_element)
+    with worker_pool(workers) as pool:
+        for schedule in info.schedules:
+            schedule_element = build_schedule(doc, schedule, listener, pool=pool, layout=fragment_layout(indent, 2))
+            listener.on_element(doc, schedule_element, epg_element)
+            epg_element.appendChild(schedule_element)
 
     listener.on_element(doc, info, epg_element)
         
@@ -193,7 +174,45 @@ def marshall_programmeinfo(info, listener=MarshallListener(), indent=None):
     else:
         return doc.toxml()        
         
-def build_schedule(doc, schedule, listener):
+class FragmentText(xml.dom.minidom.Text):
+    """
+    The XML of an element built and written out in a worker process, which is written into the 
+    document as it is
+    """
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        writer.write(self.data)
+
+def fragment_layout(indent, depth):
+    """returns the (indent, addindent, newl) an element at the given depth below the root is 
+       written out with, for the indentation the document is written out with, if any"""
+    if indent: return (indent * depth, indent, '\n')
+    else: return ('', '', '')
+
+def build_fragment(args):
+    """builds the element of a programme or service in its own document and writes it out with
+       the given (indent, addindent, newl) layout, returning the text to be spliced into the 
+       document being marshalled. This is run in a worker process"""
+
+    obj, listener, layout = args
+    doc = xml.dom.minidom.Document()
+    if isinstance(obj, Programme): element = build_programme(doc, obj, listener)
+    elif isinstance(obj, Service): element = build_service(doc, obj, listener)
+    else: raise ValueError('cannot build fragment from: %s' % obj)
+    writer = io.StringIO()
+    element.writexml(writer, *layout)
+    return writer.getvalue()
+
+def build_fragments(doc, pool, objects, listener, layout):
+    """builds the elements of programmes or services in a pool of worker processes, returning 
+       the text of each as a node of the document, in the same order"""
+    for text in pool.map(build_fragment, [(x, listener, layout) for x in objects], chunksize=FRAGMENT_CHUNKSIZE):
+        node = FragmentText()
+        node.data = text
+        node.ownerDocument = doc
+        yield node
+
+def build_schedule(doc, schedule, listener, pool=None, layout=('', '', '')):
     
     schedule_element = doc.createElement('schedule')
     if schedule.version > 1: schedule_element.setAttribute('version', str(schedule.version))
@@ -211,13 +230,58 @@ def build_schedule(doc, schedule, listener):
     schedule_element.appendChild(scope_element)
     
     # programmes
-    for programme in schedule.programmes:
-        programme_element = build_programme(doc, programme, listener)
+    if pool is not None:
+        programme_elements = build_fragments(doc, pool, schedule.programmes, listener, layout)
+    else:
+        programme_elements = (build_programme(doc, programme, listener) for programme in schedule.programmes)
+    for programme_element in programme_elements:
         listener.on_element(doc, programme_element, schedule_element)
         schedule_element.appendChild(programme_element)
 
     return schedule_element
 
+def build_service(doc, service, listener):
+    service_element = doc.createElement('service')
+    if service.version > 1: service_element.setAttribute('version', str(service.version))
+    # names
+    for name in service.names:
+        service_element.appendChild(build_name(doc, name, listener))
+    # descriptions
+    for description in service.descriptions:
+        service_element.appendChild(build_description(doc, description, listener))
+    # media
+    for media in service.media:
+        service_element.appendChild(build_mediagroup(doc, media, listener)) 
+    # genre
+    for genre in service.genres:
+        service_element.appendChild(build_genre(doc, genre, listener))    
+    # links
+    for link in service.links:
+        service_element.appendChild(build_link(doc, link, listener))                    
+    # keywords
+    if len(service.keywords) > 0:
+        keywords_element = doc.createElement('keywords')
+        keywords_element.appendChild(doc.createCDATASection(', '.join(service.keywords)))
+        listener.on_element(doc, service.keywords, keywords_element)
+        service_element.appendChild(keywords_element)
+    # bearers
+    for bearer in service.bearers:
+        service_element.appendChild(build_bearer(doc, bearer, listener))
+    # lookup
+    if service.lookup:
+        lookup_element = doc.createElement('radiodns')
+        lookup_element.setAttribute('fqdn', service.lookup.fqdn)
+        lookup_element.setAttribute('serviceIdentifier', service.lookup.serviceIdentifier)
+        listener.on_element(doc, service.lookup, lookup_element)
+        service_element.appendChild(lookup_element)
+    # geolocation
+    if len(service.geolocations) > 0:
+        service_element.appendChild(build_geolocation(doc, service.geolocations, listener))            
+        
+    listener.on_element(doc, service, service_element)
+
+    return service_element
+
 def build_programme(doc, programme, listener):
     programme_element = doc.createElement('programme')
     programme_element.setAttribute('shortId', str(programme.shortcrid))
@@ -560,11 +624,11 @@ def parse_bearer(bearer_element, listener):
         elif uri.startswith('fm'):
             bearer = FmBearer.fromstring(uri) 
         elif uri.startswith('http'):
-            bearer = IpBearer(uri)
+            bearer = IpBearer(uri, None)
         else:
             raise ValueError('bearer %s not recognised' % uri)
     except:
-        bearer = IpBearer("http://null/")
+        bearer = IpBearer("http://null/", None)
         logger.debug('bearer %s is malformed', uri)
 
     if 'cost' in bearer_element.attrib:
@@ -732,8 +796,7 @@ def parse_service(service_element, listener):
 
     # bearers
     for child in service_element.findall("spi:bearer", namespaces):
-        if child.attrib.has_key("id"): service.bearers.append(parse_bearer(child))
-        service.bearers.append(parse_bearer(child, listener))
+        if "id" in child.attrib: service.bearers.append(parse_bearer(child, listener))
 
     # media
     for media_element in service_element.findall("spi:mediaDescription", namespaces): 
@@ -750,7 +813,7 @@ def parse_service(service_element, listener):
 
     # links
     for child in service_element.findall("spi:link", namespaces):
-        if child.attrib.has_key("uri"): service.links.append(parse_link(child))
+        if "uri" in child.attrib: service.links.append(parse_link(child))
 
     # keywords
     for child in service_element.findall("spi:keywords", namespaces): 
@@ -40,6 +40,25 @@ class Test(unittest.TestCase):
         
         from spi.xml import marshall as marshall_xml
         print(marshall_xml(info, indent='   ')) # all this tests right now is the ability to render
+
+    def test_parallel_marshall(self):
+        start = datetime.datetime(2014, 11, 14, 6, 0, 0)
+        schedule = Schedule(Scope(start, start + datetime.timedelta(hours=4)))
+        for i in range(4):
+            programme = Programme("crid://example.com/programme/%d" % i, i + 1)
+            programme.names.append(MediumName('Show %d' % i))
+            location = Location()
+            location.times.append(Time(start + datetime.timedelta(hours=i), datetime.timedelta(hours=1)))
+            programme.locations.append(location)
+            schedule.programmes.append(programme)
+        info = ProgrammeInfo()
+        info.schedules.append(schedule)
+
+        from spi.xml import marshall as marshall_xml
+        self.assertEqual(marshall_xml(info, workers=2), marshall_xml(info))
+        self.assertEqual(marshall_xml(info, indent='   ', workers=2), marshall_xml(info, indent='   '))
+        with self.assertRaises(TypeError):
+            marshall_xml(info, worker=2)
      
 
 if __name__ == "__main__":